@@ -0,0 +1,176 @@
+"""
+MessagePack 編碼/解碼效能測試。
+
+對多種代表性資料（深層巢狀 map、寬 map、小整數長陣列、長 UTF-8 字串、
+大型二進位資料、大量 ext）量測各種編碼/解碼方式的 ops/s、MB/s，
+以及 tracemalloc 量到的每個物件配置區塊數與峰值記憶體。
+結果可存成基準 JSON，之後比較時若效能退步超過門檻即以非零狀態結束。
+
+    python bench.py                       # 執行並列出結果
+    python bench.py --save baseline.json  # 存成基準
+    python bench.py --baseline baseline.json --threshold 0.15
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import msgpack_lib
+
+# ---- 測試資料 ----
+
+def nested_maps(scale):
+    depth = 6
+    def build(level):
+        if level == depth:
+            return {"id": level, "name": "leaf", "ok": True}
+        return {"k%d" % i: build(level + 1) for i in range(4)}
+    return [build(0) for _ in range(max(1, int(2 * scale)))]
+
+def wide_maps(scale):
+    return {"field_%d" % i: i for i in range(int(20000 * scale))}
+
+def small_int_array(scale):
+    return [i % 200 - 60 for i in range(int(200000 * scale))]
+
+def utf8_strings(scale):
+    return ["訊息 %d：MessagePack 字串 ünïcødé " % i * 20 for i in range(int(2000 * scale))]
+
+def large_binaries(scale):
+    return [bytes(range(256)) * 4096 for _ in range(max(1, int(8 * scale)))]
+
+def ext_heavy(scale):
+    return [msgpack_lib.Ext(i % 64, b"\x01" * (i % 40)) for i in range(int(50000 * scale))]
+
+CORPORA = {
+    "nested_maps": nested_maps,
+    "wide_maps": wide_maps,
+    "small_int_array": small_int_array,
+    "utf8_strings": utf8_strings,
+    "large_binaries": large_binaries,
+    "ext_heavy": ext_heavy,
+}
+
+# ---- 測試項目：case(obj, packed) 回傳要量測的函式 ----
+
+CASES = {
+    "pack": lambda obj, packed: lambda: msgpack_lib.pack(obj),
+    "unpack": lambda obj, packed: lambda: msgpack_lib.unpack(packed),
+    "unpack_zero_copy": lambda obj, packed: lambda: msgpack_lib.unpack(packed, zero_copy=True),
+    "unpack_key_cache": lambda obj, packed: (lambda cache: lambda: msgpack_lib.unpack(packed, key_cache=cache))(
+        msgpack_lib.KeyCache()),
+    "skip": lambda obj, packed: lambda: msgpack_lib.skip(packed),
+}
+
+def count_objects(obj):
+    """計算物件樹中的值個數（容器本身也算一個）"""
+    count = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        count += 1
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return count
+
+def measure(fn, repeat, min_time):
+    """回傳每次呼叫的最短平均秒數；每輪至少執行 min_time 秒"""
+    best = float("inf")
+    for _ in range(repeat):
+        n = 0
+        start = time.perf_counter()
+        while True:
+            fn()
+            n += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / n)
+    return best
+
+def measure_allocations(fn):
+    """以 tracemalloc 量測一次呼叫後仍存活的配置區塊數與峰值記憶體"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return max(blocks, 0), peak
+
+def run(corpora=None, cases=None, scale=1.0, repeat=3, min_time=0.2, log=None):
+    """
+    執行效能測試，回傳 {"<corpus>/<case>": {...}}。
+    每項包含 ops_per_sec、mb_per_sec（以編碼後大小計）、allocs_per_object 與 peak_bytes。
+    """
+    results = {}
+    for corpus_name in corpora or CORPORA:
+        obj = CORPORA[corpus_name](scale)
+        packed = msgpack_lib.pack(obj)
+        objects = count_objects(obj)
+        for case_name in cases or CASES:
+            fn = CASES[case_name](obj, packed)
+            seconds = measure(fn, repeat, min_time)
+            blocks, peak = measure_allocations(fn)
+            key = "%s/%s" % (corpus_name, case_name)
+            results[key] = {
+                "ops_per_sec": 1.0 / seconds,
+                "mb_per_sec": len(packed) / seconds / (1024 * 1024),
+                "allocs_per_object": blocks / objects,
+                "peak_bytes": peak,
+            }
+            if log is not None:
+                log(format_result(key, results[key]))
+    return results
+
+def format_result(key, r):
+    return "%-36s %12.1f ops/s %10.2f MB/s %8.2f allocs/obj %10.1f KB peak" % (
+        key, r["ops_per_sec"], r["mb_per_sec"], r["allocs_per_object"], r["peak_bytes"] / 1024)
+
+def compare(results, baseline, threshold):
+    """回傳 ops/s 比基準下降超過 threshold（比例）的項目：[(key, 基準, 目前)]"""
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if r["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append((key, base["ops_per_sec"], r["ops_per_sec"]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MessagePack 編碼/解碼效能測試")
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA), help="只測試指定的資料（可重複指定）")
+    parser.add_argument("--case", action="append", choices=sorted(CASES), help="只測試指定的項目（可重複指定）")
+    parser.add_argument("--scale", type=float, default=1.0, help="資料量倍數（預設 1.0）")
+    parser.add_argument("--repeat", type=int, default=3, help="每項重複次數，取最佳值（預設 3）")
+    parser.add_argument("--save", help="將結果存成基準 JSON 檔")
+    parser.add_argument("--baseline", help="與基準 JSON 檔比較")
+    parser.add_argument("--threshold", type=float, default=0.10, help="允許的 ops/s 下降比例（預設 0.10）")
+    args = parser.parse_args(argv)
+
+    results = run(args.corpus, args.case, args.scale, args.repeat, log=print)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for key, base, current in regressions:
+            print("效能退步：%s %.1f -> %.1f ops/s (%.1f%%)" % (
+                key, base, current, (current / base - 1) * 100), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,38 +1,246 @@
 import sys
 import json
+import time
 import argparse
 import binascii
 import msgpack_lib
 
+# 串流模式每次讀取與寫出的區塊大小
+CHUNK_SIZE = 64 * 1024
+
+class Progress:
+    """於 stderr 定期回報已處理的筆數、資料量與速度"""
+    def __init__(self, enabled, interval=1.0):
+        self.enabled = enabled
+        self.interval = interval
+        self.records = 0
+        self.bytes = 0
+        self._start = self._last = time.monotonic()
+
+    def update(self, records, nbytes):
+        self.records += records
+        self.bytes += nbytes
+        if self.enabled:
+            now = time.monotonic()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._report(now)
+
+    def finish(self):
+        if self.enabled:
+            self._report(time.monotonic(), final=True)
+
+    def _report(self, now, final=False):
+        elapsed = max(now - self._start, 1e-9)
+        mb = self.bytes / (1024 * 1024)
+        print("%s %d 筆，%.1f MB，%.1f MB/s，%.0f 筆/s" % (
+            "完成：" if final else "進度：", self.records, mb, mb / elapsed, self.records / elapsed),
+            file=sys.stderr)
+
+def open_input(args, binary):
+    """回傳輸入的檔案物件：--input 指定的檔案或 stdin（'-'）"""
+    if args.input in (None, "-"):
+        return sys.stdin.buffer if binary else sys.stdin
+    if binary:
+        return open(args.input, "rb")
+    return open(args.input, "r", encoding="utf-8")
+
+def open_output(args, binary):
+    """回傳輸出的檔案物件：--output 指定的檔案或 stdout（'-'）"""
+    if args.output in (None, "-"):
+        return sys.stdout.buffer if binary else sys.stdout
+    if binary:
+        return open(args.output, "wb")
+    return open(args.output, "w", encoding="utf-8")
+
+def close_file(f):
+    """關閉檔案，但不關閉標準輸入輸出"""
+    if f is not None and f not in (sys.stdin, sys.stdin.buffer, sys.stdout, sys.stdout.buffer):
+        f.close()
+
+def read_all(args, binary):
+    """讀取整份輸入：命令列參數或 --input"""
+    if args.data is not None:
+        return args.data.encode() if binary else args.data
+    f = open_input(args, binary)
+    try:
+        return f.read()
+    finally:
+        close_file(f)
+
+def use_transcoder(args):
+    """原始二進位且由檔案或 stdin 讀取時，直接在 JSON 與 MessagePack 之間轉換，不建立物件樹"""
+    return args.raw and args.data is None and args.stats is None
+
+def transcode_document(args, out, progress):
+    """以串流方式轉換單一文件，記憶體用量與文件大小無關"""
+    f = open_input(args, binary=args.decode)
+    try:
+        if args.encode:
+            count = msgpack_lib.json_to_msgpack(f, out, CHUNK_SIZE, callback=lambda n: progress.update(1, n))
+        else:
+            count = msgpack_lib.msgpack_to_json(f, out, CHUNK_SIZE, callback=lambda n: progress.update(1, n))
+    except Exception as e:
+        # 輸出端可能已寫入部分結果，錯誤訊息改寫到 stderr
+        print("JSON 格式錯誤:" if args.encode else "解碼失敗:", e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        close_file(f)
+    if count != 1:
+        print("JSON 格式錯誤:" if args.encode else "解碼失敗:", "輸入應恰好包含一個值（實際 %d 個）" % count,
+              file=sys.stderr)
+        sys.exit(1)
+
+def encode_document(args, out, progress):
+    """將單一 JSON 文件編碼為一個 MessagePack 物件"""
+    if use_transcoder(args):
+        return transcode_document(args, out, progress)
+    text = read_all(args, binary=False)
+    try:
+        obj = json.loads(text)
+    except Exception as e:
+        print("JSON 格式錯誤:", e)
+        sys.exit(1)
+    packed = msgpack_lib.pack(obj, stats=args.stats)
+    if args.raw:
+        out.write(packed)
+    else:
+        # 輸出以 hex 表示，方便觀察
+        out.write(binascii.hexlify(packed).decode() + "\n")
+    progress.update(1, len(packed))
+
+def decode_document(args, out, progress):
+    """將單一 MessagePack 物件解碼為 JSON"""
+    if use_transcoder(args):
+        return transcode_document(args, out, progress)
+    data = read_all(args, binary=True)
+    if not args.raw:
+        try:
+            data = binascii.unhexlify(data.strip())
+        except Exception as e:
+            print("hex 格式錯誤:", e)
+            sys.exit(1)
+    try:
+        obj = msgpack_lib.unpack(data, stats=args.stats)
+    except Exception as e:
+        print("解碼失敗:", e)
+        sys.exit(1)
+    out.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    progress.update(1, len(data))
+
+def encode_ndjson(args, out, progress):
+    """每行 JSON 編碼為一筆 MessagePack，依序串接輸出"""
+    packer = msgpack_lib.Packer(stats=args.stats)
+    pending = bytearray() if args.raw else []
+    size = 0
+    f = open_input(args, binary=False)
+    try:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except Exception as e:
+                print("JSON 格式錯誤（第 %d 行）:" % lineno, e, file=sys.stderr)
+                sys.exit(1)
+            packed = packer.pack(obj)
+            if args.raw:
+                pending += packed
+            else:
+                pending.append(binascii.hexlify(packed).decode() + "\n")
+            size += len(packed)
+            progress.update(1, len(packed))
+            if size >= CHUNK_SIZE:
+                out.write(pending if args.raw else "".join(pending))
+                del pending[:]
+                size = 0
+        if pending:
+            out.write(pending if args.raw else "".join(pending))
+    finally:
+        close_file(f)
+
+def decode_ndjson(args, out, progress):
+    """將串接的 MessagePack 串流（或每行一筆的 hex）解碼為 NDJSON"""
+    if args.jobs is not None:
+        # 平行模式：子行程各自 mmap 輸入檔並解碼不同區段
+        f = None
+        records = msgpack_lib.unpack_file(args.input, workers=args.jobs, ordered=not args.unordered)
+    elif args.raw:
+        f = open_input(args, binary=True)
+        records = msgpack_lib.Unpacker(f, read_size=CHUNK_SIZE, stats=args.stats)
+    else:
+        f = open_input(args, binary=False)
+        records = (msgpack_lib.unpack(binascii.unhexlify(line.strip()), stats=args.stats)
+                   for line in f if line.strip())
+    lines = []
+    size = 0
+    try:
+        for obj in records:
+            line = json.dumps(obj, ensure_ascii=False) + "\n"
+            lines.append(line)
+            size += len(line)
+            progress.update(1, len(line))
+            if size >= CHUNK_SIZE:
+                out.write("".join(lines))
+                lines.clear()
+                size = 0
+    except Exception as e:
+        out.write("".join(lines))
+        print("解碼失敗:", e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        close_file(f)
+    out.write("".join(lines))
+
 def main():
     parser = argparse.ArgumentParser(description="JSON 與 MessagePack 轉換工具")
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--encode", action="store_true", help="將 JSON 轉換為 MessagePack")
     group.add_argument("--decode", action="store_true", help="將 MessagePack 轉換回 JSON")
-    parser.add_argument("data", help="輸入資料：若 encode 則為 JSON 字串；若 decode 則為 MessagePack 的 hex 字串")
+    parser.add_argument("data", nargs="?", help="輸入資料：若 encode 則為 JSON 字串；若 decode 則為 MessagePack 的 hex 字串。"
+                                               "省略時由 --input 或 stdin 讀取")
+    parser.add_argument("-i", "--input", help="輸入檔案，'-' 表示 stdin")
+    parser.add_argument("-o", "--output", help="輸出檔案，'-' 表示 stdout（預設）")
+    parser.add_argument("--raw", action="store_true", help="MessagePack 端使用原始二進位資料而非 hex")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="串流模式：encode 時每行 JSON 編碼為一筆並串接輸出；decode 時將串接的資料輸出為每行一筆 JSON")
+    parser.add_argument("--progress", action="store_true", help="於 stderr 回報進度與處理速度")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="以多個行程平行解碼（需搭配 --decode --ndjson --raw 與 --input 檔案）")
+    parser.add_argument("--unordered", action="store_true", help="平行解碼時不保留輸入順序，先完成先輸出")
+    parser.add_argument("--stats", action="store_true",
+                        help="結束時於 stderr 輸出各格式的次數與 bytes 數、最大深度與耗時統計")
     args = parser.parse_args()
+    if args.data is not None and args.input is not None:
+        parser.error("輸入資料與 --input 只能擇一")
+    if args.jobs is not None:
+        if not (args.decode and args.ndjson and args.raw) or args.input in (None, "-"):
+            parser.error("--jobs 需搭配 --decode --ndjson --raw 與 --input 檔案")
+        if args.jobs < 1:
+            parser.error("--jobs 必須為正整數")
+        if args.stats:
+            parser.error("--stats 不支援平行解碼（--jobs）")
 
-    if args.encode:
-        try:
-            obj = json.loads(args.data)
-        except Exception as e:
-            print("JSON 格式錯誤:", e)
-            sys.exit(1)
-        packed = msgpack_lib.pack(obj)
-        # 輸出以 hex 表示，方便觀察
-        print(binascii.hexlify(packed).decode())
-    elif args.decode:
-        try:
-            packed = binascii.unhexlify(args.data)
-        except Exception as e:
-            print("hex 格式錯誤:", e)
-            sys.exit(1)
-        try:
-            obj = msgpack_lib.unpack(packed)
-        except Exception as e:
-            print("解碼失敗:", e)
-            sys.exit(1)
-        print(json.dumps(obj, ensure_ascii=False))
+    # 啟用時改為 Stats 物件，由各編碼/解碼函式傳給 msgpack_lib
+    args.stats = msgpack_lib.Stats() if args.stats else None
+
+    # MessagePack 以原始二進位輸出時，輸出端需為二進位模式
+    binary_out = args.encode and args.raw
+    out = open_output(args, binary_out)
+    progress = Progress(args.progress)
+    try:
+        if args.ndjson:
+            if args.data is not None:
+                parser.error("--ndjson 需由 --input 或 stdin 讀取")
+            (encode_ndjson if args.encode else decode_ndjson)(args, out, progress)
+        else:
+            (encode_document if args.encode else decode_document)(args, out, progress)
+        out.flush()
+    finally:
+        close_file(out)
+    progress.finish()
+    if args.stats is not None:
+        print(args.stats.summary(), file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,39 @@
+import asyncio
+import json
+import keyword
+import math
+import mmap
+import os
+import re
+import shutil
 import struct
+import sys
+import tempfile
+import time
+from array import array
+from collections import deque
+from collections.abc import Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from itertools import accumulate, chain, islice
+from operator import itemgetter, sub
+
+# 編碼與解碼允許的最大巢狀深度（容器層數）
+DEFAULT_MAX_DEPTH = 1000000
+
+# 預先編譯的 struct，避免每次編碼/解碼重新解析格式字串
+_S_INT8 = struct.Struct("b")
+_S_UINT16 = struct.Struct(">H")
+_S_UINT32 = struct.Struct(">I")
+_S_UINT64 = struct.Struct(">Q")
+_S_INT16 = struct.Struct(">h")
+_S_INT32 = struct.Struct(">i")
+_S_INT64 = struct.Struct(">q")
+_S_FLOAT32 = struct.Struct(">f")
+_S_FLOAT64 = struct.Struct(">d")
+
+# 哨兵值：表示「沒有值」（例如 map 尚未讀到 key、迭代器已耗盡）
+_NOTHING = object()
 
 class Ext:
     """
@@ -13,397 +48,3167 @@ class Ext:
     def __eq__(self, other):
         return isinstance(other, Ext) and self.type == other.type and self.data == other.data
 
-def pack(obj):
-    """將 Python 物件編碼為 MessagePack 格式的 bytes"""
-    return _pack(obj)
-
-def _pack(obj):
-    if obj is None:
-        return b'\xc0'  # nil
-    elif isinstance(obj, bool):
-        return b'\xc3' if obj else b'\xc2'
-    elif isinstance(obj, int):
-        if obj >= 0:
-            if obj <= 0x7f:
-                return struct.pack("B", obj)  # positive fixint
-            elif obj <= 0xff:
-                return b'\xcc' + struct.pack("B", obj)  # uint 8
-            elif obj <= 0xffff:
-                return b'\xcd' + struct.pack(">H", obj)  # uint 16
-            elif obj <= 0xffffffff:
-                return b'\xce' + struct.pack(">I", obj)  # uint 32
-            elif obj <= 0xffffffffffffffff:
-                return b'\xcf' + struct.pack(">Q", obj)  # uint 64
-            else:
-                raise OverflowError("Integer too large")
+class LazyStr:
+    """
+    延遲解碼的字串（unpack(strings="lazy") 的 str 值）。
+    raw 為 UTF-8 原始 bytes（zero_copy 模式為 memoryview），第一次需要 str 時才解碼並保留結果；
+    與 str 比較時改為比較 UTF-8 bytes，不需解碼。
+    編碼時直接寫出 raw，不經過解碼與重新編碼，原樣轉送的欄位完全不處理文字。
+    """
+    __slots__ = ("raw", "_str")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._str = None
+
+    def __str__(self):
+        s = self._str
+        if s is None:
+            s = self._str = str(self.raw, "utf-8")
+        return s
+
+    def __len__(self):
+        raw = self.raw
+        # ASCII 內容的字元數即為 bytes 數，不需解碼
+        if self._str is None and type(raw) is bytes and raw.isascii():
+            return len(raw)
+        return len(str(self))
+
+    def __bool__(self):
+        return len(self.raw) > 0
+
+    def __eq__(self, other):
+        if isinstance(other, LazyStr):
+            return self.raw == other.raw
+        if isinstance(other, str):
+            try:
+                return self.raw == other.encode("utf-8")
+            except UnicodeEncodeError:
+                return False
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return "LazyStr(%r)" % bytes(self.raw)
+
+# ---- 本函式庫使用的擴充型別 ----
+
+# 數值陣列：資料為 1 byte 型別代碼（struct 格式字元）接著 big-endian 連續排列的元素
+EXT_TYPED_ARRAY = 80
+
+# 型別代碼固定對應元素寬度，與平台的 array typecode 寬度無關
+_TYPED_ARRAY_SIZES = {"b": 1, "B": 1, "h": 2, "H": 2, "i": 4, "I": 4, "q": 8, "Q": 8, "f": 4, "d": 8}
+_TYPECODE_TO_CODE = {}   # 本機 array typecode -> 型別代碼
+_CODE_TO_TYPECODE = {}   # 型別代碼 -> 本機 array typecode
+for _tc in "bBhHiIlLqQfd":
+    _size = array(_tc).itemsize
+    if _tc in "fd":
+        _code = _tc
+    else:
+        _code = {1: "b", 2: "h", 4: "i", 8: "q"}[_size]
+        if _tc.isupper():
+            _code = _code.upper()
+    _TYPECODE_TO_CODE[_tc] = _code
+    _CODE_TO_TYPECODE.setdefault(_code, _tc)
+del _tc, _size, _code
+
+_SWAP_BYTES = sys.byteorder == "little"
+
+def _pack_typed_array(obj):
+    """將 array.array 或數值 memoryview 一次轉為 EXT_TYPED_ARRAY 的資料"""
+    if isinstance(obj, memoryview):
+        typecode = obj.format
+        if typecode not in _TYPECODE_TO_CODE or not obj.c_contiguous:
+            raise TypeError("Unsupported memoryview format: " + typecode)
+        arr = array(typecode)
+        arr.frombytes(obj.cast("B"))
+    else:
+        typecode = obj.typecode
+        if typecode not in _TYPECODE_TO_CODE:
+            raise TypeError("Unsupported array typecode: " + typecode)
+        arr = array(typecode, obj) if _SWAP_BYTES else obj
+    if _SWAP_BYTES:
+        arr.byteswap()
+    return _TYPECODE_TO_CODE[typecode].encode("ascii") + arr.tobytes()
+
+def _unpack_typed_array(data):
+    """將 EXT_TYPED_ARRAY 的資料一次轉回 array.array"""
+    if not len(data):
+        raise ValueError("Empty typed array payload")
+    code = chr(data[0])
+    typecode = _CODE_TO_TYPECODE.get(code)
+    if typecode is None:
+        raise ValueError("Unknown typed array code: %r" % code)
+    if (len(data) - 1) % _TYPED_ARRAY_SIZES[code]:
+        raise ValueError("Typed array payload is not a multiple of its item size")
+    arr = array(typecode)
+    arr.frombytes(data[1:])
+    if _SWAP_BYTES:
+        arr.byteswap()
+    return arr
+
+def _int_typecode(low, high):
+    """回傳能容納 low..high 的最小整數 array typecode；超出 64-bit 時回傳 None"""
+    for code in ("BHIQ" if low >= 0 else "bhiq"):
+        bits = _TYPED_ARRAY_SIZES[code] * 8
+        if low >= 0:
+            if high < 1 << bits:
+                return _CODE_TO_TYPECODE[code]
+        elif -(1 << bits - 1) <= low and high < 1 << bits - 1:
+            return _CODE_TO_TYPECODE[code]
+    return None
+
+# 欄式批次：資料為 MessagePack array [筆數, keys, 各欄的 bytes 數, 欄 1, 欄 2, ...]，
+# 見 Packer.pack_columns()
+EXT_COLUMNS = 81
+
+# 字串欄：1 byte 型別代碼、4 bytes 筆數、各字串的長度（字元數，big-endian）、串接後的 UTF-8 內容
+EXT_STRING_COLUMN = 82
+
+def _pack_string_column(values):
+    """將字串 list 轉為 EXT_STRING_COLUMN 的資料"""
+    lengths = list(map(len, values))
+    lengths = array(_int_typecode(0, max(lengths, default=0)), lengths)
+    header = _pack_typed_array(lengths)
+    return b"".join((header[:1], _S_UINT32.pack(len(values)), header[1:], "".join(values).encode("utf-8")))
+
+def _unpack_string_column(data):
+    """將 EXT_STRING_COLUMN 的資料轉回字串 list：內容一次解碼後依長度切片"""
+    if len(data) < 5:
+        raise ValueError("Truncated string column")
+    code = chr(data[0])
+    if code not in "BHIQ":
+        raise ValueError("Unknown string column length code: %r" % code)
+    count = _S_UINT32.unpack_from(data, 1)[0]
+    end = 5 + count * _TYPED_ARRAY_SIZES[code]
+    if end > len(data):
+        raise ValueError("Truncated string column")
+    lengths = array(_CODE_TO_TYPECODE[code])
+    lengths.frombytes(data[5:end])
+    if _SWAP_BYTES:
+        lengths.byteswap()
+    text = str(data[end:], "utf-8")
+    ends = list(accumulate(lengths))
+    if (ends[-1] if ends else 0) != len(text):
+        raise ValueError("String column lengths do not match its payload")
+    return list(map(text.__getitem__, map(slice, chain((0,), ends), ends)))
+
+def _unpack_column_rows(data, table, max_depth, array_limit):
+    """
+    EXT_COLUMNS 以 unpack(library_exts=True) 解碼時還原為 dict 的 list；
+    內容以目前的解碼表（含 limits）與 ext 所在位置剩餘的深度解碼。
+    """
+    keys, count, columns = _decode_columns(data, 0, len(data), table, max_depth, None, array_limit)
+    if not keys:
+        return [{} for _ in range(count)]
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+# 整數序列的差分編碼：1 byte 階數（1 為差分、2 為差分的差分）、1 byte 差分的型別代碼、
+# 1 byte 結果的型別代碼（0 為 list，其餘為 array.array）、依階數 1～2 個 big-endian int64 的起始值
+# （第一個值、第一個差分）、接著以固定寬度 big-endian 連續存放的各差分
+EXT_DELTA_INTS = 83
+
+# 以差分編碼的最短序列長度；更短的序列省下的空間不足以抵銷標頭
+_DELTA_MIN_LENGTH = 8
+
+def _packed_int_size(value):
+    """value 以一般 MessagePack 整數格式編碼後的 bytes 數"""
+    if value >= 0:
+        return 1 if value <= 0x7f else 2 if value <= 0xff else 3 if value <= 0xffff else 5 if value <= 0xffffffff else 9
+    return 1 if value >= -32 else 2 if value >= -0x80 else 3 if value >= -0x8000 else 5 if value >= -0x80000000 else 9
+
+def _ext_size(length):
+    """資料為 length bytes 的 ext 編碼後的總 bytes 數（含標頭）"""
+    if length in (1, 2, 4, 8, 16):
+        return length + 2
+    return length + (3 if length <= 0xff else 4 if length <= 0xffff else 6)
+
+def _pack_delta_ints(values, typecode=None, plain=None):
+    """
+    將整數序列轉為 EXT_DELTA_INTS 的資料：差分與差分的差分中取較小者，
+    以能容納所有差分的最小寬度存放。非全為 int、超出 int64 或不比原本的編碼小時回傳 None。
+    typecode: values 為 array.array 時傳入，解碼時還原為相同型別的 array。
+    plain: 原本編碼的 bytes 數（例如 EXT_TYPED_ARRAY）；未指定時計算一般 MessagePack array 的大小。
+    """
+    if typecode is None and set(map(type, values)) != {int}:
+        return None
+    low, high = min(values), max(values)
+    if low < -(1 << 63) or high >= 1 << 63:
+        return None
+    deltas = list(map(sub, islice(values, 1, None), values))
+    best = None
+    for order, diffs, starts in ((1, deltas, (values[0],)),
+                                 (2, list(map(sub, islice(deltas, 1, None), deltas)), (values[0], deltas[0]))):
+        if not -(1 << 63) <= starts[-1] < 1 << 63:
+            continue
+        code = _int_typecode(min(diffs), max(diffs))
+        if code is None:
+            continue
+        size = 3 + 8 * order + len(diffs) * array(code).itemsize
+        if best is None or size < best[0]:
+            best = (size, order, code, diffs, starts)
+    if best is None:
+        return None
+    if plain is None:
+        # 一般 MessagePack array 的實際大小（各值的整數格式加上 array 標頭）
+        count = len(values)
+        plain = sum(map(_packed_int_size, values)) + (1 if count < 16 else 3 if count <= 0xffff else 5)
+    if _ext_size(best[0]) >= plain:
+        return None
+    size, order, code, diffs, starts = best
+    packed = _pack_typed_array(array(code, diffs))
+    result = _TYPECODE_TO_CODE[typecode].encode("ascii") if typecode else b"\x00"
+    return b"".join((bytes((order,)), packed[:1], result, *map(_S_INT64.pack, starts), packed[1:]))
+
+def _unpack_delta_ints(data):
+    """將 EXT_DELTA_INTS 的資料還原：一次轉為 array 後以 accumulate 累加，不逐一解析"""
+    if len(data) < 3:
+        raise ValueError("Truncated delta-encoded integers")
+    order, code, result = data[0], chr(data[1]), data[2]
+    if order not in (1, 2) or code not in "bBhHiIqQ":
+        raise ValueError("Unknown delta encoding: order %d, code %r" % (order, code))
+    head = 3 + 8 * order
+    if len(data) < head or (len(data) - head) % _TYPED_ARRAY_SIZES[code]:
+        raise ValueError("Truncated delta-encoded integers")
+    diffs = array(_CODE_TO_TYPECODE[code])
+    diffs.frombytes(data[head:])
+    if _SWAP_BYTES:
+        diffs.byteswap()
+    if order == 2:
+        diffs = accumulate(diffs, initial=_S_INT64.unpack_from(data, 11)[0])
+    values = list(accumulate(diffs, initial=_S_INT64.unpack_from(data, 3)[0]))
+    # 編碼時只接受 int64 範圍內的值；超出時（例如惡意的差分）視為損毀的資料
+    if min(values) < -(1 << 63) or max(values) >= 1 << 63:
+        raise ValueError("Delta-encoded integers exceed int64")
+    if not result:
+        return values
+    typecode = _CODE_TO_TYPECODE.get(chr(result))
+    if typecode is None or typecode in "fd":
+        raise ValueError("Unknown delta result code: %r" % chr(result))
+    try:
+        return array(typecode, values)
+    except OverflowError:
+        raise ValueError("Delta-encoded integers do not fit result code %r" % chr(result)) from None
+
+# 以 library_exts=True 解碼時轉換的擴充型別：ext type -> 轉換函式(data)。
+# EXT_COLUMNS 的內容本身是 MessagePack，另以目前的解碼表與剩餘深度解碼，見 _make_library_exts()
+_EXT_DECODERS = {
+    EXT_TYPED_ARRAY: _unpack_typed_array,
+    EXT_STRING_COLUMN: _unpack_string_column,
+    EXT_DELTA_INTS: _unpack_delta_ints,
+}
+
+def pack(obj, **options):
+    """將 Python 物件編碼為 MessagePack 格式的 bytes；options 同 Packer"""
+    return Packer(**options).pack(obj)
+
+def pack_columns(records, **options):
+    """將 key 相同的多筆 dict 以欄為單位編碼；options 同 Packer，見 Packer.pack_columns()"""
+    return Packer(**options).pack_columns(records)
+
+def packed_size(obj, **options):
+    """回傳 obj 編碼後的確切長度，不產生輸出；options 同 Packer"""
+    return Packer(**options).packed_size(obj)
+
+def pack_into(obj, buffer, offset=0, **options):
+    """將 obj 編碼後寫入可寫的 buffer 的 offset 處，回傳寫入後的 offset；options 同 Packer"""
+    return Packer(**options).pack_into(obj, buffer, offset)
+
+# ---- 編碼函式：encoder(buf, obj)，直接寫入 bytearray ----
+# 純量回傳 None；容器寫入標頭後回傳尚待編碼的子元素迭代器（空容器回傳 _NO_CHILDREN），
+# 由 Packer 以明確的堆疊走訪。
+# 單一 byte 以 bytearray.append(int) 寫入，不配置任何物件；
+# 標頭與數值一併以預先編譯的 struct 產生，每個值只配置一次 bytes。
+
+_NO_CHILDREN = ()
+
+_S_TAG_UINT8 = struct.Struct(">BB")
+_S_TAG_UINT16 = struct.Struct(">BH")
+_S_TAG_UINT32 = struct.Struct(">BI")
+_S_TAG_UINT64 = struct.Struct(">BQ")
+_S_TAG_INT8 = struct.Struct(">Bb")
+_S_TAG_INT16 = struct.Struct(">Bh")
+_S_TAG_INT32 = struct.Struct(">Bi")
+_S_TAG_INT64 = struct.Struct(">Bq")
+_S_TAG_FLOAT64 = struct.Struct(">Bd")
+
+def _pack_nil(buf, obj):
+    buf.append(0xc0)
+
+def _pack_bool(buf, obj):
+    buf.append(0xc3 if obj else 0xc2)
+
+def _pack_int(buf, obj):
+    if 0 <= obj <= 0x7f:
+        buf.append(obj)  # positive fixint
+    elif -32 <= obj < 0:
+        buf.append(obj & 0xff)  # negative fixint
+    elif obj > 0:
+        if obj <= 0xff:
+            buf += _S_TAG_UINT8.pack(0xcc, obj)  # uint 8
+        elif obj <= 0xffff:
+            buf += _S_TAG_UINT16.pack(0xcd, obj)  # uint 16
+        elif obj <= 0xffffffff:
+            buf += _S_TAG_UINT32.pack(0xce, obj)  # uint 32
+        elif obj <= 0xffffffffffffffff:
+            buf += _S_TAG_UINT64.pack(0xcf, obj)  # uint 64
         else:
-            if -32 <= obj < 0:
-                return struct.pack("b", obj)  # negative fixint
-            elif obj >= -128:
-                return b'\xd0' + struct.pack("b", obj)  # int 8
-            elif obj >= -32768:
-                return b'\xd1' + struct.pack(">h", obj)  # int 16
-            elif obj >= -2147483648:
-                return b'\xd2' + struct.pack(">i", obj)  # int 32
-            elif obj >= -9223372036854775808:
-                return b'\xd3' + struct.pack(">q", obj)  # int 64
+            raise OverflowError("Integer too large")
+    elif obj >= -128:
+        buf += _S_TAG_INT8.pack(0xd0, obj)  # int 8
+    elif obj >= -32768:
+        buf += _S_TAG_INT16.pack(0xd1, obj)  # int 16
+    elif obj >= -2147483648:
+        buf += _S_TAG_INT32.pack(0xd2, obj)  # int 32
+    elif obj >= -9223372036854775808:
+        buf += _S_TAG_INT64.pack(0xd3, obj)  # int 64
+    else:
+        raise OverflowError("Integer too small")
+
+def _pack_float(buf, obj):
+    buf += _S_TAG_FLOAT64.pack(0xcb, obj)  # float 64
+
+def _pack_str_header(buf, length):
+    """寫入 UTF-8 內容為 length bytes 的 str 標頭（_pack_str 與 _pack_lazy_str 共用）"""
+    if length <= 31:
+        buf.append(0xa0 | length)  # fixstr
+    elif length <= 0xff:
+        buf += _S_TAG_UINT8.pack(0xd9, length)  # str 8
+    elif length <= 0xffff:
+        buf += _S_TAG_UINT16.pack(0xda, length)  # str 16
+    elif length <= 0xffffffff:
+        buf += _S_TAG_UINT32.pack(0xdb, length)  # str 32
+    else:
+        raise OverflowError("String too long")
+
+def _pack_str(buf, obj):
+    encoded = obj.encode("utf-8")
+    length = len(encoded)
+    if length <= 31:
+        buf.append(0xa0 | length)  # fixstr：最常見的短字串不另外呼叫函式
+    else:
+        _pack_str_header(buf, length)
+    buf += encoded
+
+def _pack_lazy_str(buf, obj):
+    """LazyStr：與 _pack_str 相同，但直接寫出原始的 UTF-8 bytes"""
+    raw = obj.raw
+    _pack_str_header(buf, len(raw))
+    buf += raw
+
+def _pack_bin(buf, obj):
+    """bytes、bytearray 與 byte 格式的 memoryview"""
+    length = len(obj) if type(obj) is not memoryview else obj.nbytes
+    if length <= 0xff:
+        buf += _S_TAG_UINT8.pack(0xc4, length)  # bin 8
+    elif length <= 0xffff:
+        buf += _S_TAG_UINT16.pack(0xc5, length)  # bin 16
+    elif length <= 0xffffffff:
+        buf += _S_TAG_UINT32.pack(0xc6, length)  # bin 32
+    else:
+        raise OverflowError("Binary data too long")
+    buf += obj
+
+def _pack_array_header(buf, length):
+    if length <= 15:
+        buf.append(0x90 | length)  # fixarray
+    elif length <= 0xffff:
+        buf += _S_TAG_UINT16.pack(0xdc, length)  # array 16
+    elif length <= 0xffffffff:
+        buf += _S_TAG_UINT32.pack(0xdd, length)  # array 32
+    else:
+        raise OverflowError("Array too long")
+
+def _pack_map_header(buf, length):
+    if length <= 15:
+        buf.append(0x80 | length)  # fixmap
+    elif length <= 0xffff:
+        buf += _S_TAG_UINT16.pack(0xde, length)  # map 16
+    elif length <= 0xffffffff:
+        buf += _S_TAG_UINT32.pack(0xdf, length)  # map 32
+    else:
+        raise OverflowError("Map too large")
+
+def _pack_list(buf, obj):
+    """list 與 tuple"""
+    length = len(obj)
+    _pack_array_header(buf, length)
+    return iter(obj) if length else _NO_CHILDREN
+
+def _pack_dict(buf, obj):
+    length = len(obj)
+    _pack_map_header(buf, length)
+    return chain.from_iterable(obj.items()) if length else _NO_CHILDREN
+
+def _pack_ext_header(buf, ext_type, length):
+    if length == 1:
+        buf.append(0xd4)  # fixext 1
+    elif length == 2:
+        buf.append(0xd5)  # fixext 2
+    elif length == 4:
+        buf.append(0xd6)  # fixext 4
+    elif length == 8:
+        buf.append(0xd7)  # fixext 8
+    elif length == 16:
+        buf.append(0xd8)  # fixext 16
+    elif length <= 0xff:
+        buf += _S_TAG_UINT8.pack(0xc7, length)  # ext 8
+    elif length <= 0xffff:
+        buf += _S_TAG_UINT16.pack(0xc8, length)  # ext 16
+    elif length <= 0xffffffff:
+        buf += _S_TAG_UINT32.pack(0xc9, length)  # ext 32
+    else:
+        raise OverflowError("Extension data too long")
+    buf += _S_INT8.pack(ext_type)
+
+def _pack_ext(buf, obj):
+    _pack_ext_header(buf, obj.type, len(obj.data))
+    buf += obj.data
+
+# 依確切型別查表的純量編碼函式
+_SCALAR_ENCODERS = {
+    type(None): _pack_nil,
+    bool: _pack_bool,
+    int: _pack_int,
+    float: _pack_float,
+    str: _pack_str,
+}
+
+# 內建支援的型別；子類別依 MRO 找到最近的基底類別後快取在各 Packer 的表中
+_ENCODERS = dict(_SCALAR_ENCODERS)
+_ENCODERS.update({
+    bytes: _pack_bin,
+    bytearray: _pack_bin,
+    list: _pack_list,
+    tuple: _pack_list,
+    dict: _pack_dict,
+    Ext: _pack_ext,
+    LazyStr: _pack_lazy_str,
+})
+
+class _SizeCounter:
+    """代替 bytearray 傳給編碼函式，只累計寫入的長度"""
+    __slots__ = ("size",)
+
+    def __init__(self):
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, byte):
+        self.size += 1
+
+    def __iadd__(self, data):
+        self.size += data.nbytes if type(data) is memoryview else len(data)
+        return self
+
+class Packer:
+    """
+    MessagePack 編碼器。
+    所有型別都寫入同一個可成長的 bytearray，最後只產生一次 bytes，
+    避免巢狀容器以 `result += ...` 串接造成的二次方複製。
+    同一個 Packer 可重複使用，每次呼叫 pack() 後緩衝區會被清空。
+    巢狀容器以明確的堆疊走訪而非遞迴，深度超過 max_depth（含循環參照）時
+    拋出 ValueError。
+
+    各值依 type(obj) 查表取得編碼函式；子類別第一次出現時依 MRO 找到支援的基底類別，
+    結果快取在此 Packer 中。tuple 編碼為 array，bytearray 與 byte 格式的 memoryview
+    編碼為 bin。
+
+    default: 選用的轉換函式，不支援的型別以 default(obj) 的結果編碼
+    （每個型別只在第一次出現時判斷一次）；未指定時拋出 TypeError。
+    轉換結果在巢狀深度中算作一層。
+
+    typed_arrays: array.array 與數值格式的 memoryview 以 EXT_TYPED_ARRAY
+    整塊編碼；設為 False 時改寫成標準的 MessagePack array，方便其他實作讀取。
+
+    壓縮模式（預設關閉，關閉時輸出與先前完全相同）：
+    compact_floats: float 可無損轉為 float32 時以 float32 (0xca) 編碼。
+    floats_as_ints: 整數值的 float（例如 3.0）以 int 編碼；解碼後型別會變成 int，
+    需由呼叫端確認可以接受。
+    bytes_saved: 各壓縮方式累計節省的 bytes 數，可用 reset_stats() 歸零。
+    stats: 選用的 Stats，記錄每次 pack() 的時間與輸出的格式分布。
+
+    memo_size: 大於 0 時啟用依物件 id 的編碼快取（預設關閉）。同一個 dict/list/tuple
+    第二次出現時記下其編碼結果，之後再出現直接寫入快取的 bytes，不再走訪。
+    快取跨 pack() 呼叫保留，最多 memo_size 項，超過時淘汰最久未使用者；只出現過一次的物件
+    另外最多記住 memo_seen_size 項（預設為 memo_size 的 16 倍），兩次出現之間隔著更多
+    不同的容器時不會被快取。
+    快取持有物件的參考，id 不會被重複使用。快取中的容器（包含其子物件）
+    視為不可變，修改後須以 invalidate() 移除受影響的容器或以 clear_memo() 清空，
+    否則會寫出舊的內容。只需在單次呼叫內共用時使用 pack(obj, memo_size=...)。
+
+    delta_ints: 至少 8 個 int 的 list/tuple 與整數型別的 array.array（例如遞增的 ID、
+    固定間隔的時間戳記）以 EXT_DELTA_INTS 存放差分或差分的差分（預設關閉）。
+    只在確定比原本的編碼（array.array 在 typed_arrays 模式下為 EXT_TYPED_ARRAY）小時使用；解碼為 list（tuple 亦同）或原型別的 array.array。
+    """
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, typed_arrays=True,
+                 compact_floats=False, floats_as_ints=False, stats=None, default=None, memo_size=0,
+                 delta_ints=False, memo_seen_size=None):
+        self._buffer = bytearray()
+        self.stats = stats
+        self._max_depth = max_depth
+        self._typed_arrays = typed_arrays
+        self._compact_floats = compact_floats
+        self._floats_as_ints = floats_as_ints
+        self._default = default
+        self.bytes_saved = {"float32": 0, "float_as_int": 0}
+        # 依確切型別查表的編碼函式，反映此 Packer 的選項
+        self._encoders = dict(_ENCODERS)
+        self._encoders[array] = self._pack_array
+        self._encoders[memoryview] = self._pack_memoryview
+        if compact_floats or floats_as_ints:
+            self._encoders[float] = self._pack_float_compact
+        self._delta_ints = delta_ints
+        if delta_ints:
+            self._encoders[list] = self._encoders[tuple] = self._pack_list_delta
+        self._memo_size = memo_size
+        self._memo_seen_size = 16 * memo_size if memo_seen_size is None else memo_seen_size
+        if memo_size > 0 and self._memo_seen_size < 1:
+            raise ValueError("memo_seen_size must be at least 1")
+        self._memo = {}       # id -> (物件, 編碼結果)，依使用順序排列
+        self._memo_seen = {}  # id -> 物件：只出現過一次的容器
+        self._recording = 0   # 正在記錄編碼結果的容器數；其子容器已包含在內，不另外記錄
+        if memo_size > 0:
+            for cls in (list, tuple, dict):
+                self._encoders[cls] = self._memo_encoder(self._encoders[cls])
+
+    def reset_stats(self):
+        """將 bytes_saved 歸零"""
+        for name in self.bytes_saved:
+            self.bytes_saved[name] = 0
+
+    def invalidate(self, *objs):
+        """移除這些物件的編碼快取（修改了快取中的容器後呼叫）"""
+        for obj in objs:
+            self._memo.pop(id(obj), None)
+            self._memo_seen.pop(id(obj), None)
+
+    def clear_memo(self):
+        """清空編碼快取"""
+        self._memo.clear()
+        self._memo_seen.clear()
+
+    def pack(self, obj):
+        """將物件編碼並回傳 bytes"""
+        buf = self._buffer
+        stats = self.stats
+        try:
+            if stats is None:
+                self._pack(obj)
             else:
-                raise OverflowError("Integer too small")
-    elif isinstance(obj, float):
-        # 皆以 float64 編碼 (0xcb)
-        return b'\xcb' + struct.pack(">d", obj)
-    elif isinstance(obj, str):
-        encoded = obj.encode("utf-8")
-        length = len(encoded)
-        if length <= 31:
-            return struct.pack("B", 0xa0 | length) + encoded  # fixstr
-        elif length <= 0xff:
-            return b'\xd9' + struct.pack("B", length) + encoded  # str 8
-        elif length <= 0xffff:
-            return b'\xda' + struct.pack(">H", length) + encoded  # str 16
-        elif length <= 0xffffffff:
-            return b'\xdb' + struct.pack(">I", length) + encoded  # str 32
-        else:
-            raise OverflowError("String too long")
-    elif isinstance(obj, bytes):
-        length = len(obj)
-        if length <= 0xff:
-            return b'\xc4' + struct.pack("B", length) + obj  # bin 8
-        elif length <= 0xffff:
-            return b'\xc5' + struct.pack(">H", length) + obj  # bin 16
-        elif length <= 0xffffffff:
-            return b'\xc6' + struct.pack(">I", length) + obj  # bin 32
-        else:
-            raise OverflowError("Binary data too long")
-    elif isinstance(obj, list):
-        length = len(obj)
-        if length <= 15:
-            result = struct.pack("B", 0x90 | length)  # fixarray
-        elif length <= 0xffff:
-            result = b'\xdc' + struct.pack(">H", length)  # array 16
-        elif length <= 0xffffffff:
-            result = b'\xdd' + struct.pack(">I", length)  # array 32
+                start = time.perf_counter()
+                self._pack(obj)
+                stats._record("pack", buf, 0, len(buf), time.perf_counter() - start)
+            return bytes(buf)
+        finally:
+            del buf[:]
+
+    def packed_size(self, obj):
+        """
+        回傳 obj 編碼後的確切長度，不產生輸出：以只計算長度的物件代替緩衝區，
+        走訪與 pack() 完全相同的編碼函式。不影響 bytes_saved 與 stats。
+        """
+        counter = _SizeCounter()
+        saved = dict(self.bytes_saved)
+        try:
+            self._pack(obj, counter)
+        finally:
+            self.bytes_saved.update(saved)
+        return counter.size
+
+    def pack_into(self, obj, buffer, offset=0):
+        """
+        將 obj 編碼後寫入可寫的 buffer（bytearray、mmap、shared_memory.buf 等）
+        的 offset 處，回傳寫入後的 offset。
+        編碼結果直接從內部緩衝區複製到 buffer，不另外產生 bytes；
+        空間不足時拋出 ValueError，buffer 不會被修改。
+        """
+        buf = self._buffer
+        stats = self.stats
+        try:
+            if stats is None:
+                self._pack(obj)
+            else:
+                start = time.perf_counter()
+                self._pack(obj)
+                stats._record("pack", buf, 0, len(buf), time.perf_counter() - start)
+            with _as_memoryview(buffer) as view:
+                end = offset + len(buf)
+                if offset < 0 or end > len(view):
+                    raise ValueError("Buffer too small: need %d bytes at offset %d, have %d" % (
+                        len(buf), offset, len(view) - offset))
+                view[offset:end] = buf
+            return end
+        finally:
+            del buf[:]
+
+    def pack_columns(self, records):
+        """
+        將 key 相同的多筆 dict 以欄為單位編碼為一個 EXT_COLUMNS 擴充型別：
+        key 只寫一次，每個欄位的值連續存放。全為整數（64-bit 內）或全為 float 的欄
+        以 EXT_TYPED_ARRAY 整塊存放，全為字串的欄以 EXT_STRING_COLUMN 存放
+        （長度表加上串接的內容），其餘欄位寫成一般的 array。
+        以 unpack() 解碼得到原本的 dict list；unpack_columns() 則直接回傳各欄。
+        """
+        if not isinstance(records, list):
+            records = list(records)
+        keys = list(records[0]) if records else []
+        if records and set(map(len, records)) != {len(keys)}:
+            raise ValueError("All records must have the same keys")
+        buf = self._buffer
+        stats = self.stats
+        started = time.perf_counter()
+        try:
+            # ext 32 標頭的長度最後才補上
+            buf += _S_TAG_UINT32.pack(0xc9, 0)
+            buf += _S_INT8.pack(EXT_COLUMNS)
+            _pack_array_header(buf, 3 + len(keys))
+            _pack_int(buf, len(records))
+            self._pack(keys)
+            header_end = len(buf)
+            sizes = []
+            for key in keys:
+                try:
+                    column = list(map(itemgetter(key), records))
+                except (KeyError, TypeError):
+                    raise ValueError("All records must be dicts with the same keys") from None
+                start = len(buf)
+                self._pack_column(buf, column)
+                sizes.append(len(buf) - start)
+            # 各欄的 bytes 數放在各欄之前，讀取單一欄位時可直接跳到該欄
+            sizes = _pack_typed_array(array(_int_typecode(0, max(sizes, default=0)), sizes))
+            header = bytearray()
+            _pack_ext_header(header, EXT_TYPED_ARRAY, len(sizes))
+            buf[header_end:header_end] = header + sizes
+            if len(buf) - 6 > 0xffffffff:
+                raise OverflowError("Extension data too long")
+            buf[1:5] = _S_UINT32.pack(len(buf) - 6)
+            if stats is not None:
+                stats._record("pack", buf, 0, len(buf), time.perf_counter() - started)
+            return bytes(buf)
+        finally:
+            del buf[:]
+
+    def _pack_column(self, buf, column):
+        types = set(map(type, column))
+        typecode = None
+        if types == {int}:
+            typecode = _int_typecode(min(column), max(column))
+        elif types == {float}:
+            typecode = "d"
+        if typecode is not None:
+            data = _pack_typed_array(array(typecode, column))
+            _pack_ext_header(buf, EXT_TYPED_ARRAY, len(data))
+            buf += data
+        elif types == {str}:
+            data = _pack_string_column(column)
+            _pack_ext_header(buf, EXT_STRING_COLUMN, len(data))
+            buf += data
         else:
-            raise OverflowError("Array too long")
-        for item in obj:
-            result += _pack(item)
-        return result
-    elif isinstance(obj, dict):
-        length = len(obj)
-        if length <= 15:
-            result = struct.pack("B", 0x80 | length)  # fixmap
-        elif length <= 0xffff:
-            result = b'\xde' + struct.pack(">H", length)  # map 16
-        elif length <= 0xffffffff:
-            result = b'\xdf' + struct.pack(">I", length)  # map 32
+            self._pack(column)
+
+    def _pack(self, obj, buf=None):
+        if buf is None:
+            buf = self._buffer
+        max_depth = self._max_depth
+        get_encoder = self._encoders.get
+        resolve = self._resolve
+        # it 為目前容器尚未編碼的子元素迭代器（map 依序產生 key、value），
+        # 容器的編碼函式回傳子元素迭代器時中斷 for 迴圈、改走訪子容器，
+        # stack 保存外層的迭代器
+        it = iter((obj,))
+        stack = []
+        while True:
+            for obj in it:
+                cls = type(obj)
+                # 最常見的 fixint 直接寫入一個 byte，省去一次函式呼叫
+                if cls is int and -32 <= obj <= 0x7f:
+                    buf.append(obj & 0xff)
+                    continue
+                encoder = get_encoder(cls)
+                if encoder is None:
+                    encoder = resolve(cls)
+                children = encoder(buf, obj)
+                if children is not None:
+                    if len(stack) >= max_depth:
+                        raise ValueError("Maximum nesting depth exceeded: %d" % max_depth)
+                    if children:
+                        stack.append(it)
+                        it = children
+                        break
+            else:
+                # 目前容器已編碼完畢，回到上一層繼續
+                if not stack:
+                    return
+                it = stack.pop()
+
+    def _resolve(self, cls):
+        """找出 cls 的編碼函式並快取：依 MRO 找基底類別，找不到時使用 default"""
+        encoders = self._encoders
+        for base in cls.__mro__[1:]:
+            encoder = encoders.get(base)
+            if encoder is not None:
+                break
         else:
-            raise OverflowError("Map too large")
-        for k, v in obj.items():
-            result += _pack(k)
-            result += _pack(v)
+            if self._default is None:
+                raise TypeError("Type not supported: " + str(cls))
+            encoder = self._pack_default
+        encoders[cls] = encoder
+        return encoder
+
+    def _pack_default(self, buf, obj):
+        converted = self._default(obj)
+        cls = type(converted)
+        encoder = self._encoders.get(cls) or self._resolve(cls)
+        if encoder == self._pack_default:
+            raise TypeError("default() returned an unsupported type: " + str(cls))
+        return iter((converted,))
+
+    def _memo_encoder(self, encoder):
+        """
+        memo 模式的容器編碼函式：已快取時直接寫入快取的 bytes；
+        第二次出現時照常編碼，並在走訪完子元素後存入快取
+        """
+        memo = self._memo
+        seen = self._memo_seen
+        size = self._memo_seen_size
+        store = self._memo_store
+        def pack_memoized(buf, obj):
+            key = id(obj)
+            entry = memo.pop(key, None)
+            if entry is not None:
+                memo[key] = entry
+                buf += entry[1]
+                return None
+            start = len(buf)
+            children = encoder(buf, obj)
+            if not children or self._recording:
+                return children
+            if seen.pop(key, None) is None:
+                if len(seen) >= size:
+                    del seen[next(iter(seen))]
+                seen[key] = obj
+                return children
+            return store(obj, buf, start, children)
+        return pack_memoized
+
+    def _memo_store(self, obj, buf, start, children):
+        # 外層迴圈取完最後一個子元素（含其子容器）後才會回到這裡，此時 buf[start:] 即為完整的編碼
+        self._recording += 1
+        try:
+            yield from children
+        finally:
+            self._recording -= 1
+        if isinstance(buf, bytearray):
+            memo = self._memo
+            if len(memo) >= self._memo_size:
+                del memo[next(iter(memo))]
+            memo[id(obj)] = (obj, buf[start:])
+
+    def _pack_list_delta(self, buf, obj):
+        """delta_ints 模式的 list/tuple：整數序列以 EXT_DELTA_INTS 編碼，其餘照常寫成 array"""
+        if len(obj) >= _DELTA_MIN_LENGTH:
+            data = _pack_delta_ints(obj)
+            if data is not None:
+                _pack_ext_header(buf, EXT_DELTA_INTS, len(data))
+                buf += data
+                return None
+        return _pack_list(buf, obj)
+
+    def _pack_array(self, buf, obj):
+        """array.array：typed_arrays 模式以 EXT_TYPED_ARRAY 整塊編碼，否則寫成 array"""
+        if self._delta_ints and obj.typecode in _TYPECODE_TO_CODE and obj.typecode not in "fd" \
+                and len(obj) >= _DELTA_MIN_LENGTH:
+            plain = _ext_size(1 + len(obj) * obj.itemsize) if self._typed_arrays else None
+            data = _pack_delta_ints(obj, obj.typecode, plain)
+            if data is not None:
+                _pack_ext_header(buf, EXT_DELTA_INTS, len(data))
+                buf += data
+                return None
+        if self._typed_arrays:
+            data = _pack_typed_array(obj)
+            _pack_ext_header(buf, EXT_TYPED_ARRAY, len(data))
+            buf += data
+            return None
+        return _pack_list(buf, obj.tolist())
+
+    def _pack_memoryview(self, buf, obj):
+        """byte 格式的 memoryview 編碼為 bin，數值格式同 array.array"""
+        if obj.format in ("B", "b", "c"):
+            return _pack_bin(buf, obj if obj.c_contiguous else obj.tobytes())
+        if self._typed_arrays:
+            data = _pack_typed_array(obj)
+            _pack_ext_header(buf, EXT_TYPED_ARRAY, len(data))
+            buf += data
+            return None
+        return _pack_list(buf, obj.tolist())
+
+    def _pack_float_compact(self, buf, obj):
+        """壓縮模式的 float 編碼：依序嘗試 int、float32，最後才用 float64"""
+        if self._floats_as_ints and obj.is_integer() and -2**63 <= obj < 2**64 \
+                and not (obj == 0 and math.copysign(1.0, obj) < 0):
+            start = len(buf)
+            _pack_int(buf, int(obj))
+            self.bytes_saved["float_as_int"] += 9 - (len(buf) - start)
+            return
+        if self._compact_floats and obj == obj:
+            try:
+                packed = _S_FLOAT32.pack(obj)
+            except OverflowError:
+                packed = None
+            if packed is not None and _S_FLOAT32.unpack(packed)[0] == obj:
+                buf.append(0xca)
+                buf += packed
+                self.bytes_saved["float32"] += 4
+                return
+        buf += _S_TAG_FLOAT64.pack(0xcb, obj)  # float 64
+
+    def _pack_array_header(self, length):
+        """寫入 array 標頭（供非 list 的序列使用）"""
+        _pack_array_header(self._buffer, length)
+
+    def _pack_map_header(self, length):
+        """寫入 map 標頭"""
+        _pack_map_header(self._buffer, length)
+
+def compile_template(example_or_keys, **options):
+    """
+    為固定形狀的 dict 建立專用的編碼/解碼器。
+    example_or_keys: 範例 dict（取其 key 順序）或 key 的序列。
+    options: 傳給內部 Packer 的選項。
+    """
+    return RecordTemplate(example_or_keys, **options)
+
+class RecordTemplate:
+    """
+    固定 key（且順序相同）的 dict 的專用編碼器。
+    map 標頭與每個 key 的編碼在建立時就預先算好，編碼時只需編碼 value；
+    形狀不符的 dict 自動改用一般的編碼流程，輸出與 pack() 完全相同。
+    unpack() 則驗證固定的 key 內容後只解碼 value。
+    """
+    def __init__(self, example_or_keys, **options):
+        keys = tuple(example_or_keys)
+        if len(set(keys)) != len(keys):
+            raise ValueError("Duplicate keys in template")
+        self.keys = keys
+        self._packer = Packer(**options)
+        # 純量直接查表編碼（反映 Packer 的選項），容器等其餘型別交由 Packer._pack
+        self._scalar_encoders = {t: self._packer._encoders[t] for t in _SCALAR_ENCODERS}
+        # _chunks[i] 為寫在第 i 個 value 之前的固定內容；第一段包含 map 標頭
+        chunks = [self._packer.pack(k) for k in keys]
+        if keys:
+            buf = self._packer._buffer
+            self._packer._pack_map_header(len(keys))
+            chunks[0] = bytes(buf) + chunks[0]
+            del buf[:]
+        self._chunks = chunks
+
+    def matches(self, record):
+        """record 是否與範本的 key 與順序完全相同"""
+        return isinstance(record, dict) and len(record) == len(self.keys) and tuple(record) == self.keys
+
+    def pack(self, record):
+        """編碼一筆 record"""
+        packer = self._packer
+        buf = packer._buffer
+        try:
+            self._pack_record(record)
+            return bytes(buf)
+        finally:
+            del buf[:]
+
+    def pack_many(self, records):
+        """將多筆 record 編碼為一個 MessagePack array"""
+        packer = self._packer
+        buf = packer._buffer
+        if not isinstance(records, list):
+            records = list(records)
+        try:
+            packer._pack_array_header(len(records))
+            for record in records:
+                self._pack_record(record)
+            return bytes(buf)
+        finally:
+            del buf[:]
+
+    def _pack_record(self, record):
+        packer = self._packer
+        if not self.matches(record) or not self.keys:
+            packer._pack(record)
+            return
+        buf = packer._buffer
+        pack_value = packer._pack
+        encoders = self._scalar_encoders
+        for chunk, value in zip(self._chunks, record.values()):
+            buf += chunk
+            # 短字串與小整數直接寫入，其餘查表
+            t = type(value)
+            if t is str and len(value) <= 31 and value.isascii():
+                buf.append(0xa0 | len(value))
+                buf += value.encode("ascii")
+            elif t is int and 0 <= value <= 0x7f:
+                buf.append(value)
+            else:
+                encoder = encoders.get(t)
+                if encoder is None:
+                    pack_value(value)
+                else:
+                    encoder(buf, value)
+
+    def unpack(self, b, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, key_cache=None, record_classes=None):
+        """
+        解碼一筆 record；key 與範本相同時只解碼 value，否則改用一般的解碼流程。
+        參數同 unpack()；key_cache 與 record_classes 同樣套用到 value 中的 map。
+        """
+        b, options = _decode_options(b, zero_copy, max_depth, key_cache, record_classes=record_classes)
+        obj, offset = self._unpack_record(b, 0, *options)
+        if offset != len(b):
+            raise ValueError("Extra bytes found")
+        return obj
+
+    def unpack_many(self, b, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, key_cache=None, record_classes=None):
+        """解碼 pack_many() 產生的 array"""
+        b, options = _decode_options(b, zero_copy, max_depth, key_cache, record_classes=record_classes)
+        if not len(b) or _KIND[b[0]] != _ARRAY:
+            raise ValueError("Expected an array of records")
+        length, offset = _DISPATCH[b[0]](b, 0)
+        result = []
+        append = result.append
+        unpack_record = self._unpack_record
+        for _ in range(length):
+            obj, offset = unpack_record(b, offset, *options)
+            append(obj)
+        if offset != len(b):
+            raise ValueError("Extra bytes found")
         return result
-    elif isinstance(obj, Ext):
-        data = obj.data
-        length = len(data)
-        if length == 1:
-            return b'\xd4' + struct.pack("b", obj.type) + data  # fixext 1
-        elif length == 2:
-            return b'\xd5' + struct.pack("b", obj.type) + data  # fixext 2
-        elif length == 4:
-            return b'\xd6' + struct.pack("b", obj.type) + data  # fixext 4
-        elif length == 8:
-            return b'\xd7' + struct.pack("b", obj.type) + data  # fixext 8
-        elif length == 16:
-            return b'\xd8' + struct.pack("b", obj.type) + data  # fixext 16
-        elif length <= 0xff:
-            return b'\xc7' + struct.pack("B", length) + struct.pack("b", obj.type) + data  # ext 8
-        elif length <= 0xffff:
-            return b'\xc8' + struct.pack(">H", length) + struct.pack("b", obj.type) + data  # ext 16
-        elif length <= 0xffffffff:
-            return b'\xc9' + struct.pack(">I", length) + struct.pack("b", obj.type) + data  # ext 32
-        else:
-            raise OverflowError("Extension data too long")
+
+    def _unpack_record(self, b, start, table, max_depth, key_table, records, kinds):
+        values = []
+        offset = start
+        size = len(b)
+        if self.keys:
+            for chunk in self._chunks:
+                end = offset + len(chunk)
+                if b[offset:end] != chunk or end >= size:
+                    break
+                # 純量 value 直接查表解碼，容器才交給完整的解碼流程
+                if kinds[b[end]]:
+                    value, offset = _unpack(b, end, table, max_depth, key_table, records, kinds)
+                else:
+                    value, offset = table[b[end]](b, end)
+                values.append(value)
+            else:
+                return dict(zip(self.keys, values)), offset
+        return _unpack(b, start, table, max_depth, key_table, records, kinds)
+
+# ---- 欄式批次解碼 ----
+
+def unpack_columns(b, fields=None, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, limits=None):
+    """
+    解碼 pack_columns() 的結果，回傳 {key: 欄}，不建立每筆的 dict。
+    數值欄為 array.array，字串欄與其他欄為 list。
+    fields: 選用，只解碼這些欄位，其餘欄位只略過其 bytes；欄位不存在時拋出 KeyError。
+    其餘參數同 unpack()。
+    """
+    b, (table, max_depth, _, _, _) = _decode_options(b, zero_copy, max_depth, None, limits, library_exts=True)
+    start, end = _ext_payload(b, EXT_COLUMNS)
+    if end != len(b):
+        raise ValueError("Extra bytes found")
+    wanted = None if fields is None else set(fields)
+    array_limit = (limits or _DEFAULT_LIMITS).max_array_len
+    keys, count, columns = _decode_columns(b, start, end, table, max_depth, wanted, array_limit)
+    if wanted is not None and len(columns) != len(wanted):
+        raise KeyError(next(iter(wanted - columns.keys())))
+    return columns
+
+def _ext_payload(b, ext_type):
+    """回傳 b 開頭的 ext 中資料的 (起點, 終點)；不是指定的 ext type 時拋出 ValueError"""
+    span = _ext_span(b, 0) if len(b) else None
+    if span is None or span[0] != ext_type:
+        raise ValueError("Expected an ext %d" % ext_type)
+    return span[1], span[2]
+
+def _ext_span(b, offset):
+    """回傳 offset 處的 ext 的 (ext type, 資料起點, 資料終點)；不是 ext 時回傳 None"""
+    first = b[offset]
+    if 0xd4 <= first <= 0xd8:
+        length, start = 1 << first - 0xd4, offset + 1
+    elif first == 0xc7:
+        length, start = (b[offset+1] if len(b) > offset + 1 else 0), offset + 2
+    elif first in (0xc8, 0xc9):
+        st = _S_UINT16 if first == 0xc8 else _S_UINT32
+        if len(b) < offset + 1 + st.size:
+            raise OutOfData("Insufficient bytes for ext length", offset + 1 + st.size)
+        length, start = st.unpack_from(b, offset + 1)[0], offset + 1 + st.size
     else:
-        raise TypeError("Type not supported: " + str(type(obj)))
+        return None
+    end = start + 1 + length
+    if end > len(b):
+        raise OutOfData("Insufficient bytes for ext data", end)
+    return _S_INT8.unpack_from(b, start)[0], start + 1, end
+
+def _decode_columns(b, offset, end, table, max_depth, wanted, array_limit):
+    """
+    解碼 EXT_COLUMNS 的資料，回傳 (keys, 筆數, {key: 欄})；wanted 以外的欄位直接跳過。
+    table 需為 library_exts 的解碼表；資料本身的 array 算作一層，各欄以剩餘的深度解碼。
+    array_limit: 筆數上限（Limits.max_array_len）。
+    """
+    if offset >= end or _KIND[b[offset]] != _ARRAY:
+        raise ValueError("Malformed columnar batch")
+    if max_depth < 1:
+        raise ValueError("Maximum nesting depth exceeded: %d" % max_depth)
+    max_depth -= 1
+    kinds = _KIND_LIBRARY
+    length, offset = table[b[offset]](b, offset)
+    count, offset = _unpack(b, offset, table, max_depth, kinds=kinds)
+    keys, offset = _unpack(b, offset, table, max_depth, kinds=kinds)
+    sizes, offset = _unpack(b, offset, table, max_depth, kinds=kinds)
+    if (type(count) is not int or type(keys) is not list or type(sizes) is not array
+            or length != 3 + len(keys) or len(sizes) != len(keys) or offset + sum(sizes) != end):
+        raise ValueError("Malformed columnar batch")
+    if not 0 <= count <= array_limit:
+        raise _limit_error("columnar batch", count, array_limit)
+    columns = {}
+    for key, size in zip(keys, sizes):
+        if wanted is None or key in wanted:
+            column, column_end = _unpack(b, offset, table, max_depth, kinds=kinds)
+            if column_end != offset + size or not isinstance(column, (list, array)) or len(column) != count:
+                raise ValueError("Malformed column %r" % (key,))
+            columns[key] = column
+        offset += size
+    return keys, count, columns
+
+class OutOfData(ValueError):
+    """
+    輸入資料不足以解出完整物件。
+    needed: 至少需要的資料總長度（以輸入開頭起算），供串流解碼判斷何時再試。
+    """
+    def __init__(self, message, needed=0):
+        ValueError.__init__(self, message)
+        self.needed = needed
+
+# 各格式長度欄位的最大值，即不設限
+_MAX_LENGTH = 0xffffffff
+
+class Limits:
+    """
+    解碼時的資源上限，傳給 unpack()、unpack_from()、Unpacker、AsyncUnpacker 與 validate()
+    的 limits 參數；超過時拋出 ValueError。巢狀深度另由 max_depth 參數限制。
+
+    max_buffer_size: 輸入（串流解碼時為尚未取出的緩衝資料）的最大 bytes 數。
+    max_str_len / max_bin_len / max_ext_len: str、bin、ext 資料的最大 bytes 數。
+    max_array_len / max_map_len: array 元素數與 map 項目數的上限。
+    未指定的項目不設限。不論是否設定上限，容器宣告的元素數若超過剩餘資料可容納的數量
+    （每個元素至少 1 byte），都會在讀到標頭時立即判定資料不足。
+    """
+    __slots__ = ("max_buffer_size", "max_str_len", "max_bin_len", "max_ext_len",
+                 "max_array_len", "max_map_len")
+
+    def __init__(self, max_buffer_size=None, max_str_len=_MAX_LENGTH, max_bin_len=_MAX_LENGTH,
+                 max_ext_len=_MAX_LENGTH, max_array_len=_MAX_LENGTH, max_map_len=_MAX_LENGTH):
+        self.max_buffer_size = max_buffer_size
+        self.max_str_len = max_str_len
+        self.max_bin_len = max_bin_len
+        self.max_ext_len = max_ext_len
+        self.max_array_len = max_array_len
+        self.max_map_len = max_map_len
+
+    def _key(self):
+        return (self.max_str_len, self.max_bin_len, self.max_ext_len,
+                self.max_array_len, self.max_map_len)
+
+    def _check_buffer(self, size):
+        if self.max_buffer_size is not None and size > self.max_buffer_size:
+            raise ValueError("Buffer size %d exceeds limit %d" % (size, self.max_buffer_size))
 
-def unpack(b: bytes):
-    """將 MessagePack 格式的 bytes 解碼成 Python 物件"""
-    obj, offset = _unpack(b, 0)
+    def __repr__(self):
+        return "Limits(%s)" % ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__)
+
+_DEFAULT_LIMITS = Limits()
+
+def unpack(b: bytes, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, key_cache=None, stats=None,
+           limits=None, record_classes=None, strings="str", library_exts=False):
+    """
+    將 MessagePack 格式的 bytes 解碼成 Python 物件。
+    zero_copy: 為 True 時接受任何支援 buffer protocol 的物件（bytes、bytearray、
+    memoryview、mmap 等），bin 與 Ext 的資料以 memoryview 切片回傳而不複製。
+    回傳的切片會持有輸入緩衝區的參考，在釋放前無法關閉對應的 mmap。
+    max_depth: 允許的最大巢狀深度，超過時拋出 ValueError。
+    key_cache: 選用的 KeyCache，map 的字串 key 經由快取解碼。
+    stats: 選用的 Stats，記錄解碼時間與輸入的格式分布。
+    limits: 選用的 Limits，限制輸入與各格式的大小。
+    record_classes: 選用的 RecordClasses，符合的 map 直接建立為已註冊類別的物件。
+    strings: str 值的解碼方式（map 的 key 一律解碼為 str）：
+    "str"（預設）解碼為 str；"raw" 回傳原始的 UTF-8 bytes（zero_copy 模式為 memoryview）；
+    "lazy" 回傳 LazyStr，使用時才解碼，重新編碼時直接寫出原始 bytes。
+    後兩者不做 UTF-8 解碼與檢查，適合只轉送不處理的欄位。
+    library_exts: 為 True 時將本函式庫的擴充型別（80～83）還原為 array.array、
+    欄式批次的 dict list 與差分編碼的整數序列；預設與其他擴充型別相同回傳 Ext，
+    不佔用應用程式自行使用的 ext 編號。
+    """
+    b, options = _decode_options(b, zero_copy, max_depth, key_cache, limits, record_classes, strings,
+                                 library_exts)
+    if stats is None:
+        obj, offset = _unpack(b, 0, *options)
+    else:
+        start = time.perf_counter()
+        obj, offset = _unpack(b, 0, *options)
+        stats._record("unpack", b, 0, offset, time.perf_counter() - start)
     if offset != len(b):
         raise ValueError("Extra bytes found")
     return obj
 
-def _unpack(b: bytes, offset: int):
-    if offset >= len(b):
-        raise ValueError("Unexpected end of data")
-    first = b[offset]
-    # positive fixint (0x00 - 0x7f)
-    if first <= 0x7f:
-        return first, offset + 1
-    # fixmap (0x80 - 0x8f)
-    elif 0x80 <= first <= 0x8f:
-        length = first & 0x0f
-        offset += 1
-        result = {}
-        for _ in range(length):
-            key, offset = _unpack(b, offset)
-            value, offset = _unpack(b, offset)
-            result[key] = value
-        return result, offset
-    # fixarray (0x90 - 0x9f)
-    elif 0x90 <= first <= 0x9f:
-        length = first & 0x0f
-        offset += 1
-        result = []
-        for _ in range(length):
-            item, offset = _unpack(b, offset)
-            result.append(item)
-        return result, offset
-    # fixstr (0xa0 - 0xbf)
-    elif 0xa0 <= first <= 0xbf:
-        length = first & 0x1f
+def unpack_from(buffer, offset=0, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, key_cache=None,
+                limits=None, record_classes=None, strings="str", library_exts=False):
+    """
+    解碼 buffer 中 offset 處的一個物件，回傳 (obj, 其後的 offset)；其後可以還有其他資料
+    （例如 shared_memory 區塊尾端未使用的空間）。
+    buffer 可為任何支援 buffer protocol 的物件，輸入本身不會被複製成 bytes。
+    預設模式解碼完即釋放對 buffer 的參考；zero_copy 模式的 bin/ext 直接參照 buffer，
+    在釋放前無法關閉對應的 shared_memory 或 mmap。其餘參數同 unpack()。
+    """
+    view = _as_memoryview(buffer)
+    b, options = _decode_options(view, zero_copy, max_depth, key_cache, limits, record_classes, strings,
+                                 library_exts)
+    try:
+        return _unpack(b, offset, *options)
+    finally:
+        if not zero_copy:
+            view.release()
+
+def _decode_options(b, zero_copy, max_depth, key_cache, limits=None, record_classes=None, strings="str",
+                    library_exts=False):
+    """依 unpack() 的選項回傳 (輸入, (解碼表, max_depth, key 解碼表, 類別查詢表, 前導 byte 類別表))"""
+    if zero_copy:
+        b = _as_memoryview(b)
+    if limits is not None:
+        limits._check_buffer(len(b))
+    table = _dispatch_table(zero_copy, limits, strings, library_exts)
+    key_table = _key_table(zero_copy, limits, strings, key_cache)
+    records = record_classes._lookup if record_classes is not None else None
+    return b, (table, max_depth, key_table, records, _KIND_LIBRARY if library_exts else _KIND)
+
+def _key_table(zero_copy, limits, strings, key_cache):
+    """map key 的解碼表：key 一律解碼為 str（可經由 KeyCache）；與 value 相同時回傳 None"""
+    if strings == "str" and key_cache is None:
+        return None
+    table = _dispatch_table(zero_copy, limits)
+    return key_cache._key_table(table, limits) if key_cache is not None else table
+
+def _as_memoryview(b):
+    """將 buffer 物件轉為一維、以 byte 為單位的 memoryview"""
+    view = memoryview(b)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
+
+class KeyCache:
+    """
+    map key 的字串快取：以 key 的原始 bytes 對應到已 intern 的 str。
+    資料由大量相同 key 的 map 組成時，可省去重複的 UTF-8 解碼並共用同一個 str 物件。
+    同一個 KeyCache 可在多次 unpack() 呼叫或 Unpacker 之間共用。
+
+    max_size: 最多快取的 key 數，超過時淘汰最早加入的項目。
+    max_key_length: 只快取長度不超過此值的 key（預設涵蓋 fixstr 與 str 8）。
+    hits / misses: 命中與未命中次數，可用來調整 max_size。
+    """
+    def __init__(self, max_size=1024, max_key_length=0xff):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.max_key_length = max_key_length
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}
+        self._tables = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        """清除快取內容與統計"""
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _miss(self, raw):
+        """未命中：解碼、intern 並放入快取，必要時淘汰最早加入的項目"""
+        self.misses += 1
+        s = sys.intern(str(raw, "utf-8"))
+        cache = self._cache
+        if len(cache) >= self.max_size:
+            del cache[next(iter(cache))]
+        cache[raw] = s
+        return s
+
+    def _key_table(self, table, limits=None):
+        """
+        以 table 為基礎，建立 str key 經過快取的解碼表；
+        超過快取長度或 limits 的 key 交由 table 原本的解碼函式處理。
+        """
+        key_table = self._tables.get(id(table))
+        if key_table is None:
+            key_table = list(table)
+            limit = self.max_key_length
+            if limits is not None:
+                limit = min(limit, limits.max_str_len)
+            fixstr = self._make_fixstr_handler(limit, table[0xa0])
+            for i in range(0xa0, 0xc0):
+                key_table[i] = fixstr
+            key_table[0xd9] = self._make_handler(1, None, limit, table[0xd9])
+            if limit > 0xff:
+                key_table[0xda] = self._make_handler(2, _S_UINT16, limit, table[0xda])
+            self._tables[id(table)] = key_table
+        return key_table
+
+    def _make_fixstr_handler(self, limit, fallback):
+        cache_get = self._cache.get
+        miss = self._miss
+        def handler(b, offset):
+            length = b[offset] & 0x1f
+            start = offset + 1
+            if length > limit or start + length > len(b):
+                return fallback(b, offset)
+            raw = b[start:start+length]
+            if type(raw) is not bytes:
+                raw = bytes(raw)
+            s = cache_get(raw)
+            if s is None:
+                s = miss(raw)
+            else:
+                self.hits += 1
+            return s, start + length
+        return handler
+
+    def _make_handler(self, width, st, limit, fallback):
+        """建立 str 8/16 key 的解碼函式；width 為長度欄位的 byte 數"""
+        cache_get = self._cache.get
+        miss = self._miss
+        head = width + 1
+        def handler(b, offset):
+            if offset + head > len(b):
+                return fallback(b, offset)
+            length = b[offset+1] if width == 1 else st.unpack_from(b, offset + 1)[0]
+            start = offset + head
+            if length > limit or start + length > len(b):
+                return fallback(b, offset)
+            raw = b[start:start+length]
+            if type(raw) is not bytes:
+                raw = bytes(raw)
+            s = cache_get(raw)
+            if s is None:
+                s = miss(raw)
+            else:
+                self.hits += 1
+            return s, start + length
+        return handler
+
+class RecordClasses:
+    """
+    解碼時將特定 key 集合的 map 直接建立為已註冊的類別的物件，不經過 dict。
+    類別須為 namedtuple（tuple 子類別）或定義了 __slots__ 的類別，
+    物件與 pickle 相同不呼叫 __init__，直接設定各欄位。
+    map 的 key 集合與類別的欄位相同時（順序不限）建立該類別的物件，
+    其餘的 map（key 不符、多出或缺少欄位）照常解碼為 dict。
+    類別依 map 的欄位數與第一個 key 選擇，key 不符時改試其他含有該 key 的類別
+    （以該 key 為第一個欄位的類別優先）；key 集合完全相同的類別不可同時註冊。
+
+        classes = RecordClasses(Point, User)
+        obj = unpack(data, record_classes=classes)
+    """
+    def __init__(self, *classes):
+        self._lookup = {}  # 欄位數 -> {key: (欄位索引, 建立物件的函式, 下一個含有此 key 的候選)}
+        self._specs = {}   # 類別 -> (欄位, 欄位索引, 建立物件的函式)
+        for cls in classes:
+            self.register(cls)
+
+    def register(self, cls, fields=None):
+        """
+        註冊類別並回傳 cls（可作為裝飾器）。
+        fields: 對應的 map key，預設為 namedtuple 的 _fields 或依宣告順序的 __slots__。
+        """
+        if issubclass(cls, tuple):
+            names = getattr(cls, "_fields", None)
+            if names is None:
+                raise TypeError("Tuple record classes must be namedtuples")
+            fields = tuple(names if fields is None else fields)
+            if sorted(fields) != sorted(names):
+                raise ValueError("Fields of a namedtuple must match its _fields")
+            # value 依 _fields 的順序存放，直接作為 tuple 的內容
+            index = {field: names.index(field) for field in fields}
+            build = partial(tuple.__new__, cls)
+        else:
+            names = _slot_names(cls)
+            if not names:
+                raise TypeError("Record classes must define __slots__ or be namedtuples")
+            fields = tuple(names if fields is None else fields)
+            unknown = set(fields) - set(names)
+            if unknown:
+                raise ValueError("Unknown fields for %s: %s" % (cls.__name__, ", ".join(sorted(unknown))))
+            index = {field: i for i, field in enumerate(fields)}
+            build = _slots_builder(cls, [names[field] for field in fields])
+        if not fields or len(index) != len(fields):
+            raise ValueError("Record fields must be non-empty and unique")
+        for other, (other_fields, _, _) in self._specs.items():
+            if other is not cls and set(other_fields) == set(fields):
+                raise ValueError("%s and %s have the same fields" % (other.__name__, cls.__name__))
+        self._specs[cls] = (fields, index, build)
+        self._build_lookup()
+        return cls
+
+    def _build_lookup(self):
+        """依已註冊的類別重建查詢表（原地更新，已建立的 Unpacker 也會看到新的類別）"""
+        candidates = {}  # 欄位數 -> {key: [(欄位索引, 建立物件的函式), ...]}
+        for fields, index, build in self._specs.values():
+            by_key = candidates.setdefault(len(fields), {})
+            for field in fields:
+                specs = by_key.setdefault(field, [])
+                # 編碼端通常依欄位順序寫出 key，以此 key 為第一個欄位的類別優先嘗試
+                if field == fields[0]:
+                    specs.insert(0, (index, build))
+                else:
+                    specs.append((index, build))
+        self._lookup.clear()
+        for length, by_key in candidates.items():
+            table = self._lookup[length] = {}
+            for key, specs in by_key.items():
+                spec = None
+                for index, build in reversed(specs):
+                    spec = (index, build, spec)
+                table[key] = spec
+
+def _slot_names(cls):
+    """
+    依 MRO 收集 __slots__ 宣告的名稱（基底類別在前），回傳 {宣告的名稱: 屬性名稱}；
+    私有名稱（例如 __x）的屬性名稱依宣告的類別改寫為 _類別名稱__x。
+    """
+    names = {}
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        owner = klass.__name__.lstrip("_")
+        for name in ([slots] if isinstance(slots, str) else slots):
+            if name in ("__dict__", "__weakref__") or name in names:
+                continue
+            if name.startswith("__") and not name.endswith("__") and owner:
+                names[name] = "_%s%s" % (owner, name)
+            else:
+                names[name] = name
+    return names
+
+def _slots_builder(cls, attributes):
+    """回傳依 attributes 順序以 value list 建立 cls 物件的函式（不呼叫 __init__）"""
+    new = object.__new__
+    if cls.__setattr__ is object.__setattr__ and all(a.isidentifier() and not keyword.iskeyword(a)
+                                                      for a in attributes):
+        # 產生 `obj.a, obj.b = values` 形式的函式，一次設定所有欄位，比逐一呼叫 setter 快數倍
+        namespace = {"new": new, "cls": cls}
+        exec("def build(values):\n"
+             "    obj = new(cls)\n"
+             "    %s, = values\n"
+             "    return obj\n" % ", ".join("obj." + a for a in attributes), namespace)
+        return namespace["build"]
+    setters = [getattr(cls, attribute).__set__ for attribute in attributes]
+    def build(values):
+        obj = new(cls)
+        for setter, value in zip(setters, values):
+            setter(obj, value)
+        return obj
+    return build
+
+class Unpacker:
+    """
+    串流解碼器，可逐步餵入資料並依序取出串接在一起的多個物件。
+
+    用法一：呼叫 feed(chunk) 加入資料，再以 for 迴圈取出目前已完整的物件。
+    用法二：傳入 file_like（需有 read(n) 方法），迭代時會每次讀取
+    read_size bytes，直到檔案結束。
+
+    物件被切在多個 chunk 之間時，新資料到達後以略過表從上次的檢查位置接續確認物件是否完整
+    （只走訪新資料），完整後才解碼一次；若已知還缺多少資料（例如大型 str/bin），在資料到齊前不會重新檢查。
+    已取出的資料會定期從內部緩衝區移除，長時間串流的記憶體用量維持有界。
+    key_cache: 選用的 KeyCache，串流中所有 map 的 key 共用同一份快取。
+    stats: 選用的 Stats，每個取出的物件記為一次 unpack。
+    limits: 選用的 Limits；max_buffer_size 限制尚未取出的資料量，
+    物件確定需要超過此大小的資料時（例如宣告了大量元素）立即拋出 ValueError。
+    record_classes: 選用的 RecordClasses，符合的 map 直接建立為已註冊類別的物件。
+    strings / library_exts: 同 unpack()。
+    """
+    def __init__(self, file_like=None, read_size=64 * 1024, max_depth=DEFAULT_MAX_DEPTH,
+                 key_cache=None, stats=None, limits=None, record_classes=None, strings="str",
+                 library_exts=False):
+        if read_size <= 0:
+            raise ValueError("read_size must be positive")
+        self._file = file_like
+        self._max_depth = max_depth
+        self.key_cache = key_cache
+        self.stats = stats
+        self._limits = limits
+        self._table = _dispatch_table(False, limits, strings, library_exts)
+        self._kinds = _KIND_LIBRARY if library_exts else _KIND
+        self._key_table = _key_table(False, limits, strings, key_cache)
+        self._records = record_classes._lookup if record_classes is not None else None
+        self._skip_table = _skip_table(limits)
+        self._read_size = read_size
+        self._buffer = bytearray()
+        self._pos = 0      # 下一個物件在緩衝區中的起點
+        self._needed = 0   # 下次檢查前緩衝區至少需要的長度
+        # 目前物件的檢查進度：(已檢查到的位置，相對於物件開頭, 尚未略過的元素數)
+        self._scan = (0, 1)
+
+    def feed(self, data):
+        """加入一段資料"""
+        if self._file is not None:
+            raise TypeError("feed() is not available when reading from a file")
+        self._buffer += data
+        if self._limits is not None:
+            self._limits._check_buffer(len(self._buffer) - self._pos)
+
+    def unpack(self):
+        """
+        取出下一個完整物件。
+        資料不足時拋出 OutOfData，已緩衝的資料保留到下一次 feed()。
+        """
+        while True:
+            try:
+                return self._unpack_one()
+            except OutOfData:
+                if self._file is None or not self._read():
+                    raise
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.unpack()
+        except OutOfData:
+            if self._file is not None and self._pos < len(self._buffer):
+                raise OutOfData("Unexpected end of stream", self._needed)
+            raise StopIteration
+
+    def _read(self):
+        chunk = self._file.read(self._read_size)
+        if not chunk:
+            return False
+        self._buffer += chunk
+        if self._limits is not None:
+            self._limits._check_buffer(len(self._buffer) - self._pos)
+        return True
+
+    def _unpack_one(self):
+        buf = self._buffer
+        pos = self._pos
+        if len(buf) < self._needed or pos >= len(buf) or self._complete_size() is None:
+            raise OutOfData("Unexpected end of data", max(self._needed, pos + 1))
+        stats = self.stats
+        if stats is None:
+            obj, pos = _unpack(buf, pos, self._table, self._max_depth, self._key_table, self._records,
+                               self._kinds)
+        else:
+            begin = pos
+            start = time.perf_counter()
+            obj, pos = _unpack(buf, pos, self._table, self._max_depth, self._key_table, self._records,
+                               self._kinds)
+            stats._record("unpack", buf, begin, pos, time.perf_counter() - start)
+        self._pos = pos
+        self._needed = 0
+        self._scan = (0, 1)
+        # 已消耗的部分超過一半時壓縮緩衝區，移除成本可攤銷
+        if pos > (len(buf) >> 1):
+            del buf[:pos]
+            self._pos = 0
+        return obj
+
+    def _complete_size(self):
+        """緩衝區中的下一個物件已完整時回傳其長度，否則記下檢查進度並回傳 None"""
+        buf = self._buffer
+        start = self._pos
+        end = len(buf)
+        table = self._skip_table
+        offset, remaining = self._scan
+        offset += start
+        while remaining:
+            if offset >= end:
+                self._needed = offset + 1
+                break
+            try:
+                new_offset, children = table[buf[offset]](buf, offset)
+            except OutOfData as e:
+                if self._limits is not None:
+                    self._limits._check_buffer(e.needed - start)
+                self._needed = e.needed
+                break
+            if new_offset > end:
+                if self._limits is not None:
+                    self._limits._check_buffer(new_offset - start)
+                self._needed = new_offset
+                break
+            offset = new_offset
+            remaining += children - 1
+        else:
+            # 記下已完整，解碼前不需重新檢查
+            self._scan = (offset - start, 0)
+            return offset - start
+        self._scan = (offset - start, remaining)
+        return None
+
+class AsyncUnpacker:
+    """
+    asyncio 版的串流解碼器：從 asyncio.StreamReader 讀取資料，
+    以 `async for obj in AsyncUnpacker(reader)` 依序取出完整的物件。
+
+    與 Unpacker 相同，新資料到達時以略過表接續檢查下一個物件是否已完整，
+    物件完整後才解碼一次，大型物件分成多個 chunk 到達時不會重複解碼。
+    解碼本身是同步的，為避免長時間占用事件迴圈：
+    連續解碼約 read_size bytes 便讓出一次事件迴圈；
+    單一物件達 offload_bytes 時改在預設的 executor（執行緒）中解碼，
+    事件迴圈在解碼期間仍可處理其他連線。offload_bytes 設為 None 可停用。
+    其餘參數同 Unpacker。
+    """
+    def __init__(self, reader, read_size=64 * 1024, max_depth=DEFAULT_MAX_DEPTH,
+                 key_cache=None, stats=None, offload_bytes=1024 * 1024, limits=None, record_classes=None,
+                 strings="str", library_exts=False):
+        self._reader = reader
+        self._read_size = read_size
+        self._offload_bytes = offload_bytes
+        self._unpacker = Unpacker(read_size=read_size, max_depth=max_depth, key_cache=key_cache, stats=stats,
+                                  limits=limits, record_classes=record_classes, strings=strings,
+                                  library_exts=library_exts)
+        self._decoded = 0  # 上次讓出事件迴圈後解碼的 bytes 數
+
+    async def unpack(self):
+        """
+        取出下一個完整物件，資料不足時等待讀取。
+        串流正常結束時拋出 EOFError；結束在物件中間時拋出 OutOfData。
+        """
+        unpacker = self._unpacker
+        while True:
+            size = unpacker._complete_size()
+            if size is not None:
+                break
+            chunk = await self._reader.read(self._read_size)
+            if not chunk:
+                if unpacker._pos < len(unpacker._buffer):
+                    raise OutOfData("Unexpected end of stream", len(unpacker._buffer) + 1)
+                raise EOFError("End of stream")
+            unpacker.feed(chunk)
+        if self._offload_bytes is not None and size >= self._offload_bytes:
+            return await asyncio.get_running_loop().run_in_executor(None, unpacker.unpack)
+        obj = unpacker.unpack()
+        self._decoded += size
+        if self._decoded >= self._read_size:
+            self._decoded = 0
+            await asyncio.sleep(0)
+        return obj
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.unpack()
+        except EOFError:
+            raise StopAsyncIteration
+
+class AsyncPacker:
+    """
+    將物件編碼後直接寫入 asyncio.StreamWriter，並以 drain() 配合對方的讀取速度，
+    傳輸緩衝區超過上限時暫停，避免記憶體無限制成長。
+    其餘參數同 Packer。
+    """
+    def __init__(self, writer, **options):
+        self._writer = writer
+        self._packer = Packer(**options)
+
+    async def pack(self, obj):
+        """編碼並寫出一個物件"""
+        self._writer.write(self._packer.pack(obj))
+        await self._writer.drain()
+
+    async def pack_many(self, objs, chunk_size=64 * 1024):
+        """依序寫出多個物件；每累積約 chunk_size bytes 才寫出並 drain 一次"""
+        pack = self._packer.pack
+        pending = bytearray()
+        for obj in objs:
+            pending += pack(obj)
+            if len(pending) >= chunk_size:
+                self._writer.write(pending)
+                pending = bytearray()
+                await self._writer.drain()
+        if pending:
+            self._writer.write(pending)
+            await self._writer.drain()
+
+# 解碼表中各前導 byte 的類別：純量的 handler 回傳 (obj, offset)，
+# 容器的 handler 只讀標頭並回傳 (length, 第一個元素的 offset)
+_SCALAR, _ARRAY, _MAP, _EXT = 0, 1, 2, 3
+_KIND = [_SCALAR] * 256
+for _i in list(range(0x80, 0x90)) + [0xde, 0xdf]:
+    _KIND[_i] = _MAP
+for _i in list(range(0x90, 0xa0)) + [0xdc, 0xdd]:
+    _KIND[_i] = _ARRAY
+# library_exts 的解碼表使用：ext 的 handler 另外接收所在位置剩餘的深度
+_KIND_LIBRARY = list(_KIND)
+for _i in (0xc7, 0xc8, 0xc9, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8):
+    _KIND_LIBRARY[_i] = _EXT
+del _i
+
+
+def _unpack(b: bytes, offset: int, table=None, max_depth=DEFAULT_MAX_DEPTH, key_table=None, records=None,
+            kinds=_KIND):
+    """
+    以明確的堆疊（而非遞迴）解碼 offset 處的一個物件，回傳 (obj, new_offset)。
+    巢狀深度只受 max_depth 限制，不受 Python 遞迴上限影響。
+    key_table: 解碼 map key 時使用的解碼表（例如帶有 KeyCache 的版本），預設同 table。
+    records: 選用，RecordClasses 的查詢表，符合的 map 直接建立為對應類別的物件。
+    kinds: 前導 byte 的類別表；library_exts 的解碼表需搭配 _KIND_LIBRARY，
+    ext 才會收到所在位置剩餘的深度。
+    """
+    if table is None:
+        table = _DISPATCH
+    if key_table is None:
+        key_table = table
+    end = len(b)
+    # container 為目前正在填入的容器（最外層為 None），remaining 為其剩餘元素數，
+    # key 為 map 中尚待配對 value 的 key；record 為 (類別資訊, map 第一個 key 的 offset)，
+    # 此時 container 是依欄位順序存放 value 的 list，key 為欄位的索引。
+    # stack 保存外層容器的這四個狀態
+    container = None
+    remaining = 0
+    key = _NOTHING
+    is_list = False
+    record = None
+    stack = []
+    while True:
+        if offset >= end:
+            raise OutOfData("Unexpected end of data", offset + 1)
+        first = b[offset]
+        kind = kinds[first]
+        if kind == _EXT:
+            obj, offset = table[first](b, offset, max_depth - len(stack))
+        elif kind:
+            if len(stack) >= max_depth:
+                raise ValueError("Maximum nesting depth exceeded: %d" % max_depth)
+            length, offset = table[first](b, offset)
+            obj = [] if kind == _ARRAY else {}
+            if length:
+                stack.append((container, remaining, key, record))
+                container = obj
+                remaining = length
+                key = _NOTHING
+                is_list = kind == _ARRAY
+                record = None
+                if not is_list and records is not None and length in records and offset < end \
+                        and not kinds[b[offset]]:
+                    # 先讀取第一個 key，依此選擇已註冊的類別
+                    start = offset
+                    key, offset = key_table[b[offset]](b, offset)
+                    try:
+                        spec = records[length].get(key)
+                    except TypeError:
+                        spec = None
+                    if spec is not None:
+                        container = [_NOTHING] * length
+                        record = (spec, start)
+                        key = spec[0][key]
+                obj = _NOTHING  # 新容器尚無元素，直接進入下方的填入迴圈
+        else:
+            obj, offset = table[first](b, offset)
+        # 將完成的物件放回目前容器，並在此直接解碼連續的純量元素，
+        # 遇到子容器才回到外層迴圈；容器填滿後再往上一層
+        while True:
+            if container is None:
+                return obj, offset
+            if is_list:
+                if obj is not _NOTHING:
+                    container.append(obj)
+                    remaining -= 1
+                while remaining and offset < end and not kinds[b[offset]]:
+                    obj, offset = table[b[offset]](b, offset)
+                    container.append(obj)
+                    remaining -= 1
+            elif record is None:
+                if obj is not _NOTHING:
+                    if key is _NOTHING:
+                        key = obj
+                    else:
+                        container[key] = obj
+                        key = _NOTHING
+                        remaining -= 1
+                while remaining and offset < end:
+                    if key is _NOTHING:
+                        first = b[offset]
+                        if kinds[first]:
+                            break
+                        key, offset = key_table[first](b, offset)
+                        if offset >= end:
+                            break
+                    first = b[offset]
+                    if kinds[first]:
+                        break
+                    obj, offset = table[first](b, offset)
+                    container[key] = obj
+                    key = _NOTHING
+                    remaining -= 1
+            else:
+                index = record[0][0]
+                if obj is not _NOTHING:
+                    if key is _NOTHING:
+                        key = _record_slot(index, obj, container)
+                    else:
+                        container[key] = obj
+                        key = _NOTHING
+                        remaining -= 1
+                while remaining and offset < end and key is not None:
+                    if key is _NOTHING:
+                        first = b[offset]
+                        if kinds[first]:
+                            break
+                        key, offset = key_table[first](b, offset)
+                        key = _record_slot(index, key, container)
+                        if key is None or offset >= end:
+                            break
+                    first = b[offset]
+                    if kinds[first]:
+                        break
+                    obj, offset = table[first](b, offset)
+                    container[key] = obj
+                    key = _NOTHING
+                    remaining -= 1
+                if key is None:
+                    offset = record[1]
+                    remaining = len(index)
+                    spec = record[0][2]
+                    # 從第一個 key 重新解碼（以 key_table，與其餘的 key 相同）
+                    key, offset = key_table[b[offset]](b, offset)
+                    if spec is None:
+                        # key 集合與所有候選類別皆不符：以一般的 dict 解碼此 map
+                        container = {}
+                        record = None
+                    else:
+                        # 改試下一個含有第一個 key 的類別
+                        container = [_NOTHING] * remaining
+                        key = spec[0][key]
+                        record = (spec, record[1])
+                    break
+            if remaining:
+                break
+            obj = container if record is None else record[0][1](container)
+            container, remaining, key, record = stack.pop()
+            is_list = type(container) is list and record is None
+
+def _record_slot(index, key, values):
+    """回傳 key 對應的欄位索引；不屬於該類別或重複出現時回傳 None"""
+    try:
+        slot = index.get(key)
+    except TypeError:
+        return None
+    if slot is None or values[slot] is not _NOTHING:
+        return None
+    return slot
+
+# 以下為各格式的解碼函式，皆為 handler(b, offset) -> (obj, new_offset)，
+# 由解碼表依第一個 byte 直接查表取得。容器與 bin/ext 的解碼函式
+# 由 _build_dispatch() 依解碼選項產生。
+
+def _unpack_positive_fixint(b, offset):
+    return b[offset], offset + 1
+
+def _unpack_negative_fixint(b, offset):
+    return b[offset] - 0x100, offset + 1
+
+def _unpack_nil(b, offset):
+    return None, offset + 1
+
+def _unpack_false(b, offset):
+    return False, offset + 1
+
+def _unpack_true(b, offset):
+    return True, offset + 1
+
+def _unpack_reserved(b, offset):
+    raise ValueError("Reserved byte encountered: 0xc1")
+
+def _unpack_fixstr(b, offset):
+    length = b[offset] & 0x1f
+    offset += 1
+    if offset + length > len(b):
+        raise OutOfData("Insufficient bytes for fixstr data", offset + length)
+    return str(b[offset:offset+length], "utf-8"), offset + length
+
+def _unpack_uint8(b, offset):
+    if offset + 2 > len(b):
+        raise OutOfData("Insufficient bytes for uint8", offset + 2)
+    return b[offset+1], offset + 2
+
+def _make_scalar(st, name):
+    """建立固定長度數值（int/uint/float）的解碼函式"""
+    size = st.size + 1
+    unpack_from = st.unpack_from
+    def handler(b, offset):
+        if offset + size > len(b):
+            raise OutOfData("Insufficient bytes for " + name, offset + size)
+        return unpack_from(b, offset + 1)[0], offset + size
+    return handler
+
+def _limit_error(name, length, limit):
+    return ValueError("%s length %d exceeds limit %d" % (name, length, limit))
+
+def _make_fix_limited(handler, name, mask, limit):
+    """為 fixstr/fixarray/fixmap 的解碼函式加上長度上限（上限小於格式本身的最大值時才需要）"""
+    def limited(b, offset):
+        length = b[offset] & mask
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        return handler(b, offset)
+    return limited
+
+# unpack() 的 strings 參數可用的值
+_STRING_MODES = ("str", "raw", "lazy")
+
+def _make_fixstr(strings, copy):
+    """建立 fixstr 的解碼函式；strings 為 "raw" 或 "lazy" 時不解碼 UTF-8"""
+    if strings == "str":
+        return _unpack_fixstr
+    lazy = strings == "lazy"
+    def handler(b, offset):
+        length = b[offset] & 0x1f
         offset += 1
-        s = b[offset:offset+length].decode("utf-8")
-        return s, offset + length
-    # nil (0xc0)
-    elif first == 0xc0:
-        return None, offset + 1
-    # reserved (0xc1) -> 未使用，拋出例外
-    elif first == 0xc1:
-        raise ValueError("Reserved byte encountered: 0xc1")
-    # false (0xc2)
-    elif first == 0xc2:
-        return False, offset + 1
-    # true (0xc3)
-    elif first == 0xc3:
-        return True, offset + 1
-    # bin 8 (0xc4)
-    elif first == 0xc4:
-        if offset + 2 > len(b):
-            raise ValueError("Insufficient bytes for bin 8")
-        length = b[offset+1]
-        offset += 2
         if offset + length > len(b):
-            raise ValueError("Insufficient bytes for bin8 data")
+            raise OutOfData("Insufficient bytes for fixstr data", offset + length)
         data = b[offset:offset+length]
-        return data, offset + length
-    # bin 16 (0xc5)
-    elif first == 0xc5:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for bin 16")
-        length = struct.unpack(">H", b[offset+1:offset+3])[0]
-        offset += 3
+        if copy:
+            data = bytes(data)
+        return (LazyStr(data) if lazy else data), offset + length
+    return handler
+
+def _make_str(st, name, limit=_MAX_LENGTH, strings="str", copy=True):
+    """
+    建立 str 8/16/32 的解碼函式；st 為 None 表示長度欄位為 1 byte。
+    strings: "str" 解碼為 str；"raw" 回傳原始的 bytes（copy 為 False 時為輸入的切片）；
+    "lazy" 回傳包裝原始 bytes 的 LazyStr。後兩者不做 UTF-8 解碼與檢查。
+    """
+    head = (st.size if st else 1) + 1
+    if strings != "str":
+        lazy = strings == "lazy"
+        def raw_handler(b, offset):
+            if offset + head > len(b):
+                raise OutOfData("Insufficient bytes for " + name + " length", offset + head)
+            length = st.unpack_from(b, offset + 1)[0] if st else b[offset+1]
+            if length > limit:
+                raise _limit_error(name, length, limit)
+            offset += head
+            if offset + length > len(b):
+                raise OutOfData("Insufficient bytes for " + name + " data", offset + length)
+            data = b[offset:offset+length]
+            if copy:
+                data = bytes(data)
+            return (LazyStr(data) if lazy else data), offset + length
+        return raw_handler
+    def handler(b, offset):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for " + name + " length", offset + head)
+        length = st.unpack_from(b, offset + 1)[0] if st else b[offset+1]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        offset += head
         if offset + length > len(b):
-            raise ValueError("Insufficient bytes for bin16 data")
-        data = b[offset:offset+length]
-        return data, offset + length
-    # bin 32 (0xc6)
-    elif first == 0xc6:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for bin 32")
-        length = struct.unpack(">I", b[offset+1:offset+5])[0]
-        offset += 5
+            raise OutOfData("Insufficient bytes for " + name + " data", offset + length)
+        return str(b[offset:offset+length], "utf-8"), offset + length
+    return handler
+
+def _make_bin(st, name, copy, limit=_MAX_LENGTH):
+    """建立 bin 8/16/32 的解碼函式；copy 為 False 時直接回傳輸入的切片"""
+    head = (st.size if st else 1) + 1
+    def handler(b, offset):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for " + name, offset + head)
+        length = st.unpack_from(b, offset + 1)[0] if st else b[offset+1]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        offset += head
         if offset + length > len(b):
-            raise ValueError("Insufficient bytes for bin32 data")
+            raise OutOfData("Insufficient bytes for " + name.replace(" ", "") + " data", offset + length)
         data = b[offset:offset+length]
-        return data, offset + length
-    # ext 8 (0xc7)
-    elif first == 0xc7:
-        if offset + 2 > len(b):
-            raise ValueError("Insufficient bytes for ext 8 length")
-        length = b[offset+1]
-        if offset + 3 + length > len(b):
-            raise ValueError("Insufficient bytes for ext8 data")
-        ext_type = struct.unpack("b", b[offset+2:offset+3])[0]
-        data = b[offset+3:offset+3+length]
-        return Ext(ext_type, data), offset + 3 + length
-    # ext 16 (0xc8)
-    elif first == 0xc8:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for ext 16 length")
-        length = struct.unpack(">H", b[offset+1:offset+3])[0]
-        if offset + 4 + length > len(b):
-            raise ValueError("Insufficient bytes for ext16 data")
-        ext_type = struct.unpack("b", b[offset+3:offset+4])[0]
-        data = b[offset+4:offset+4+length]
-        return Ext(ext_type, data), offset + 4 + length
-    # ext 32 (0xc9)
-    elif first == 0xc9:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for ext 32 length")
-        length = struct.unpack(">I", b[offset+1:offset+5])[0]
-        if offset + 6 + length > len(b):
-            raise ValueError("Insufficient bytes for ext32 data")
-        ext_type = struct.unpack("b", b[offset+5:offset+6])[0]
-        data = b[offset+6:offset+6+length]
-        return Ext(ext_type, data), offset + 6 + length
-    # float 32 (0xca)
-    elif first == 0xca:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for float32")
-        value = struct.unpack(">f", b[offset+1:offset+5])[0]
-        return value, offset + 5
-    # float 64 (0xcb)
-    elif first == 0xcb:
-        if offset + 9 > len(b):
-            raise ValueError("Insufficient bytes for float64")
-        value = struct.unpack(">d", b[offset+1:offset+9])[0]
-        return value, offset + 9
-    # uint 8 (0xcc)
-    elif first == 0xcc:
-        if offset + 2 > len(b):
-            raise ValueError("Insufficient bytes for uint8")
-        value = b[offset+1]
-        return value, offset + 2
-    # uint 16 (0xcd)
-    elif first == 0xcd:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for uint16")
-        value = struct.unpack(">H", b[offset+1:offset+3])[0]
-        return value, offset + 3
-    # uint 32 (0xce)
-    elif first == 0xce:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for uint32")
-        value = struct.unpack(">I", b[offset+1:offset+5])[0]
-        return value, offset + 5
-    # uint 64 (0xcf)
-    elif first == 0xcf:
-        if offset + 9 > len(b):
-            raise ValueError("Insufficient bytes for uint64")
-        value = struct.unpack(">Q", b[offset+1:offset+9])[0]
-        return value, offset + 9
-    # int 8 (0xd0)
-    elif first == 0xd0:
-        if offset + 2 > len(b):
-            raise ValueError("Insufficient bytes for int8")
-        value = struct.unpack("b", b[offset+1:offset+2])[0]
-        return value, offset + 2
-    # int 16 (0xd1)
-    elif first == 0xd1:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for int16")
-        value = struct.unpack(">h", b[offset+1:offset+3])[0]
-        return value, offset + 3
-    # int 32 (0xd2)
-    elif first == 0xd2:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for int32")
-        value = struct.unpack(">i", b[offset+1:offset+5])[0]
-        return value, offset + 5
-    # int 64 (0xd3)
-    elif first == 0xd3:
-        if offset + 9 > len(b):
-            raise ValueError("Insufficient bytes for int64")
-        value = struct.unpack(">q", b[offset+1:offset+9])[0]
-        return value, offset + 9
-    # fixext 1 (0xd4)
-    elif first == 0xd4:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for fixext 1")
-        ext_type = struct.unpack("b", b[offset+1:offset+2])[0]
-        data = b[offset+2:offset+3]
-        return Ext(ext_type, data), offset + 3
-    # fixext 2 (0xd5)
-    elif first == 0xd5:
-        if offset + 4 > len(b):
-            raise ValueError("Insufficient bytes for fixext 2")
-        ext_type = struct.unpack("b", b[offset+1:offset+2])[0]
-        data = b[offset+2:offset+4]
-        return Ext(ext_type, data), offset + 4
-    # fixext 4 (0xd6)
-    elif first == 0xd6:
-        if offset + 6 > len(b):
-            raise ValueError("Insufficient bytes for fixext 4")
-        ext_type = struct.unpack("b", b[offset+1:offset+2])[0]
-        data = b[offset+2:offset+6]
-        return Ext(ext_type, data), offset + 6
-    # fixext 8 (0xd7)
-    elif first == 0xd7:
-        if offset + 10 > len(b):
-            raise ValueError("Insufficient bytes for fixext 8")
-        ext_type = struct.unpack("b", b[offset+1:offset+2])[0]
-        data = b[offset+2:offset+10]
-        return Ext(ext_type, data), offset + 10
-    # fixext 16 (0xd8)
-    elif first == 0xd8:
-        if offset + 18 > len(b):
-            raise ValueError("Insufficient bytes for fixext 16")
-        ext_type = struct.unpack("b", b[offset+1:offset+2])[0]
-        data = b[offset+2:offset+18]
-        return Ext(ext_type, data), offset + 18
-    # str 8 (0xd9)
-    elif first == 0xd9:
-        if offset + 2 > len(b):
-            raise ValueError("Insufficient bytes for str8 length")
-        length = b[offset+1]
-        offset += 2
-        s = b[offset:offset+length].decode("utf-8")
-        return s, offset + length
-    # str 16 (0xda)
-    elif first == 0xda:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for str16 length")
-        length = struct.unpack(">H", b[offset+1:offset+3])[0]
-        offset += 3
-        s = b[offset:offset+length].decode("utf-8")
-        return s, offset + length
-    # str 32 (0xdb)
-    elif first == 0xdb:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for str32 length")
-        length = struct.unpack(">I", b[offset+1:offset+5])[0]
-        offset += 5
-        s = b[offset:offset+length].decode("utf-8")
-        return s, offset + length
-    # array 16 (0xdc)
-    elif first == 0xdc:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for array16 length")
-        length = struct.unpack(">H", b[offset+1:offset+3])[0]
-        offset += 3
-        result = []
-        for _ in range(length):
-            item, offset = _unpack(b, offset)
-            result.append(item)
-        return result, offset
-    # array 32 (0xdd)
-    elif first == 0xdd:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for array32 length")
-        length = struct.unpack(">I", b[offset+1:offset+5])[0]
-        offset += 5
-        result = []
-        for _ in range(length):
-            item, offset = _unpack(b, offset)
-            result.append(item)
-        return result, offset
-    # map 16 (0xde)
-    elif first == 0xde:
-        if offset + 3 > len(b):
-            raise ValueError("Insufficient bytes for map16 length")
-        length = struct.unpack(">H", b[offset+1:offset+3])[0]
-        offset += 3
-        result = {}
-        for _ in range(length):
-            key, offset = _unpack(b, offset)
-            value, offset = _unpack(b, offset)
-            result[key] = value
-        return result, offset
-    # map 32 (0xdf)
-    elif first == 0xdf:
-        if offset + 5 > len(b):
-            raise ValueError("Insufficient bytes for map32 length")
-        length = struct.unpack(">I", b[offset+1:offset+5])[0]
-        offset += 5
-        result = {}
-        for _ in range(length):
-            key, offset = _unpack(b, offset)
-            value, offset = _unpack(b, offset)
-            result[key] = value
-        return result, offset
-    # negative fixint (0xe0 - 0xff)
-    elif first >= 0xe0:
-        return struct.unpack("b", bytes([first]))[0], offset + 1
+        return (bytes(data) if copy else data), offset + length
+    return handler
+
+def _make_library_exts(table, array_limit):
+    """
+    回傳 library_exts 的轉換函式 convert(ext_type, data, max_depth)：本函式庫的擴充型別
+    轉為對應的物件，其他回傳 Ext。EXT_COLUMNS 的內容以 table（含 limits）與剩餘深度解碼；
+    轉換結果的元素數同樣受 array_limit（Limits.max_array_len）限制。
+    """
+    def convert(ext_type, data, max_depth):
+        if ext_type == EXT_COLUMNS:
+            return _unpack_column_rows(data, table, max_depth, array_limit)
+        decoder = _EXT_DECODERS.get(ext_type)
+        if decoder is None:
+            return Ext(ext_type, data)
+        obj = decoder(data)
+        if len(obj) > array_limit:
+            raise _limit_error("ext %d" % ext_type, len(obj), array_limit)
+        return obj
+    return convert
+
+def _make_ext(st, name, copy, limit=_MAX_LENGTH, convert=None):
+    """
+    建立 ext 8/16/32 的解碼函式；convert 為選用的 _make_library_exts() 轉換函式，
+    此時 handler 的 max_depth 參數為 ext 所在位置剩餘的深度。
+    """
+    head = (st.size if st else 1) + 1
+    def handler(b, offset, max_depth=0):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for " + name + " length", offset + head)
+        length = st.unpack_from(b, offset + 1)[0] if st else b[offset+1]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        offset += head
+        if offset + 1 + length > len(b):
+            raise OutOfData("Insufficient bytes for " + name.replace(" ", "") + " data", offset + 1 + length)
+        ext_type = _S_INT8.unpack_from(b, offset)[0]
+        data = b[offset+1:offset+1+length]
+        if copy:
+            data = bytes(data)
+        return (convert(ext_type, data, max_depth) if convert else Ext(ext_type, data)), offset + 1 + length
+    return handler
+
+def _make_fixext(length, copy, limit=_MAX_LENGTH, convert=None):
+    """建立 fixext 1/2/4/8/16 的解碼函式；convert 同 _make_ext()"""
+    size = length + 2
+    if length > limit:
+        def over_limit(b, offset, max_depth=0):
+            raise _limit_error("fixext %d" % length, length, limit)
+        return over_limit
+    def handler(b, offset, max_depth=0):
+        if offset + size > len(b):
+            raise OutOfData("Insufficient bytes for fixext %d" % length, offset + size)
+        ext_type = _S_INT8.unpack_from(b, offset + 1)[0]
+        data = b[offset+2:offset+size]
+        if copy:
+            data = bytes(data)
+        return (convert(ext_type, data, max_depth) if convert else Ext(ext_type, data)), offset + size
+    return handler
+
+def _unpack_fixmap(b, offset):
+    return b[offset] & 0x0f, offset + 1
+
+_unpack_fixarray = _unpack_fixmap
+
+def _make_container(st, name, per_item, limit=_MAX_LENGTH):
+    """
+    建立 array/map 16/32 的標頭解碼函式；per_item 為每個元素至少佔用的 byte 數
+    （map 為 2）。宣告的元素數超過剩餘資料可容納的數量時，不逐一解碼，直接拋出 OutOfData。
+    """
+    head = st.size + 1
+    unpack_from = st.unpack_from
+    def handler(b, offset):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for " + name + " length", offset + head)
+        length = unpack_from(b, offset + 1)[0]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        offset += head
+        if length * per_item > len(b) - offset:
+            raise OutOfData("Insufficient bytes for %d %s elements" % (length, name), offset + length * per_item)
+        return length, offset
+    return handler
+
+def _build_dispatch(zero_copy=False, limits=_DEFAULT_LIMITS, strings="str", library_exts=False):
+    """
+    依解碼選項建立 256 項的解碼表。
+    zero_copy: bin/ext 資料直接回傳輸入的切片（搭配 memoryview 輸入即不複製）。
+    limits: 各格式的長度上限。
+    strings: str 的解碼方式，見 unpack()。
+    library_exts: 是否轉換本函式庫的擴充型別；解碼時需搭配 _KIND_LIBRARY。
+    """
+    if strings not in _STRING_MODES:
+        raise ValueError("strings must be one of %s" % ", ".join(map(repr, _STRING_MODES)))
+    copy = not zero_copy
+    str_limit, bin_limit, ext_limit, array_limit, map_limit = limits._key()
+    table = [None] * 256
+    decoders = _make_library_exts(table, array_limit) if library_exts else None
+    for i in range(0x00, 0x80):
+        table[i] = _unpack_positive_fixint
+    for i in range(0x80, 0x90):
+        table[i] = _unpack_fixmap
+    for i in range(0x90, 0xa0):
+        table[i] = _unpack_fixarray
+    fixstr = _make_fixstr(strings, copy)
+    for i in range(0xa0, 0xc0):
+        table[i] = fixstr
+    for i in range(0xe0, 0x100):
+        table[i] = _unpack_negative_fixint
+    table[0xc0] = _unpack_nil
+    table[0xc1] = _unpack_reserved
+    table[0xc2] = _unpack_false
+    table[0xc3] = _unpack_true
+    table[0xc4] = _make_bin(None, "bin 8", copy, bin_limit)
+    table[0xc5] = _make_bin(_S_UINT16, "bin 16", copy, bin_limit)
+    table[0xc6] = _make_bin(_S_UINT32, "bin 32", copy, bin_limit)
+    table[0xc7] = _make_ext(None, "ext 8", copy, ext_limit, decoders)
+    table[0xc8] = _make_ext(_S_UINT16, "ext 16", copy, ext_limit, decoders)
+    table[0xc9] = _make_ext(_S_UINT32, "ext 32", copy, ext_limit, decoders)
+    table[0xca] = _make_scalar(_S_FLOAT32, "float32")
+    table[0xcb] = _make_scalar(_S_FLOAT64, "float64")
+    table[0xcc] = _unpack_uint8
+    table[0xcd] = _make_scalar(_S_UINT16, "uint16")
+    table[0xce] = _make_scalar(_S_UINT32, "uint32")
+    table[0xcf] = _make_scalar(_S_UINT64, "uint64")
+    table[0xd0] = _make_scalar(_S_INT8, "int8")
+    table[0xd1] = _make_scalar(_S_INT16, "int16")
+    table[0xd2] = _make_scalar(_S_INT32, "int32")
+    table[0xd3] = _make_scalar(_S_INT64, "int64")
+    table[0xd4] = _make_fixext(1, copy, ext_limit, decoders)
+    table[0xd5] = _make_fixext(2, copy, ext_limit, decoders)
+    table[0xd6] = _make_fixext(4, copy, ext_limit, decoders)
+    table[0xd7] = _make_fixext(8, copy, ext_limit, decoders)
+    table[0xd8] = _make_fixext(16, copy, ext_limit, decoders)
+    table[0xd9] = _make_str(None, "str8", str_limit, strings, copy)
+    table[0xda] = _make_str(_S_UINT16, "str16", str_limit, strings, copy)
+    table[0xdb] = _make_str(_S_UINT32, "str32", str_limit, strings, copy)
+    table[0xdc] = _make_container(_S_UINT16, "array16", 1, array_limit)
+    table[0xdd] = _make_container(_S_UINT32, "array32", 1, array_limit)
+    table[0xde] = _make_container(_S_UINT16, "map16", 2, map_limit)
+    table[0xdf] = _make_container(_S_UINT32, "map32", 2, map_limit)
+    _apply_fix_limits(table, limits)
+    return table
+
+def _apply_fix_limits(table, limits):
+    """上限小於 fixstr/fixarray/fixmap 本身的最大長度時，為這些項目加上檢查"""
+    for first, last, mask, name, limit in ((0xa0, 0xbf, 0x1f, "fixstr", limits.max_str_len),
+                                           (0x90, 0x9f, 0x0f, "fixarray", limits.max_array_len),
+                                           (0x80, 0x8f, 0x0f, "fixmap", limits.max_map_len)):
+        if limit < mask:
+            handler = _make_fix_limited(table[first], name, mask, limit)
+            for i in range(first, last + 1):
+                table[i] = handler
+
+_DISPATCH = _build_dispatch()
+_DISPATCH_ZERO_COPY = _build_dispatch(zero_copy=True)
+
+# 依 (zero_copy, 上限, str 的解碼方式, 是否轉換本函式庫的擴充型別) 快取的解碼表
+_DISPATCH_CACHE = {(False, _DEFAULT_LIMITS._key(), "str", False): _DISPATCH,
+                   (True, _DEFAULT_LIMITS._key(), "str", False): _DISPATCH_ZERO_COPY}
+
+def _dispatch_table(zero_copy, limits, strings="str", library_exts=False):
+    """取得符合選項的解碼表；limits 為 None 時使用預設（不設限）的表"""
+    if limits is None:
+        if strings == "str" and not library_exts:
+            return _DISPATCH_ZERO_COPY if zero_copy else _DISPATCH
+        limits = _DEFAULT_LIMITS
+    key = (bool(zero_copy), limits._key(), strings, bool(library_exts))
+    table = _DISPATCH_CACHE.get(key)
+    if table is None:
+        table = _DISPATCH_CACHE[key] = _build_dispatch(zero_copy, limits, strings, library_exts)
+    return table
+
+# ---- 略過與延遲解碼 ----
+# 略過表：handler(b, offset) -> (new_offset, children)，children 為其後
+# 尚需略過的子元素數量（array 為長度、map 為長度的兩倍），不建立任何物件。
+
+def _make_skip_fixed(size):
+    def handler(b, offset):
+        return offset + size, 0
+    return handler
+
+def _make_skip_sized(st, extra, name="", limit=_MAX_LENGTH, check_utf8=False):
+    """
+    略過 str/bin/ext 8/16/32；extra 為長度欄位之後、資料之前的 byte 數。
+    check_utf8 為 True 時（validate() 使用）確認資料是合法的 UTF-8。
+    """
+    head = (st.size if st else 1) + 1
+    def handler(b, offset):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for length", offset + head)
+        length = st.unpack_from(b, offset + 1)[0] if st else b[offset+1]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        end = offset + head + extra + length
+        if check_utf8 and end <= len(b):
+            str(b[offset+head:end], "utf-8")
+        return end, 0
+    return handler
+
+def _make_skip_container(st, per_item, name="", limit=_MAX_LENGTH):
+    head = st.size + 1
+    def handler(b, offset):
+        if offset + head > len(b):
+            raise OutOfData("Insufficient bytes for container length", offset + head)
+        length = st.unpack_from(b, offset + 1)[0]
+        if length > limit:
+            raise _limit_error(name, length, limit)
+        offset += head
+        children = length * per_item
+        if children > len(b) - offset:
+            raise OutOfData("Insufficient bytes for %d %s elements" % (length, name), offset + children)
+        return offset, children
+    return handler
+
+def _skip_fixstr_utf8(b, offset):
+    end = offset + 1 + (b[offset] & 0x1f)
+    if end <= len(b):
+        str(b[offset+1:end], "utf-8")
+    return end, 0
+
+def _skip_fixstr(b, offset):
+    return offset + 1 + (b[offset] & 0x1f), 0
+
+def _skip_fixarray(b, offset):
+    return offset + 1, b[offset] & 0x0f
+
+def _skip_fixmap(b, offset):
+    return offset + 1, (b[offset] & 0x0f) * 2
+
+def _build_skip(limits=_DEFAULT_LIMITS, check_utf8=False):
+    str_limit, bin_limit, ext_limit, array_limit, map_limit = limits._key()
+    table = [_make_skip_fixed(1)] * 256
+    for i in range(0x80, 0x90):
+        table[i] = _skip_fixmap
+    for i in range(0x90, 0xa0):
+        table[i] = _skip_fixarray
+    for i in range(0xa0, 0xc0):
+        table[i] = _skip_fixstr_utf8 if check_utf8 else _skip_fixstr
+    table[0xc1] = _unpack_reserved
+    table[0xc4] = _make_skip_sized(None, 0, "bin 8", bin_limit)
+    table[0xc5] = _make_skip_sized(_S_UINT16, 0, "bin 16", bin_limit)
+    table[0xc6] = _make_skip_sized(_S_UINT32, 0, "bin 32", bin_limit)
+    table[0xc7] = _make_skip_sized(None, 1, "ext 8", ext_limit)
+    table[0xc8] = _make_skip_sized(_S_UINT16, 1, "ext 16", ext_limit)
+    table[0xc9] = _make_skip_sized(_S_UINT32, 1, "ext 32", ext_limit)
+    for code, size in ((0xca, 5), (0xcb, 9), (0xcc, 2), (0xcd, 3), (0xce, 5), (0xcf, 9),
+                       (0xd0, 2), (0xd1, 3), (0xd2, 5), (0xd3, 9),
+                       (0xd4, 3), (0xd5, 4), (0xd6, 6), (0xd7, 10), (0xd8, 18)):
+        table[code] = _make_skip_fixed(size)
+    for code, length in ((0xd4, 1), (0xd5, 2), (0xd6, 4), (0xd7, 8), (0xd8, 16)):
+        if length > ext_limit:
+            table[code] = _make_fixext(length, False, ext_limit)
+    table[0xd9] = _make_skip_sized(None, 0, "str8", str_limit, check_utf8)
+    table[0xda] = _make_skip_sized(_S_UINT16, 0, "str16", str_limit, check_utf8)
+    table[0xdb] = _make_skip_sized(_S_UINT32, 0, "str32", str_limit, check_utf8)
+    table[0xdc] = _make_skip_container(_S_UINT16, 1, "array16", array_limit)
+    table[0xdd] = _make_skip_container(_S_UINT32, 1, "array32", array_limit)
+    table[0xde] = _make_skip_container(_S_UINT16, 2, "map16", map_limit)
+    table[0xdf] = _make_skip_container(_S_UINT32, 2, "map32", map_limit)
+    _apply_fix_limits(table, limits)
+    return table
+
+_SKIP = _build_skip()
+
+# 依 (上限, 是否檢查 UTF-8) 快取的略過表
+_SKIP_CACHE = {(_DEFAULT_LIMITS._key(), False): _SKIP}
+
+def _skip_table(limits, check_utf8=False):
+    key = ((limits or _DEFAULT_LIMITS)._key(), check_utf8)
+    table = _SKIP_CACHE.get(key)
+    if table is None:
+        table = _SKIP_CACHE[key] = _build_skip(limits or _DEFAULT_LIMITS, check_utf8)
+    return table
+
+def skip(b, offset=0):
+    """
+    略過 offset 處的一個完整物件，回傳其後的 offset。
+    只讀取長度欄位，不建立任何 Python 物件；巢狀容器以計數方式走訪，不遞迴。
+    """
+    table = _SKIP
+    end = len(b)
+    remaining = 1
+    while remaining:
+        if offset >= end:
+            raise OutOfData("Unexpected end of data", offset + 1)
+        offset, children = table[b[offset]](b, offset)
+        remaining += children - 1
+    if offset > end:
+        raise OutOfData("Unexpected end of data", offset)
+    return offset
+
+# ---- 統計 ----
+
+def _build_format_names():
+    names = [None] * 256
+    for first, last, name in ((0x00, 0x7f, "positive fixint"), (0x80, 0x8f, "fixmap"),
+                              (0x90, 0x9f, "fixarray"), (0xa0, 0xbf, "fixstr"),
+                              (0xe0, 0xff, "negative fixint")):
+        for i in range(first, last + 1):
+            names[i] = name
+    for code, name in ((0xc0, "nil"), (0xc1, "(never used)"), (0xc2, "false"), (0xc3, "true"),
+                       (0xc4, "bin 8"), (0xc5, "bin 16"), (0xc6, "bin 32"),
+                       (0xc7, "ext 8"), (0xc8, "ext 16"), (0xc9, "ext 32"),
+                       (0xca, "float 32"), (0xcb, "float 64"),
+                       (0xcc, "uint 8"), (0xcd, "uint 16"), (0xce, "uint 32"), (0xcf, "uint 64"),
+                       (0xd0, "int 8"), (0xd1, "int 16"), (0xd2, "int 32"), (0xd3, "int 64"),
+                       (0xd4, "fixext 1"), (0xd5, "fixext 2"), (0xd6, "fixext 4"),
+                       (0xd7, "fixext 8"), (0xd8, "fixext 16"),
+                       (0xd9, "str 8"), (0xda, "str 16"), (0xdb, "str 32"),
+                       (0xdc, "array 16"), (0xdd, "array 32"), (0xde, "map 16"), (0xdf, "map 32")):
+        names[code] = name
+    return names
+
+# 前導 byte -> MessagePack 規格中的格式名稱
+_FORMAT_NAMES = _build_format_names()
+
+class Stats:
+    """
+    編碼/解碼統計，傳給 Packer、unpack() 或 Unpacker 的 stats 參數後啟用。
+    未啟用時每次呼叫只多一次 None 判斷；啟用時每次最上層呼叫結束後，
+    以略過表再走訪一次該次的資料（成本約同 skip()）。
+
+    calls / seconds: 各操作（"pack"、"unpack"）的呼叫次數與累計時間。
+    slowest: 各操作最慢一次的 (秒數, bytes 數)。
+    formats: 格式名稱 -> [次數, bytes 數]；容器只計標頭，元素分別計入各自的格式。
+    max_depth: 最深的容器巢狀層數（最外層容器為 1）。
+    largest_container: 最大的 array 元素數或 map 項目數。
+    hook: 選用的 callback，每次最上層呼叫後以 (操作, bytes 數, 秒數) 呼叫。
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        """清除所有統計"""
+        self.calls = {"pack": 0, "unpack": 0}
+        self.seconds = {"pack": 0.0, "unpack": 0.0}
+        self.slowest = {"pack": (0.0, 0), "unpack": (0.0, 0)}
+        self.formats = {}
+        self.max_depth = 0
+        self.largest_container = 0
+
+    def _record(self, operation, b, start, end, seconds):
+        """記錄一次最上層呼叫：b[start:end] 為該次編碼輸出或解碼消耗的資料"""
+        size = end - start
+        self.calls[operation] += 1
+        self.seconds[operation] += seconds
+        if seconds > self.slowest[operation][0]:
+            self.slowest[operation] = (seconds, size)
+        self._scan(b, start, end)
+        if self.hook is not None:
+            self.hook(operation, size, seconds)
+
+    def _scan(self, b, offset, end):
+        table = _SKIP
+        kinds = _KIND
+        names = _FORMAT_NAMES
+        formats = self.formats
+        max_depth = self.max_depth
+        largest = self.largest_container
+        # remaining 為目前容器尚未走訪的子元素數，stack 保存外層容器的 remaining
+        remaining = 0
+        stack = []
+        while offset < end:
+            first = b[offset]
+            new_offset, children = table[first](b, offset)
+            name = names[first]
+            entry = formats.get(name)
+            if entry is None:
+                entry = formats[name] = [0, 0]
+            entry[0] += 1
+            entry[1] += new_offset - offset
+            offset = new_offset
+            if remaining:
+                remaining -= 1
+            kind = kinds[first]
+            if kind:
+                if len(stack) + 1 > max_depth:
+                    max_depth = len(stack) + 1
+                length = children >> 1 if kind == _MAP else children
+                if length > largest:
+                    largest = length
+                if children:
+                    stack.append(remaining)
+                    remaining = children
+            while not remaining and stack:
+                remaining = stack.pop()
+        self.max_depth = max_depth
+        self.largest_container = largest
+
+    def summary(self):
+        """回傳可讀的統計摘要（多行文字）"""
+        lines = []
+        for operation in ("pack", "unpack"):
+            calls = self.calls[operation]
+            if calls:
+                slowest, size = self.slowest[operation]
+                lines.append("%s：%d 次，共 %.6f s，平均 %.6f s，最慢 %.6f s（%d bytes）" % (
+                    operation, calls, self.seconds[operation], self.seconds[operation] / calls,
+                    slowest, size))
+        lines.append("最大深度：%d，最大容器：%d 個元素" % (self.max_depth, self.largest_container))
+        if self.formats:
+            # 中文標題每字佔兩格寬，欄寬因此少算兩字
+            lines.append("%-14s %10s %14s" % ("格式", "次數", "bytes"))
+            for name, (count, size) in sorted(self.formats.items(), key=lambda item: -item[1][1]):
+                lines.append("%-16s %12d %14d" % (name, count, size))
+        return "\n".join(lines)
+
+def validate(b, max_depth=DEFAULT_MAX_DEPTH, limits=None, library_exts=False):
+    """
+    確認 b 恰好是一個格式正確的 MessagePack 物件，不建立任何容器或值：
+    檢查長度欄位、保留的前導 byte (0xc1)、str 是否為合法 UTF-8、巢狀深度與 limits，
+    並且其後沒有多餘的資料。格式錯誤時拋出 ValueError（資料不完整時為 OutOfData）。
+    每個 byte 至多檢查一次，惡意宣告的長度在讀到標頭時即被拒絕，耗時與輸入大小成正比。
+    ext 的資料內容預設不在檢查範圍內；library_exts 為 True 時（預計以 unpack(library_exts=True) 解碼），
+    EXT_COLUMNS 內的 MessagePack 資料同樣以剩餘的深度與 limits 檢查，其他本函式庫的擴充型別
+    則實際轉換一次，拒絕 unpack() 會拒絕的內容與超過 max_array_len 的結果。
+    """
+    if limits is None:
+        limits = _DEFAULT_LIMITS
+    else:
+        limits._check_buffer(len(b))
+    table = _skip_table(limits, check_utf8=True)
+    _validate(b, 0, len(b), max_depth, table, _KIND_LIBRARY if library_exts else _KIND, limits.max_array_len)
+
+def _validate(b, offset, end, max_depth, table, kinds, array_limit):
+    """
+    確認 b[offset:end] 恰好是一個物件；kinds 為 _KIND_LIBRARY 時檢查 EXT_COLUMNS 的內容，
+    並轉換其他本函式庫的擴充型別，結果的元素數受 array_limit 限制
+    """
+    # remaining 為目前容器尚未檢查的子元素數，stack 保存外層容器的 remaining
+    remaining = 1
+    stack = []
+    while True:
+        if offset >= end:
+            raise OutOfData("Unexpected end of data", offset + 1)
+        first = b[offset]
+        kind = kinds[first]
+        if kind == _EXT:
+            ext_type, start, data_end = _ext_span(b, offset)
+        elif kind and len(stack) >= max_depth:
+            raise ValueError("Maximum nesting depth exceeded: %d" % max_depth)
+        offset, children = table[first](b, offset)
+        if offset > end:
+            raise OutOfData("Unexpected end of data", offset)
+        if kind == _EXT:
+            if ext_type == EXT_COLUMNS:
+                _validate(b, start, data_end, max_depth - len(stack), table, kinds, array_limit)
+            elif ext_type in _EXT_DECODERS:
+                length = len(_EXT_DECODERS[ext_type](b[start:data_end]))
+                if length > array_limit:
+                    raise _limit_error("ext %d" % ext_type, length, array_limit)
+        remaining -= 1
+        if children:
+            stack.append(remaining)
+            remaining = children
+        while not remaining:
+            if not stack:
+                if offset != end:
+                    raise ValueError("Extra bytes found")
+                return
+            remaining = stack.pop()
+
+def _container_header(b, offset):
+    """讀取容器標頭，回傳 (是否為 map, 長度, 第一個元素的 offset)；非容器回傳 None"""
+    kind = _KIND[b[offset]]
+    if not kind:
+        return None
+    length, start = _DISPATCH[b[offset]](b, offset)
+    return kind == _MAP, length, start
+
+def _lazy_at(b, offset):
+    """容器回傳延遲解碼的檢視，其餘值直接解碼"""
+    if offset >= len(b):
+        raise OutOfData("Unexpected end of data", offset + 1)
+    header = _container_header(b, offset)
+    if header is None:
+        return _DISPATCH[b[offset]](b, offset)[0]
+    is_map, length, start = header
+    return (LazyMap if is_map else LazyArray)(b, offset, length, start)
+
+class _LazyContainer:
+    """LazyMap 與 LazyArray 的共用部分：記錄所在 buffer 與 offset"""
+    def __init__(self, b, offset, length, start):
+        self._buf = b
+        self._offset = offset
+        self._length = length
+        self._start = start
+
+    def __len__(self):
+        return self._length
+
+    def to_python(self):
+        """完整解碼成 dict/list"""
+        return _unpack(self._buf, self._offset)[0]
+
+    def raw(self):
+        """回傳此容器在原始 buffer 中的編碼內容（memoryview，不複製）"""
+        return self._buf[self._offset:skip(self._buf, self._offset)]
+
+class LazyArray(_LazyContainer, Sequence):
+    """
+    延遲解碼的 array 檢視。
+    存取時只略過到所需位置為止的元素並記錄其 offset，之後存取更後面的元素時接續記錄；
+    元素在被取用時才解碼，子容器同樣回傳延遲檢視。
+    """
+    _offsets = None
+
+    def _index(self, stop):
+        """記錄前 stop 個元素的 offset，回傳已記錄的 offset list"""
+        offsets = self._offsets
+        if offsets is None:
+            offsets = self._offsets = [self._start]
+        if len(offsets) < stop:
+            b = self._buf
+            offset = offsets[-1]
+            for _ in range(stop - len(offsets)):
+                offset = skip(b, offset)
+                offsets.append(offset)
+        return offsets
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = range(*index.indices(self._length))
+            if not indices:
+                return []
+            offsets = self._index(max(indices) + 1)
+            return [_lazy_at(self._buf, offsets[i]) for i in indices]
+        position = index + self._length if index < 0 else index
+        if not 0 <= position < self._length:
+            raise IndexError("Array index out of range: %d" % index)
+        return _lazy_at(self._buf, self._index(position + 1)[position])
+
+    def __repr__(self):
+        return "LazyArray(len=%d)" % self._length
+
+class LazyMap(_LazyContainer, Mapping):
+    """
+    延遲解碼的 map 檢視。
+    查詢時依序解碼 key 並記錄對應 value 的 offset，找到後即停止，下次查詢再接續；
+    迭代或查詢不存在的 key 時才讀完所有 key。value 在被取用時才解碼。
+    """
+    _offsets = None
+    _scanned = 0   # 已讀取的 key 數
+    _value = None  # 最後讀取的 key 對應 value 的 offset（尚未略過）
+
+    def _index(self, wanted=_NOTHING):
+        """接續讀取 key 直到讀到 wanted（預設讀完全部），回傳 key -> value offset 的 dict"""
+        offsets = self._offsets
+        if offsets is None:
+            offsets = self._offsets = {}
+        elif wanted in offsets:
+            return offsets
+        if self._scanned < self._length:
+            b = self._buf
+            offset = skip(b, self._value) if self._scanned else self._start
+            while True:
+                key, offset = _unpack(b, offset)
+                offsets[key] = offset
+                self._scanned += 1
+                if key == wanted or self._scanned == self._length:
+                    break
+                offset = skip(b, offset)
+            self._value = offset
+        return offsets
+
+    def __getitem__(self, key):
+        return _lazy_at(self._buf, self._index(key)[key])
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __contains__(self, key):
+        return key in self._index(key)
+
+    def __repr__(self):
+        return "LazyMap(len=%d)" % self._length
+
+def unpack_lazy(b, check=False):
+    """
+    延遲解碼：容器回傳 LazyMap/LazyArray 檢視，只有實際取用的部分才會被解碼，
+    工作量與存取路徑上略過的資料量成正比。
+    b 可為任何支援 buffer protocol 的物件，檢視會持有其參考。
+    check: 為 True 時先略過整份文件，確認資料完整且沒有多餘的 bytes（成本與文件大小成正比）；
+    預設不檢查，損毀的部分在存取到時才拋出錯誤。
+    """
+    b = _as_memoryview(b)
+    if check and skip(b, 0) != len(b):
+        raise ValueError("Extra bytes found")
+    return _lazy_at(b, 0)
+
+def get(b, *path, offset=0):
+    """
+    依路徑直接取出值，例如 get(buf, "users", 3, "name")。
+    沿路只解碼 map 的 key，其他 value 與 array 元素一律略過，
+    工作量與路徑上的容器寬度成正比，與整份文件大小無關。
+    找不到時拋出 KeyError 或 IndexError。
+    """
+    if not isinstance(b, bytes):
+        b = _as_memoryview(b)
+    for step in path:
+        if offset >= len(b):
+            raise OutOfData("Unexpected end of data", offset + 1)
+        header = _container_header(b, offset)
+        if header is None:
+            raise TypeError("Cannot index into a non-container value at offset %d" % offset)
+        is_map, length, offset = header
+        if is_map:
+            for _ in range(length):
+                key, offset = _unpack(b, offset)
+                if key == step:
+                    break
+                offset = skip(b, offset)
+            else:
+                raise KeyError(step)
+        else:
+            if type(step) is not int:
+                raise TypeError("Array index must be int, not " + type(step).__name__)
+            index = step + length if step < 0 else step
+            if not 0 <= index < length:
+                raise IndexError("Array index out of range: %d" % step)
+            for _ in range(index):
+                offset = skip(b, offset)
+    return _unpack(b, offset)[0]
+
+# ---- 平行解碼 ----
+
+def scan_records(b, batch_bytes=4 * 1024 * 1024):
+    """
+    以 skip() 掃描串接在一起的多筆紀錄，不建立任何物件。
+    每累積約 batch_bytes 的資料就產生一組 (start, end, count)，
+    start/end 必定落在紀錄邊界上。
+    """
+    size = len(b)
+    start = offset = 0
+    count = 0
+    while offset < size:
+        offset = skip(b, offset)
+        count += 1
+        if offset - start >= batch_bytes:
+            yield start, offset, count
+            start = offset
+            count = 0
+    if count:
+        yield start, offset, count
+
+def _decode_range(path, start, end):
+    """子行程：map 同一個檔案並解碼 [start, end) 範圍內的紀錄"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _decode_records(mm, start, end)
+
+def _decode_records(b, start, end):
+    result = []
+    append = result.append
+    offset = start
+    while offset < end:
+        obj, offset = _unpack(b, offset)
+        append(obj)
+    return result
+
+def unpack_file(path, workers=None, batch_bytes=4 * 1024 * 1024, ordered=True):
+    """
+    平行解碼一個由多筆 MessagePack 紀錄串接而成的檔案，逐筆產生解碼結果。
+
+    先在主行程以 skip() 掃描紀錄邊界並切成約 batch_bytes 的區段，
+    再交給 ProcessPoolExecutor；每個子行程各自 mmap 同一個檔案並解碼自己的區段。
+    workers: 子行程數（預設為 CPU 數）；為 1 時直接在目前行程解碼。
+    ordered: 為 True 時依檔案中的順序產生結果；為 False 時哪個區段先完成就先產生。
+    同時進行中的區段數限制在 workers 的兩倍，記憶體用量不隨檔案大小成長。
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ranges = scan_records(mm, batch_bytes)
+            if workers <= 1:
+                for start, end, _ in ranges:
+                    yield from _decode_records(mm, start, end)
+                return
+            executor = ProcessPoolExecutor(workers)
+            try:
+                pending = deque()
+                for start, end, _ in ranges:
+                    pending.append(executor.submit(_decode_range, path, start, end))
+                    while len(pending) >= workers * 2:
+                        yield from _drain(pending, ordered)
+                while pending:
+                    yield from _drain(pending, ordered)
+            finally:
+                executor.shutdown(cancel_futures=True)
+
+def _drain(pending, ordered):
+    """取出一個完成的區段結果：依序模式取最早送出的，否則取任一個已完成的"""
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    future = done.pop()
+    pending.remove(future)
+    return future.result()
+
+# ---- 紀錄檔 ----
+# 資料檔為多筆 MessagePack 紀錄直接串接（與 unpack_file()、Unpacker 相容），
+# 另有同名加上 ".idx" 的索引檔，依序存放每筆紀錄起點的 uint64（big-endian）。
+# 寫入時先寫資料再寫索引；中途當機時，開啟檔案會從索引最後一筆往後掃描補齊，
+# 並截掉資料檔尾端不完整的紀錄。
+
+def _index_path(path):
+    return path + ".idx"
+
+def _read_index(path):
+    """讀取索引檔，回傳 array("Q")；不存在時回傳空陣列，尾端不完整的項目忽略"""
+    offsets = array("Q")
+    try:
+        with open(_index_path(path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return offsets
+    offsets.frombytes(data[:len(data) - len(data) % _S_UINT64.size])
+    if _SWAP_BYTES:
+        offsets.byteswap()
+    return offsets
+
+def _write_index(path, offsets):
+    """以暫存檔寫入後取代的方式更新索引檔，過程中當機不會留下半份索引"""
+    data = array("Q", offsets)
+    if _SWAP_BYTES:
+        data.byteswap()
+    tmp = _index_path(path) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _index_path(path))
+
+def _repair_offsets(b, offsets):
+    """
+    讓 offsets 與資料 b 一致：去掉超出資料的項目，並從最後一筆（重新驗證）
+    往後掃描補上索引遺漏的紀錄。回傳最後一筆完整紀錄的結尾。
+    索引正確時只需略過最後一筆紀錄，成本與檔案大小無關。
+    """
+    size = len(b)
+    valid = 0
+    previous = -1
+    for valid, offset in enumerate(offsets):
+        if offset >= size or offset <= previous:
+            break
+        previous = offset
+    else:
+        valid = len(offsets)
+    del offsets[valid:]
+    offset = offsets.pop() if offsets else 0
+    while offset < size:
+        try:
+            end = skip(b, offset)
+        except OutOfData:
+            break
+        offsets.append(offset)
+        offset = end
+    return offset
+
+def rebuild_index(path):
+    """
+    由資料檔完整掃描重建索引檔，回傳紀錄數。
+    資料檔尾端不完整的紀錄不列入索引（資料檔本身不修改）。
+    """
+    offsets = array("Q")
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                _repair_offsets(mm, offsets)
+    _write_index(path, offsets)
+    return len(offsets)
+
+class RecordWriter:
+    """
+    附加寫入的紀錄檔：append() 將一筆物件編碼後寫到資料檔尾端並記錄其 offset。
+    開啟既有的檔案時會先修復索引（見本節開頭說明），再接著往後寫。
+    pack_options 同 Packer。可作為 context manager 使用。
+    """
+    def __init__(self, path, **pack_options):
+        self.path = path
+        self._packer = Packer(**pack_options)
+        with open(path, "ab+") as f:
+            size = os.fstat(f.fileno()).st_size
+            offsets = _read_index(path)
+            stored = array("Q", offsets)
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    end = _repair_offsets(mm, offsets)
+            else:
+                end = 0
+                del offsets[:]
+            if end != size:
+                f.truncate(end)
+        try:
+            index_size = os.path.getsize(_index_path(path))
+        except FileNotFoundError:
+            index_size = -1
+        if offsets != stored or index_size != len(offsets) * _S_UINT64.size:
+            _write_index(path, offsets)
+        self._count = len(offsets)
+        self._offset = end
+        self._data = open(path, "ab")
+        self._index = open(_index_path(path), "ab")
+
+    def __len__(self):
+        return self._count
+
+    def append(self, obj):
+        """寫入一筆紀錄，回傳其索引"""
+        packed = self._packer.pack(obj)
+        self._data.write(packed)
+        self._index.write(_S_UINT64.pack(self._offset))
+        self._offset += len(packed)
+        self._count += 1
+        return self._count - 1
+
+    def extend(self, objs):
+        for obj in objs:
+            self.append(obj)
+
+    def flush(self, fsync=False):
+        """先寫出資料再寫出索引；fsync 為 True 時並確保寫入磁碟"""
+        for f in (self._data, self._index):
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self):
+        if not self._data.closed:
+            self.flush()
+            self._data.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class RecordReader(Sequence):
+    """
+    以 mmap 讀取紀錄檔：len()、reader[i]、reader[i:j] 與迭代。
+    依索引直接定位，隨機讀取的成本與檔案大小無關；
+    迭代時直接在 mmap 上依序解碼，不需每筆紀錄一次系統呼叫。
+    索引不存在或與資料不一致（例如寫入中途當機）時，只在記憶體中修復，不寫回檔案。
+    解碼選項同 unpack()；zero_copy 模式回傳的 memoryview 釋放前無法 close()。
+    """
+    def __init__(self, path, zero_copy=False, max_depth=DEFAULT_MAX_DEPTH, key_cache=None,
+                 record_classes=None, strings="str", library_exts=False):
+        self.path = path
+        self._offsets = _read_index(path)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mm = b""
+        self._end = _repair_offsets(self._mm, self._offsets)
+        self._b, self._options = _decode_options(self._mm, zero_copy, max_depth, key_cache,
+                                                 record_classes=record_classes, strings=strings,
+                                                 library_exts=library_exts)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(i) for i in range(*index.indices(len(self._offsets)))]
+        if index < 0:
+            index += len(self._offsets)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError("record index out of range")
+        return self._decode(index)
+
+    def _decode(self, index):
+        obj, _ = _unpack(self._b, self._offsets[index], *self._options)
+        return obj
+
+    def __iter__(self):
+        b = self._b
+        options = self._options
+        offset = 0
+        end = self._end
+        while offset < end:
+            obj, offset = _unpack(b, offset, *options)
+            yield obj
+
+    def close(self):
+        if isinstance(self._b, memoryview):
+            self._b.release()
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ---- JSON 串流轉換 ----
+# 不建立完整的物件樹：JSON 以 token 為單位讀取並直接寫出 MessagePack，
+# MessagePack 亦逐個值讀取並直接寫出 JSON 文字。記憶體用量取決於巢狀深度、
+# 單一字串/數值的大小與 chunk_size，與整份文件的大小無關。
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_scanstring = json.decoder.scanstring
+_JSON_NUMBER_CHARS = re.compile(r"[-+0-9.eE]*")
+_JSON_LITERALS = {"t": ("true", True), "f": ("false", False), "n": ("null", None),
+                  "N": ("NaN", math.nan), "I": ("Infinity", math.inf)}
+
+class _JsonReader:
+    """從文字檔逐段讀取 JSON，只保留尚未處理的部分"""
+    def __init__(self, src, chunk_size):
+        self._src = src
+        self._chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """讀取更多資料；已讀完時回傳 False。每次至少讀取目前未處理的長度，避免長字串反覆重掃"""
+        if self.eof:
+            return False
+        chunk = self._src.read(max(self._chunk_size, len(self.text) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_char(self):
+        """略過空白並回傳下一個字元（不前進）；已到結尾時回傳空字串"""
+        while True:
+            text = self.text
+            pos = self.pos
+            if pos < len(text) and text[pos] not in " \t\n\r":
+                return text[pos]
+            pos = self.pos = _JSON_WHITESPACE.match(text, pos).end()
+            if pos < len(text):
+                return text[pos]
+            if not self.fill():
+                return ""
+
+    def string(self):
+        while True:
+            try:
+                value, self.pos = _scanstring(self.text, self.pos + 1)
+                return value
+            except ValueError:
+                # 字串（或跳脫序列）被讀取邊界截斷時讀取更多後重試
+                if not self.fill():
+                    raise
+
+    def number(self):
+        # 先確保整段數字字元都已讀入，避免數值被讀取邊界截斷
+        while _JSON_NUMBER_CHARS.match(self.text, self.pos).end() == len(self.text) and self.fill():
+            pass
+        match = json.scanner.NUMBER_RE.match(self.text, self.pos)
+        if match is None:
+            # -Infinity 可能跨越多次讀取，讀到足夠比對的長度（或結尾）為止
+            while len(self.text) - self.pos < 9 and self.fill():
+                pass
+            if self.text.startswith("-Infinity", self.pos):
+                self.pos += 9
+                return -math.inf
+            raise ValueError("Invalid JSON value at %r" % self.text[self.pos:self.pos + 20])
+        integer, frac, exp = match.groups()
+        self.pos = match.end()
+        if frac or exp:
+            return float(integer + (frac or "") + (exp or ""))
+        return int(integer)
+
+    def literal(self):
+        word, value = _JSON_LITERALS.get(self.text[self.pos], (None, None))
+        while word is not None and len(self.text) - self.pos < len(word) and self.fill():
+            pass
+        if word is None or not self.text.startswith(word, self.pos):
+            raise ValueError("Invalid JSON value at %r" % self.text[self.pos:self.pos + 20])
+        self.pos += len(word)
+        return value
+
+class _MsgpackStreamWriter:
+    """
+    寫出 MessagePack 並於容器結束時補上元素數。
+    容器開始時先寫入 32-bit 長度的標頭；結束時若標頭仍在緩衝區中，改寫成最短的標頭
+    （輸出與 pack() 相同），已寫到檔案的標頭則 seek 回去填入長度。
+    輸出不可 seek 時（例如管線），尚未完成的最外層值先寫到暫存檔，完成後再複製到輸出，
+    記憶體用量同樣與文件大小無關。
+    """
+    def __init__(self, out, flush_size):
+        self._flush_size = flush_size
+        self.buf = bytearray()
+        if out.seekable():
+            self._out = out
+            self._dst = None
+            self._origin = out.tell()
+        else:
+            self._out = None    # 需要時才建立的暫存檔
+            self._dst = out
+            self._origin = 0
+        self._base = 0      # buf[0] 在輸出中的位置（相對於開始時）
+        self.open = []      # 尚未結束的容器：[標頭位置, 元素數, 是否為 map]
+
+    def tell(self):
+        return self._base + len(self.buf)
+
+    def begin(self, is_map):
+        self.open.append([self.tell(), 0, is_map])
+        self.buf += b"\xdf\x00\x00\x00\x00" if is_map else b"\xdd\x00\x00\x00\x00"
+
+    def end(self):
+        position, count, is_map = self.open.pop()
+        if position >= self._base:
+            header = bytearray()
+            (_pack_map_header if is_map else _pack_array_header)(header, count)
+            start = position - self._base
+            self.buf[start:start + 5] = header
+        else:
+            self._out.seek(self._origin + position)
+            self._out.write(_S_TAG_UINT32.pack(0xdf if is_map else 0xdd, count))
+            self._out.seek(0, os.SEEK_END)
+
+    def maybe_flush(self):
+        if len(self.buf) >= self._flush_size:
+            self.flush()
+
+    def flush(self):
+        if self._dst is None:
+            self._out.write(self.buf)
+        elif self.open:
+            # 最外層的值尚未完成：先寫到暫存檔，之後仍可 seek 回去填入標頭
+            if self._out is None:
+                self._out = tempfile.TemporaryFile()
+                self._origin = -self._base
+            self._out.write(self.buf)
+        else:
+            # 最外層的值皆已完成：依序寫出暫存檔與緩衝區的內容
+            if self._out is not None:
+                self._out.seek(0)
+                shutil.copyfileobj(self._out, self._dst)
+                self._out.close()
+                self._out = None
+            self._dst.write(self.buf)
+        self._base += len(self.buf)
+        del self.buf[:]
+
+def json_to_msgpack(src, dst, chunk_size=64 * 1024, callback=None):
+    """
+    將文字檔 src 中的 JSON 值（可以是多個，以空白或換行分隔，例如 NDJSON）
+    依序轉為串接的 MessagePack 寫入二進位檔 dst，回傳值的個數。
+    不建立 Python 物件樹，記憶體用量與文件大小無關；dst 不可 seek 時未完成的大型值暫存於暫存檔。
+    結果與 pack(json.loads(...)) 相同，跨越寫出邊界的大型容器則使用 32-bit 長度的標頭。
+    callback: 選用，每完成一個最上層的值以 (編碼後 bytes 數) 呼叫。
+    """
+    reader = _JsonReader(src, chunk_size)
+    writer = _MsgpackStreamWriter(dst, chunk_size)
+    count = 0
+    while reader.next_char():
+        start = writer.tell()
+        _transcode_json_value(reader, writer)
+        count += 1
+        if callback is not None:
+            callback(writer.tell() - start)
+        writer.maybe_flush()
+    writer.flush()
+    return count
+
+def _transcode_json_value(reader, writer):
+    """讀取一個完整的 JSON 值並寫出；巢狀容器以 writer.open 作為堆疊"""
+    buf = writer.buf
+    open_containers = writer.open
+    expect_key = False
+    while True:
+        c = reader.next_char()
+        if expect_key:
+            # map 中的 key（或空 map 的結尾已在開始時處理）
+            if c != '"':
+                raise ValueError("Expected JSON object key at %r" % reader.text[reader.pos:reader.pos + 20])
+            open_containers[-1][1] += 1
+            _pack_str(buf, reader.string())
+            if reader.next_char() != ":":
+                raise ValueError("Expected ':' after JSON object key")
+            reader.pos += 1
+            expect_key = False
+            continue
+        if open_containers and not open_containers[-1][2]:
+            open_containers[-1][1] += 1
+        if c == "{" or c == "[":
+            reader.pos += 1
+            is_map = c == "{"
+            writer.begin(is_map)
+            if reader.next_char() == ("}" if is_map else "]"):
+                reader.pos += 1
+                writer.end()
+            else:
+                expect_key = is_map
+                continue
+        elif c == '"':
+            _pack_str(buf, reader.string())
+        elif c == "-" or "0" <= c <= "9":
+            value = reader.number()
+            (_pack_float if type(value) is float else _pack_int)(buf, value)
+        elif c:
+            value = reader.literal()
+            if value is None:
+                _pack_nil(buf, value)
+            elif type(value) is bool:
+                _pack_bool(buf, value)
+            else:
+                _pack_float(buf, value)
+        else:
+            raise OutOfData("Unexpected end of JSON input")
+        # 一個值結束：處理其後的 ',' 或容器結尾
+        while True:
+            if not open_containers:
+                return
+            c = reader.next_char()
+            is_map = open_containers[-1][2]
+            if c == ",":
+                reader.pos += 1
+                expect_key = is_map
+                break
+            if c == ("}" if is_map else "]"):
+                reader.pos += 1
+                writer.end()
+                continue
+            if not c:
+                raise OutOfData("Unexpected end of JSON input")
+            raise ValueError("Expected ',' or closing bracket at %r" % reader.text[reader.pos:reader.pos + 20])
+        writer.maybe_flush()
+
+def _json_float(value):
+    if value != value:
+        return "NaN"
+    if value == math.inf:
+        return "Infinity"
+    if value == -math.inf:
+        return "-Infinity"
+    return float.__repr__(value)
+
+def _json_scalar(value, is_key):
+    """以 json.dumps(ensure_ascii=False) 的格式輸出純量；map key 依 json 的規則轉為字串"""
+    t = type(value)
+    if t is str:
+        return json.encoder.encode_basestring(value)
+    if value is None:
+        text = "null"
+    elif t is bool:
+        text = "true" if value else "false"
+    elif t is int:
+        text = int.__repr__(value)
+    elif t is float:
+        text = _json_float(value)
+    elif is_key:
+        raise TypeError("keys must be str, int, float, bool or None, not %s" % t.__name__)
     else:
-        raise ValueError("Unknown byte code: 0x%x at offset %d" % (first, offset))
+        raise TypeError("Object of type %s is not JSON serializable" % t.__name__)
+    return '"' + text + '"' if is_key else text
+
+def _stream_container_header(b, offset):
+    """只讀取容器標頭（不檢查元素是否已在緩衝區中），回傳 (長度, 第一個元素的 offset)"""
+    first = b[offset]
+    if first <= 0x9f:
+        return first & 0x0f, offset + 1
+    st = _S_UINT16 if first in (0xdc, 0xde) else _S_UINT32
+    if offset + 1 + st.size > len(b):
+        raise OutOfData("Insufficient bytes for container length", offset + 1 + st.size)
+    return st.unpack_from(b, offset + 1)[0], offset + 1 + st.size
+
+class _MsgpackStreamReader:
+    """從二進位檔逐段讀取 MessagePack，逐個 token（純量或容器標頭）解碼"""
+    def __init__(self, src, chunk_size):
+        self._src = src
+        self._chunk_size = chunk_size
+        self._buf = bytearray()
+        self._pos = 0
+        self._consumed = 0   # 已從緩衝區移除的 bytes 數
+        self._eof = False
+
+    def offset(self):
+        return self._consumed + self._pos
+
+    def _fill(self, needed):
+        if self._eof:
+            return False
+        chunk = self._src.read(max(self._chunk_size, needed - self._pos))
+        if not chunk:
+            self._eof = True
+            return False
+        self._consumed += self._pos
+        del self._buf[:self._pos]
+        self._pos = 0
+        self._buf += chunk
+        return True
+
+    def at_end(self):
+        return self._pos >= len(self._buf) and not self._fill(self._pos + 1)
+
+    def token(self):
+        """回傳 (種類, 值)；容器的值為其長度"""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            try:
+                if pos >= len(buf):
+                    raise OutOfData("Unexpected end of data", pos + 1)
+                kind = _KIND[buf[pos]]
+                if kind:
+                    value, self._pos = _stream_container_header(buf, pos)
+                else:
+                    value, self._pos = _DISPATCH[buf[pos]](buf, pos)
+                return kind, value
+            except OutOfData as e:
+                if not self._fill(e.needed):
+                    raise OutOfData("Unexpected end of stream", self._consumed + e.needed)
+
+def msgpack_to_json(src, dst, chunk_size=64 * 1024, callback=None):
+    """
+    將二進位檔 src 中串接的 MessagePack 值逐一轉為 JSON 文字寫入文字檔 dst，
+    每個值一行（與 json.dumps(obj, ensure_ascii=False) 相同），回傳值的個數。
+    直接由輸入的 bytes 產生文字，不建立容器；bin、ext 等無法以 JSON 表示的值拋出 TypeError。
+    callback: 選用，每完成一個最上層的值以 (讀取的 bytes 數) 呼叫。
+    """
+    reader = _MsgpackStreamReader(src, chunk_size)
+    pieces = []
+    count = 0
+    while not reader.at_end():
+        start = reader.offset()
+        _render_json_value(reader, pieces, dst)
+        pieces.append("\n")
+        count += 1
+        if callback is not None:
+            callback(reader.offset() - start)
+        if len(pieces) >= 4096:
+            dst.write("".join(pieces))
+            pieces.clear()
+    dst.write("".join(pieces))
+    return count
+
+def _render_json_value(reader, pieces, dst):
+    """讀取一個完整的值並將 JSON 文字片段加入 pieces，累積過多時寫出到 dst"""
+    # 每層容器：[是否為 map, 總 token 數（map 為項目數的兩倍）, 已讀取的 token 數]
+    levels = []
+    is_key = False
+    while True:
+        kind, value = reader.token()
+        if kind:
+            if is_key:
+                raise TypeError("keys must be str, int, float, bool or None, not a container")
+            is_map = kind == _MAP
+            pieces.append("{" if is_map else "[")
+            levels.append([is_map, value * 2 if is_map else value, 0])
+        else:
+            pieces.append(_json_scalar(value, is_key))
+            if is_key:
+                pieces.append(": ")
+        # 關閉已完成的容器，並為下一個 token 輸出分隔符號
+        while True:
+            if not levels:
+                return
+            level = levels[-1]
+            if level[2] == level[1]:
+                pieces.append("}" if level[0] else "]")
+                levels.pop()
+                continue
+            index = level[2]
+            level[2] += 1
+            is_key = level[0] and not index & 1
+            if index and (is_key or not level[0]):
+                pieces.append(", ")
+            break
+        if len(pieces) >= 4096:
+            dst.write("".join(pieces))
+            pieces.clear()
@@ -1,3 +1,6 @@
+import io
+import json
+import math
 import unittest
 import struct
 import msgpack_lib
@@ -265,5 +268,1255 @@ class TestMsgPackFormats(unittest.TestCase):
         with self.assertRaises(ValueError):
             msgpack_lib.unpack(b'\xc1')
 
+class TestPacker(unittest.TestCase):
+    # Packer 可重複使用，每次輸出互不影響
+    def test_reuse(self):
+        packer = msgpack_lib.Packer()
+        self.assertEqual(packer.pack([1, 2, 3]), msgpack_lib.pack([1, 2, 3]))
+        self.assertEqual(packer.pack({"a": None}), b'\x81\xa1a\xc0')
+
+    # 編碼失敗後緩衝區需被清空
+    def test_reset_after_error(self):
+        packer = msgpack_lib.Packer()
+        with self.assertRaises(TypeError):
+            packer.pack([1, object()])
+        self.assertEqual(packer.pack(1), b'\x01')
+
+    # 大型巢狀容器結果與逐一編碼後串接相同
+    def test_large_nested(self):
+        rows = [{"id": i, "tags": ["x", "y"], "v": -i} for i in range(20000)]
+        packed = msgpack_lib.pack(rows)
+        expected = b'\xdc' + struct.pack(">H", len(rows)) + b"".join(msgpack_lib.pack(r) for r in rows)
+        self.assertEqual(packed, expected)
+        self.assertEqual(msgpack_lib.unpack(packed), rows)
+
+    # tuple 編碼為 array，bytearray 與 byte 格式的 memoryview 編碼為 bin
+    def test_native_types(self):
+        self.assertEqual(msgpack_lib.pack((1, (2, "a"))), msgpack_lib.pack([1, [2, "a"]]))
+        self.assertEqual(msgpack_lib.pack(bytearray(b"xyz")), b'\xc4\x03xyz')
+        self.assertEqual(msgpack_lib.pack(memoryview(b"xyz")), b'\xc4\x03xyz')
+        self.assertEqual(msgpack_lib.pack(memoryview(b"x" * 300)[::2]), msgpack_lib.pack(b"x" * 150))
+
+    # 子類別依 MRO 使用基底類別的編碼方式
+    def test_subclasses(self):
+        import collections
+        import enum
+        class Color(enum.IntEnum):
+            RED = 1
+            BIG = 1000
+        class Name(str):
+            pass
+        obj = collections.OrderedDict([(Name("c"), [Color.RED, Color.BIG]), ("t", True)])
+        self.assertEqual(msgpack_lib.pack(obj), msgpack_lib.pack({"c": [1, 1000], "t": True}))
+        self.assertEqual(msgpack_lib.pack(msgpack_lib.Ext(5, b"ab")), b'\xd5\x05ab')
+
+    # default 只在每個型別第一次出現時判斷，轉換結果可以是容器
+    def test_default(self):
+        import datetime
+        import unittest.mock
+        packer = msgpack_lib.Packer(default=lambda d: {"iso": d.isoformat()})
+        day = datetime.date(2024, 1, 2)
+        with unittest.mock.patch.object(packer, "_resolve", wraps=packer._resolve) as resolve:
+            self.assertEqual(packer.pack([day, day, day]), msgpack_lib.pack([{"iso": "2024-01-02"}] * 3))
+            self.assertEqual(resolve.call_count, 1)
+        with self.assertRaises(TypeError):
+            msgpack_lib.pack(object(), default=lambda o: o)
+        with self.assertRaises(TypeError):
+            msgpack_lib.pack(object())
+
+class TestDispatch(unittest.TestCase):
+    # 查表解碼需涵蓋所有 256 個前導 byte
+    def test_table_complete(self):
+        self.assertEqual(len(msgpack_lib._DISPATCH), 256)
+        self.assertTrue(all(h is not None for h in msgpack_lib._DISPATCH))
+
+    # 巢狀 map 與各種純量混合解碼
+    def test_nested_map(self):
+        d = {"a": {"b": [1, -1, -33, 300, -40000, 1.5, None, True, b"x", "y" * 40]},
+             "c": {f"k{i}": {"v": i} for i in range(20)}}
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack(d)), d)
+
+    # 長度不足時仍拋出 ValueError
+    def test_truncated(self):
+        for data in [b'\xcd\x01', b'\xde\x00', b'\xc5\x00\x05ab', b'\xd6\x01\x02', b'\x92\x01']:
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(data)
+
+class TestUnpacker(unittest.TestCase):
+    objs = [1, "hello", {"a": [1, 2, {"b": None}]}, b"\x00" * 300, -70000, 2.5, msgpack_lib.Ext(1, b"abc")]
+
+    # 逐 byte 餵入，物件完整時立即取出
+    def test_feed_byte_by_byte(self):
+        unpacker = msgpack_lib.Unpacker()
+        result = []
+        for obj in self.objs:
+            packed = msgpack_lib.pack(obj)
+            for i in range(len(packed)):
+                unpacker.feed(packed[i:i+1])
+                result.extend(unpacker)
+            self.assertEqual(result[-1], obj)
+        self.assertEqual(result, self.objs)
+
+    # 一次餵入多個串接物件
+    def test_feed_concatenated(self):
+        unpacker = msgpack_lib.Unpacker()
+        unpacker.feed(b"".join(msgpack_lib.pack(o) for o in self.objs))
+        self.assertEqual(list(unpacker), self.objs)
+        with self.assertRaises(msgpack_lib.OutOfData):
+            unpacker.unpack()
+
+    # 從檔案以固定大小讀取
+    def test_file_like(self):
+        import io
+        stream = io.BytesIO(b"".join(msgpack_lib.pack(o) for o in self.objs * 10))
+        self.assertEqual(list(msgpack_lib.Unpacker(stream, read_size=7)), self.objs * 10)
+
+    # 檔案結尾有不完整的物件
+    def test_file_truncated(self):
+        import io
+        stream = io.BytesIO(msgpack_lib.pack(1) + msgpack_lib.pack("hello")[:-1])
+        unpacker = msgpack_lib.Unpacker(stream, read_size=2)
+        self.assertEqual(next(unpacker), 1)
+        with self.assertRaises(msgpack_lib.OutOfData):
+            next(unpacker)
+
+    # 大型 bin 在資料到齊前不重試，且已取出的資料會被壓縮移除
+    def test_large_payload_and_compaction(self):
+        unpacker = msgpack_lib.Unpacker()
+        packed = msgpack_lib.pack(b"x" * 100000)
+        unpacker.feed(packed[:10])
+        self.assertEqual(list(unpacker), [])
+        self.assertEqual(unpacker._needed, len(packed))
+        for i in range(10, len(packed), 1000):
+            unpacker.feed(packed[i:i+1000])
+        self.assertEqual(list(unpacker), [b"x" * 100000])
+        for _ in range(1000):
+            unpacker.feed(msgpack_lib.pack("y" * 100))
+            self.assertEqual(next(unpacker), "y" * 100)
+        self.assertLess(len(unpacker._buffer), 1000)
+
+    # 切在多個 chunk 之間的大型陣列只在完整後解碼一次，檢查進度由上次的位置接續
+    def test_split_object_decoded_once(self):
+        from unittest import mock
+        obj = [{"id": i, "tags": ["a", "b"]} for i in range(2000)]
+        packed = msgpack_lib.pack(obj)
+        unpacker = msgpack_lib.Unpacker()
+        result = []
+        with mock.patch.object(msgpack_lib, "_unpack", wraps=msgpack_lib._unpack) as decode:
+            for i in range(0, len(packed), 100):
+                unpacker.feed(packed[i:i+100])
+                result.extend(unpacker)
+                if i + 200 == len(packed) // 100 * 100:
+                    self.assertGreater(unpacker._scan[0], len(packed) // 2)
+        self.assertEqual(result, [obj])
+        self.assertEqual(decode.call_count, 1)
+
+class TestZeroCopy(unittest.TestCase):
+    # zero_copy 模式下 bin/ext 以 memoryview 切片回傳
+    def test_memoryview_slices(self):
+        payload = bytes(range(256)) * 300
+        buf = bytearray(msgpack_lib.pack([payload, msgpack_lib.Ext(3, payload), "s", 1]))
+        result = msgpack_lib.unpack(buf, zero_copy=True)
+        self.assertIsInstance(result[0], memoryview)
+        self.assertIsInstance(result[1].data, memoryview)
+        self.assertIs(result[0].obj, buf)
+        self.assertEqual(result[0], payload)
+        self.assertEqual(result[1], msgpack_lib.Ext(3, payload))
+        self.assertEqual(result[2:], ["s", 1])
+
+    # 預設模式仍回傳 bytes，即使輸入是 memoryview
+    def test_default_copies(self):
+        packed = msgpack_lib.pack({"b": b"abc", "e": msgpack_lib.Ext(1, b"x")})
+        result = msgpack_lib.unpack(memoryview(packed))
+        self.assertIs(type(result["b"]), bytes)
+        self.assertIs(type(result["e"].data), bytes)
+
+    # 從 mmap 解碼大型 bin 時不複製資料
+    def test_mmap(self):
+        import mmap
+        import tempfile
+        import tracemalloc
+        blob = b"\xab" * (8 * 1024 * 1024)
+        with tempfile.TemporaryFile() as f:
+            f.write(msgpack_lib.pack([blob, blob]))
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                tracemalloc.start()
+                result = msgpack_lib.unpack(mm, zero_copy=True)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.assertLess(peak, 1024 * 1024)
+                self.assertEqual(len(result[1]), len(blob))
+                self.assertEqual(result[1][:4], b"\xab" * 4)
+                for view in result:
+                    view.release()
+
+class TestLazy(unittest.TestCase):
+    doc = {"users": [{"name": "u%d" % i, "tags": ["a"] * i, "blob": b"x" * i} for i in range(20)],
+           "meta": {"count": 20, "ok": True}, "pi": 3.5}
+
+    # skip 回傳的 offset 與完整解碼後的 offset 相同
+    def test_skip(self):
+        for obj in [None, 1, -70000, 1.5, "s" * 300, b"b" * 70000, msgpack_lib.Ext(1, b"abc"),
+                    [1, [2, [3, {}]]], self.doc]:
+            packed = msgpack_lib.pack(obj) + b"\xc0"
+            self.assertEqual(msgpack_lib.skip(packed), len(packed) - 1)
+        with self.assertRaises(msgpack_lib.OutOfData):
+            msgpack_lib.skip(msgpack_lib.pack(self.doc)[:-1])
+        with self.assertRaises(ValueError):
+            msgpack_lib.skip(b"\x91\xc1")
+
+    # 延遲檢視的存取結果與完整解碼相同
+    def test_lazy_views(self):
+        lazy = msgpack_lib.unpack_lazy(msgpack_lib.pack(self.doc))
+        self.assertIsInstance(lazy, msgpack_lib.LazyMap)
+        self.assertEqual(len(lazy), 3)
+        users = lazy["users"]
+        self.assertIsInstance(users, msgpack_lib.LazyArray)
+        self.assertEqual(users[3]["name"], "u3")
+        self.assertEqual(users[-1]["blob"], b"x" * 19)
+        self.assertEqual(users[5]["tags"].to_python(), ["a"] * 5)
+        self.assertEqual(lazy["meta"], {"count": 20, "ok": True})
+        self.assertIn("pi", lazy)
+        self.assertEqual(lazy.to_python(), self.doc)
+        self.assertEqual(bytes(lazy["meta"].raw()), msgpack_lib.pack(self.doc["meta"]))
+        with self.assertRaises(KeyError):
+            lazy["missing"]
+
+    # 只略過到所需位置為止的元素與 key，之後存取更後面的位置時接續
+    def test_lazy_incremental(self):
+        packed = msgpack_lib.pack(self.doc)
+        lazy = msgpack_lib.unpack_lazy(packed + b"\xc0")
+        users = lazy["users"]
+        self.assertEqual(lazy._scanned, 1)
+        self.assertEqual(users[3]["name"], "u3")
+        self.assertEqual(len(users._offsets), 4)
+        self.assertEqual([u["name"] for u in users[8:2:-2]], ["u8", "u6", "u4"])
+        self.assertEqual(len(users._offsets), 9)
+        self.assertEqual(list(users)[-1]["name"], "u19")
+        self.assertEqual(lazy["pi"], 3.5)
+        self.assertEqual(list(lazy), ["users", "meta", "pi"])
+        with self.assertRaises(IndexError):
+            users[20]
+        with self.assertRaises(ValueError):
+            msgpack_lib.unpack_lazy(packed + b"\xc0", check=True)
+
+    # 依路徑取值
+    def test_get(self):
+        packed = msgpack_lib.pack(self.doc)
+        self.assertEqual(msgpack_lib.get(packed, "users", 3, "name"), "u3")
+        self.assertEqual(msgpack_lib.get(packed, "users", -1, "tags"), ["a"] * 19)
+        self.assertEqual(msgpack_lib.get(packed, "meta"), self.doc["meta"])
+        self.assertEqual(msgpack_lib.get(bytearray(packed)), self.doc)
+        with self.assertRaises(KeyError):
+            msgpack_lib.get(packed, "users", 0, "missing")
+        with self.assertRaises(IndexError):
+            msgpack_lib.get(packed, "users", 20)
+        with self.assertRaises(TypeError):
+            msgpack_lib.get(packed, "pi", 0)
+
+class TestDeepNesting(unittest.TestCase):
+    # 數十萬層巢狀資料可編碼與解碼，不受遞迴上限影響
+    def test_deep_roundtrip(self):
+        depth = 300000
+        obj = leaf = []
+        for i in range(depth):
+            child = [] if i % 2 else {}
+            if isinstance(leaf, list):
+                leaf.append(child)
+            else:
+                leaf["k"] = child
+            leaf = child
+        packed = msgpack_lib.pack(obj)
+        self.assertEqual(len(packed), depth * 2 + 1)
+        result = msgpack_lib.unpack(packed)
+        for _ in range(depth):
+            result = result[0] if isinstance(result, list) else result["k"]
+        self.assertEqual(result, [])
+
+    # 超過 max_depth 時快速失敗
+    def test_max_depth(self):
+        hostile = b'\x91' * 1000000 + b'\xc0'
+        with self.assertRaises(ValueError):
+            msgpack_lib.unpack(hostile, max_depth=1000)
+        self.assertEqual(msgpack_lib.unpack(b'\x91\x91\xc0', max_depth=2), [[None]])
+        with self.assertRaises(ValueError):
+            msgpack_lib.unpack(b'\x91\x91\xc0', max_depth=1)
+        with self.assertRaises(ValueError):
+            msgpack_lib.Packer(max_depth=2).pack([[[]]])
+
+    # 循環參照在深度上限處被攔下
+    def test_cycle(self):
+        a = []
+        a.append(a)
+        with self.assertRaises(ValueError):
+            msgpack_lib.Packer(max_depth=100).pack(a)
+
+class TestTypedArray(unittest.TestCase):
+    # array.array 以擴充型別整塊編碼並還原為 array.array
+    def test_roundtrip(self):
+        from array import array
+        for typecode in "bBhHiIlLqQfd":
+            arr = array(typecode, [0, 1, 2, 100, 7])
+            packed = msgpack_lib.pack(arr)
+            self.assertIn(packed[0], (0xc7, 0xc8, 0xc9, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8))
+            result = msgpack_lib.unpack(packed, library_exts=True)
+            self.assertIsInstance(result, array)
+            self.assertEqual(result.itemsize, arr.itemsize)
+            self.assertEqual(result.tolist(), arr.tolist())
+
+    # 預設不轉換，應用程式自行使用的 ext 80～83 照常回傳 Ext
+    def test_opt_in(self):
+        from array import array
+        for ext_type in range(80, 84):
+            ext = msgpack_lib.Ext(ext_type, b"\x01\x02\x03")
+            self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack(ext)), ext)
+        packed = msgpack_lib.pack(array("h", [1, 2]))
+        self.assertEqual(msgpack_lib.unpack(packed), msgpack_lib.Ext(msgpack_lib.EXT_TYPED_ARRAY, b"h\x00\x01\x00\x02"))
+        unpacker = msgpack_lib.Unpacker(library_exts=True)
+        unpacker.feed(packed)
+        self.assertEqual(next(unpacker), array("h", [1, 2]))
+
+    # 資料為 big-endian
+    def test_wire_format(self):
+        from array import array
+        packed = msgpack_lib.pack(array("d", [1.5, -2.0]))
+        self.assertEqual(packed, b'\xc7\x11' + struct.pack("b", msgpack_lib.EXT_TYPED_ARRAY) + b'd' + struct.pack(">dd", 1.5, -2.0))
+
+    # 數值 memoryview、巢狀使用與 zero_copy 模式
+    def test_memoryview_and_nested(self):
+        from array import array
+        arr = array("i", range(1000))
+        obj = {"v": memoryview(arr), "w": [array("f", [0.5])]}
+        result = msgpack_lib.unpack(memoryview(msgpack_lib.pack(obj)), zero_copy=True, library_exts=True)
+        self.assertEqual(result["v"], arr)
+        self.assertEqual(result["w"][0].tolist(), [0.5])
+
+    # 互通模式輸出標準 array
+    def test_interop(self):
+        from array import array
+        arr = array("h", [1, -300, 70])
+        packed = msgpack_lib.pack({"a": arr}, typed_arrays=False)
+        self.assertEqual(packed, msgpack_lib.pack({"a": [1, -300, 70]}))
+        with self.assertRaises(TypeError):
+            msgpack_lib.pack(array("u", "ab"))
+
+    # 不合法的資料
+    def test_malformed(self):
+        tag = struct.pack("b", msgpack_lib.EXT_TYPED_ARRAY)
+        for data in [b'\xd4' + tag + b'z', b'\xd5' + tag + b'h\x00', b'\xd4' + tag + b'\x00']:
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(data, library_exts=True)
+
+class TestKeyCache(unittest.TestCase):
+    # 相同的 key 共用同一個 str 物件，並統計命中次數
+    def test_interned_keys(self):
+        rows = [{"name": "n%d" % i, "value": i, 1: None} for i in range(100)]
+        cache = msgpack_lib.KeyCache()
+        result = msgpack_lib.unpack(msgpack_lib.pack(rows), key_cache=cache)
+        self.assertEqual(result, rows)
+        self.assertIs(list(result[0])[0], list(result[99])[0])
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 198)
+        self.assertEqual(len(cache), 2)
+
+    # 快取大小有上限，超過時淘汰舊項目
+    def test_eviction(self):
+        cache = msgpack_lib.KeyCache(max_size=4)
+        d = {"k%d" % i: i for i in range(10)}
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack(d), key_cache=cache), d)
+        self.assertEqual(len(cache), 4)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+    # 長 key、非 key 位置的字串與 zero_copy 模式
+    def test_fallbacks(self):
+        cache = msgpack_lib.KeyCache(max_key_length=8)
+        d = {"x" * 40: "x" * 40, "short": ["short"], "y" * 300: 1}
+        packed = msgpack_lib.pack(d)
+        self.assertEqual(msgpack_lib.unpack(packed, key_cache=cache), d)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(msgpack_lib.unpack(bytearray(packed), zero_copy=True, key_cache=cache), d)
+        self.assertEqual(cache.hits, 1)
+        with self.assertRaises(msgpack_lib.OutOfData):
+            msgpack_lib.unpack(b'\x81\xa5ab', key_cache=cache)
+
+    # Unpacker 在整個串流中共用快取
+    def test_unpacker(self):
+        cache = msgpack_lib.KeyCache()
+        unpacker = msgpack_lib.Unpacker(key_cache=cache)
+        for i in range(50):
+            unpacker.feed(msgpack_lib.pack({"id": i, "tag": "t"}))
+        self.assertEqual([r["id"] for r in unpacker], list(range(50)))
+        self.assertEqual((cache.misses, cache.hits), (2, 98))
+
+class TestTemplate(unittest.TestCase):
+    rows = [{"id": i, "name": "user%d" % i, "score": i * 0.5, "tags": ["a"] * (i % 3), "big": -70000 * i}
+            for i in range(200)]
+
+    # 範本編碼結果與 pack() 完全相同
+    def test_pack_matches_generic(self):
+        template = msgpack_lib.compile_template(self.rows[0])
+        self.assertEqual(template.keys, ("id", "name", "score", "tags", "big"))
+        for row in self.rows[:20]:
+            self.assertEqual(template.pack(row), msgpack_lib.pack(row))
+        self.assertEqual(template.pack_many(self.rows), msgpack_lib.pack(self.rows))
+
+    # 形狀不符時改用一般流程
+    def test_fallback(self):
+        template = msgpack_lib.compile_template(["a", "b"])
+        for obj in [{"b": 1, "a": 2}, {"a": 1}, {"a": 1, "b": 2, "c": 3}, [1, 2], None]:
+            self.assertEqual(template.pack(obj), msgpack_lib.pack(obj))
+            self.assertEqual(template.unpack(msgpack_lib.pack(obj)), obj)
+        mixed = [{"a": 1, "b": 2}, {"b": 1, "a": 2}, {"a": {"x": 1}, "b": [1]}]
+        self.assertEqual(template.unpack_many(template.pack_many(mixed)), mixed)
+
+    # 範本解碼
+    def test_unpack(self):
+        template = msgpack_lib.compile_template(self.rows[0])
+        packed = template.pack_many(self.rows)
+        self.assertEqual(template.unpack_many(packed), self.rows)
+        self.assertEqual(template.unpack_many(bytearray(packed), zero_copy=True), self.rows)
+        self.assertEqual(template.unpack(template.pack(self.rows[5])), self.rows[5])
+
+    # 巢狀容器的 value 同樣使用 key_cache
+    def test_unpack_key_cache(self):
+        import collections
+
+        template = msgpack_lib.compile_template(["a", "b"])
+        cache = msgpack_lib.KeyCache()
+        rows = [{"a": {"x": i}, "b": [{"y": i}]} for i in range(10)]
+        self.assertEqual(template.unpack_many(template.pack_many(rows), key_cache=cache), rows)
+        self.assertEqual((cache.misses, cache.hits), (2, 18))
+        # value 中符合的 map 建立為註冊的類別
+        User = collections.namedtuple("User", "x")
+        result = template.unpack(template.pack(rows[3]), record_classes=msgpack_lib.RecordClasses(User))
+        self.assertEqual(result, {"a": User(3), "b": [{"y": 3}]})
+        result = template.unpack_many(template.pack_many(rows), record_classes=msgpack_lib.RecordClasses(User))
+        self.assertEqual([row["a"] for row in result], [User(i) for i in range(10)])
+        with self.assertRaises(ValueError):
+            template.unpack(template.pack(self.rows[5]) + b"\x00")
+        with self.assertRaises(ValueError):
+            template.unpack(template.pack(self.rows[5])[:-1])
+        with self.assertRaises(ValueError):
+            msgpack_lib.compile_template(["a", "a"])
+
+class TestCompactFloats(unittest.TestCase):
+    # 預設模式輸出不變
+    def test_default_unchanged(self):
+        self.assertEqual(msgpack_lib.pack(1.5), b'\xcb' + struct.pack(">d", 1.5))
+        self.assertEqual(msgpack_lib.pack(3.0), b'\xcb' + struct.pack(">d", 3.0))
+
+    # 可無損轉為 float32 時才使用 float32
+    def test_float32(self):
+        packer = msgpack_lib.Packer(compact_floats=True)
+        for value in [1.5, -0.25, 0.0, -0.0, float("inf"), 3.0]:
+            packed = packer.pack(value)
+            self.assertEqual(packed[0], 0xca)
+            result = msgpack_lib.unpack(packed)
+            self.assertEqual(result, value)
+            self.assertEqual(math.copysign(1, result), math.copysign(1, value))
+        for value in [0.1, 1e300, float("nan")]:
+            self.assertEqual(packer.pack(value)[0], 0xcb)
+        self.assertEqual(packer.bytes_saved, {"float32": 24, "float_as_int": 0})
+        packer.reset_stats()
+        self.assertEqual(packer.bytes_saved["float32"], 0)
+
+    # 整數值的 float 以 int 編碼
+    def test_floats_as_ints(self):
+        packer = msgpack_lib.Packer(compact_floats=True, floats_as_ints=True)
+        self.assertEqual(packer.pack([3.0, -1.0, 70000.0, 0.5, -0.0]),
+                         b'\x95\x03\xff\xce\x00\x01\x11\x70\xca' + struct.pack(">f", 0.5) + b'\xca' + struct.pack(">f", -0.0))
+        self.assertEqual(packer.bytes_saved, {"float32": 8, "float_as_int": 8 + 8 + 4})
+
+    # 範本編碼同樣套用壓縮選項
+    def test_template(self):
+        template = msgpack_lib.compile_template(["x"], compact_floats=True)
+        self.assertEqual(template.pack({"x": 0.5}), b'\x81\xa1x\xca' + struct.pack(">f", 0.5))
+
+class TestParallel(unittest.TestCase):
+    records = [{"id": i, "name": "u%d" % i, "vals": [i, i * 0.5], "blob": b"x" * (i % 50)} for i in range(3000)]
+
+    def write_records(self, tmp):
+        import os
+        path = os.path.join(tmp, "records.mp")
+        packer = msgpack_lib.Packer()
+        with open(path, "wb") as f:
+            for record in self.records:
+                f.write(packer.pack(record))
+        return path
+
+    # 邊界掃描：區段落在紀錄邊界上且涵蓋所有紀錄
+    def test_scan_records(self):
+        data = b"".join(msgpack_lib.pack(r) for r in self.records)
+        ranges = list(msgpack_lib.scan_records(data, batch_bytes=1000))
+        self.assertGreater(len(ranges), 10)
+        self.assertEqual(sum(count for _, _, count in ranges), len(self.records))
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (_, end, _), (start, _, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+
+    # 平行解碼依序或不依序產生所有紀錄
+    def test_unpack_file(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = self.write_records(tmp)
+            self.assertEqual(list(msgpack_lib.unpack_file(path, workers=1, batch_bytes=4096)), self.records)
+            self.assertEqual(list(msgpack_lib.unpack_file(path, workers=2, batch_bytes=4096)), self.records)
+            unordered = list(msgpack_lib.unpack_file(path, workers=2, batch_bytes=4096, ordered=False))
+            self.assertEqual(sorted(r["id"] for r in unordered), list(range(len(self.records))))
+
+    # 空檔案與結尾不完整的檔案
+    def test_edge_cases(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "empty.mp")
+            open(path, "wb").close()
+            self.assertEqual(list(msgpack_lib.unpack_file(path)), [])
+            with open(path, "wb") as f:
+                f.write(msgpack_lib.pack([1, 2, 3])[:-1])
+            with self.assertRaises(msgpack_lib.OutOfData):
+                list(msgpack_lib.unpack_file(path, workers=2))
+
+class TestCommandLine(unittest.TestCase):
+    def run_main(self, *args, stdin=b""):
+        import os
+        import subprocess
+        import sys
+        main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        return subprocess.run([sys.executable, main_py] + list(args), input=stdin,
+                              capture_output=True, check=True).stdout
+
+    # 原本的 hex 用法維持不變
+    def test_hex_roundtrip(self):
+        out = self.run_main("--encode", '{"a": [1, 2]}')
+        self.assertEqual(out.strip(), msgpack_lib.pack({"a": [1, 2]}).hex().encode())
+        self.assertEqual(self.run_main("--decode", out.strip().decode()).strip(), b'{"a": [1, 2]}')
+
+    # NDJSON 串流與原始二進位輸出、檔案輸入輸出
+    def test_ndjson_files(self):
+        import os
+        import tempfile
+        lines = b"".join(b'{"id": %d, "s": "x"}\n' % i for i in range(100))
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "in.ndjson")
+            packed = os.path.join(tmp, "out.mp")
+            with open(src, "wb") as f:
+                f.write(lines)
+            self.run_main("--encode", "--ndjson", "--raw", "-i", src, "-o", packed)
+            with open(packed, "rb") as f:
+                data = f.read()
+            self.assertEqual(data, b"".join(msgpack_lib.pack({"id": i, "s": "x"}) for i in range(100)))
+            self.assertEqual(self.run_main("--decode", "--ndjson", "--raw", "-i", packed), lines)
+            self.assertEqual(self.run_main("--decode", "--ndjson", "--raw", stdin=data), lines)
+            self.assertEqual(self.run_main("--decode", "--ndjson", "--raw", "--jobs", "2", "-i", packed), lines)
+
+    # --stats 於 stderr 輸出統計摘要，stdout 不受影響
+    def test_stats(self):
+        import os
+        import subprocess
+        import sys
+        result = subprocess.run([sys.executable, "main.py", "--encode", "--stats", '{"a": 1}'],
+                                capture_output=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), msgpack_lib.pack({"a": 1}).hex().encode())
+        self.assertIn(b"fixmap", result.stderr)
+
+    # 原始二進位的單一文件改以串流轉換，結果與一般編碼/解碼相同
+    def test_raw_document(self):
+        doc = {"a": [1, 2.5, None, True], "b": {"c": "é"}}
+        packed = self.run_main("--encode", "--raw", stdin=json.dumps(doc).encode())
+        self.assertEqual(packed, msgpack_lib.pack(doc))
+        self.assertEqual(self.run_main("--decode", "--raw", stdin=packed),
+                         (json.dumps(doc, ensure_ascii=False) + "\n").encode())
+
+    # 串流轉換失敗時錯誤訊息寫到 stderr，不混入二進位輸出
+    def test_raw_document_error(self):
+        import os
+        import subprocess
+        import sys
+        main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        for args, stdin in ((["--encode", "--raw"], b'{"a":1} {"b":2}'), (["--decode", "--raw"], b"\x92\x01")):
+            result = subprocess.run([sys.executable, main_py] + args, input=stdin, capture_output=True)
+            self.assertEqual(result.returncode, 1)
+            self.assertNotIn("失敗".encode(), result.stdout)
+            self.assertNotIn("錯誤".encode(), result.stdout)
+            self.assertTrue(result.stderr)
+
+class TestBench(unittest.TestCase):
+    # 小資料量即可跑完所有資料與項目，並回報各項指標
+    def test_run(self):
+        import bench
+        results = bench.run(scale=0.001, repeat=1, min_time=0)
+        self.assertEqual(len(results), len(bench.CORPORA) * len(bench.CASES))
+        for r in results.values():
+            self.assertGreater(r["ops_per_sec"], 0)
+            self.assertGreaterEqual(r["allocs_per_object"], 0)
+
+    # 與基準比較時，只有超過門檻的退步才會被回報
+    def test_compare(self):
+        import bench
+        baseline = {"a/pack": {"ops_per_sec": 100.0}, "b/pack": {"ops_per_sec": 100.0}}
+        results = {"a/pack": {"ops_per_sec": 95.0}, "b/pack": {"ops_per_sec": 80.0}, "c/pack": {"ops_per_sec": 1.0}}
+        self.assertEqual(bench.compare(results, baseline, 0.10), [("b/pack", 100.0, 80.0)])
+
+class TestStats(unittest.TestCase):
+    # 各格式的次數與 bytes 數、最大深度與最大容器
+    def test_formats(self):
+        stats = msgpack_lib.Stats()
+        data = msgpack_lib.pack({"a": [1, "x" * 40, [[]]], "b": list(range(20))}, stats=stats)
+        self.assertEqual(stats.calls["pack"], 1)
+        self.assertEqual(stats.formats["str 8"], [1, 42])
+        self.assertEqual(stats.formats["fixstr"], [2, 4])
+        self.assertEqual(stats.formats["fixarray"], [3, 3])
+        self.assertEqual(stats.formats["array 16"], [1, 3])
+        self.assertEqual(stats.max_depth, 4)
+        self.assertEqual(stats.largest_container, 20)
+        self.assertEqual(sum(size for _, size in stats.formats.values()), len(data))
+
+    # unpack() 與 Unpacker 記錄每個最上層物件，並呼叫 hook
+    def test_unpack_and_hook(self):
+        calls = []
+        stats = msgpack_lib.Stats(hook=lambda *args: calls.append(args))
+        data = msgpack_lib.pack({"k": 1})
+        msgpack_lib.unpack(data, stats=stats)
+        unpacker = msgpack_lib.Unpacker(stats=stats)
+        unpacker.feed(data * 2)
+        self.assertEqual(list(unpacker), [{"k": 1}, {"k": 1}])
+        self.assertEqual(stats.calls["unpack"], 3)
+        self.assertEqual(stats.formats["fixmap"], [3, 3])
+        self.assertEqual([(op, size) for op, size, _ in calls], [("unpack", len(data))] * 3)
+        self.assertIn("fixmap", stats.summary())
+        stats.reset()
+        self.assertEqual(stats.formats, {})
+
+class TestAsync(unittest.TestCase):
+    # 多個並行連線經由本機 TCP 伺服器回傳解碼後的物件，包含需分段讀取的大型物件
+    def test_tcp_echo(self):
+        import asyncio
+
+        async def handle(reader, writer):
+            packer = msgpack_lib.AsyncPacker(writer)
+            async for obj in msgpack_lib.AsyncUnpacker(reader, read_size=4096, offload_bytes=64 * 1024):
+                await packer.pack(obj)
+            writer.close()
+            await writer.wait_closed()
+
+        async def client(port, n):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            records = [{"id": n, "i": i, "s": "x" * i} for i in range(50)] + [{"big": list(range(30000))}]
+            await msgpack_lib.AsyncPacker(writer).pack_many(records, chunk_size=1024)
+            writer.write_eof()
+            received = [obj async for obj in msgpack_lib.AsyncUnpacker(reader, read_size=1000)]
+            writer.close()
+            await writer.wait_closed()
+            return received == records
+
+        async def run():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await asyncio.gather(*(client(port, n) for n in range(50)))
+
+        self.assertTrue(all(asyncio.run(run())))
+
+    # 串流結束在物件中間時拋出 OutOfData；緩衝區中大量物件解碼時會讓出事件迴圈
+    def test_truncated_and_yield(self):
+        import asyncio
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(msgpack_lib.pack(list(range(10))) * 2000 + b"\x92\x01")
+            reader.feed_eof()
+            ticks = []
+            async def ticker():
+                while True:
+                    ticks.append(1)
+                    await asyncio.sleep(0)
+            task = asyncio.ensure_future(ticker())
+            unpacker = msgpack_lib.AsyncUnpacker(reader, read_size=4096)
+            count = 0
+            with self.assertRaises(msgpack_lib.OutOfData):
+                async for obj in unpacker:
+                    count += 1
+            task.cancel()
+            return count, len(ticks)
+
+        count, ticks = asyncio.run(run())
+        self.assertEqual(count, 2000)
+        self.assertGreater(ticks, 0)
+
+class TestRecordFile(unittest.TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "records.mp")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # 附加寫入後以索引隨機讀取、切片與迭代；資料檔與一般串接的紀錄相同
+    def test_write_and_read(self):
+        records = [{"i": i, "s": "x" * (i % 50)} for i in range(1000)]
+        with msgpack_lib.RecordWriter(self.path) as writer:
+            writer.extend(records[:600])
+        with msgpack_lib.RecordWriter(self.path) as writer:
+            self.assertEqual(len(writer), 600)
+            self.assertEqual(writer.append(records[600]), 600)
+            writer.extend(records[601:])
+        with msgpack_lib.RecordReader(self.path) as reader:
+            self.assertEqual(len(reader), 1000)
+            self.assertEqual(reader[0], records[0])
+            self.assertEqual(reader[-1], records[-1])
+            self.assertEqual(reader[10:20:3], records[10:20:3])
+            self.assertEqual(list(reader), records)
+            with self.assertRaises(IndexError):
+                reader[1000]
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"".join(map(msgpack_lib.pack, records)))
+
+    # 寫入中途當機：資料尾端不完整、索引落後或遺失時，讀取與重新開啟皆能修復
+    def test_recovery(self):
+        import os
+        records = list(range(100, 400))
+        with msgpack_lib.RecordWriter(self.path) as writer:
+            writer.extend(records)
+        index_path = self.path + ".idx"
+        with open(index_path, "r+b") as f:
+            f.truncate(8 * 250 + 3)
+        with open(self.path, "ab") as f:
+            f.write(b"\xcd\x01")
+        with msgpack_lib.RecordReader(self.path) as reader:
+            self.assertEqual(list(reader), records)
+            self.assertEqual(reader[299], records[299])
+        with msgpack_lib.RecordWriter(self.path) as writer:
+            self.assertEqual(len(writer), 300)
+            writer.append("next")
+        self.assertEqual(os.path.getsize(index_path), 8 * 301)
+        os.remove(index_path)
+        self.assertEqual(msgpack_lib.rebuild_index(self.path), 301)
+        with msgpack_lib.RecordReader(self.path) as reader:
+            self.assertEqual(reader[-1], "next")
+            self.assertEqual(reader[:300], records)
+
+class TestPackInto(unittest.TestCase):
+    # packed_size 與實際編碼長度相同，包含受選項影響的格式
+    def test_packed_size(self):
+        from array import array
+        objs = [0, -33, 2**40, 1.5, 0.1, "é" * 40, b"x" * 300, (1, [2]), {"a": {"b": None}},
+                msgpack_lib.Ext(3, b"abcd"), array("d", [1.0, 2.0]), memoryview(b"abc"), bytearray(70000)]
+        for obj in objs:
+            for options in ({}, {"compact_floats": True, "floats_as_ints": True}, {"typed_arrays": False}):
+                self.assertEqual(msgpack_lib.packed_size(obj, **options), len(msgpack_lib.pack(obj, **options)))
+        packer = msgpack_lib.Packer(compact_floats=True)
+        packer.packed_size([1.5, 2.5])
+        self.assertEqual(packer.bytes_saved["float32"], 0)
+
+    # 寫入指定 offset 並回傳新的 offset；空間不足時不修改 buffer
+    def test_pack_into(self):
+        buf = bytearray(b"\xff" * 12)
+        offset = msgpack_lib.pack_into([1, "ab"], buf, 2)
+        offset = msgpack_lib.pack_into(None, buf, offset)
+        self.assertEqual(offset, 8)
+        self.assertEqual(bytes(buf), b"\xff\xff\x92\x01\xa2ab\xc0\xff\xff\xff\xff")
+        with self.assertRaises(ValueError):
+            msgpack_lib.pack_into("x" * 10, buf, offset)
+        self.assertEqual(buf[offset:], b"\xff" * 4)
+        self.assertEqual(msgpack_lib.unpack_from(buf, 2), ([1, "ab"], 7))
+        self.assertEqual(msgpack_lib.unpack_from(buf, 7), (None, 8))
+
+    # 透過 shared_memory 由另一個連線寫入並以 zero_copy 讀取
+    def test_shared_memory(self):
+        from multiprocessing import shared_memory
+        obj = {"id": 7, "payload": b"z" * 5000, "tags": ["a", "b"]}
+        producer = shared_memory.SharedMemory(create=True, size=msgpack_lib.packed_size(obj) + 100)
+        try:
+            end = msgpack_lib.pack_into(obj, producer.buf)
+            consumer = shared_memory.SharedMemory(name=producer.name)
+            result, offset = msgpack_lib.unpack_from(consumer.buf, zero_copy=True)
+            self.assertEqual(offset, end)
+            self.assertIsInstance(result["payload"], memoryview)
+            self.assertEqual(result["payload"], obj["payload"])
+            result["payload"].release()
+            self.assertEqual(msgpack_lib.unpack_from(consumer.buf)[0], obj)
+            consumer.close()
+        finally:
+            producer.close()
+            producer.unlink()
+
+class TestLimits(unittest.TestCase):
+    # 宣告大量元素但資料很短的輸入在讀到標頭時立即被拒絕
+    def test_hostile_length(self):
+        import time
+        for data in (b'\xdd\xff\xff\xff\xff\x01', b'\xdf\xff\xff\xff\xff\x01\x01', b'\x91\xdb\xff\xff\xff\xff'):
+            start = time.perf_counter()
+            with self.assertRaises(msgpack_lib.OutOfData):
+                msgpack_lib.unpack(data)
+            with self.assertRaises(msgpack_lib.OutOfData):
+                msgpack_lib.validate(data)
+            self.assertLess(time.perf_counter() - start, 0.1)
+        unpacker = msgpack_lib.Unpacker(limits=msgpack_lib.Limits(max_buffer_size=1024))
+        unpacker.feed(b'\xdd\xff\xff\xff\xff\x01')
+        with self.assertRaises(ValueError) as cm:
+            unpacker.unpack()
+        self.assertNotIsInstance(cm.exception, msgpack_lib.OutOfData)
+
+    # 各格式的長度上限，包含 fix 格式與經由 KeyCache 解碼的 key
+    def test_limits(self):
+        limits = msgpack_lib.Limits(max_str_len=3, max_bin_len=2, max_ext_len=1,
+                                    max_array_len=3, max_map_len=1, max_buffer_size=100)
+        for obj in ("abcd", "x" * 40, b"abc", msgpack_lib.Ext(1, b"ab"), [1, 2, 3, 4],
+                    list(range(20)), {"a": 1, "b": 2}, {"long": 1}, b"x" * 99):
+            data = msgpack_lib.pack(obj)
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(data, limits=limits)
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(data, limits=limits, key_cache=msgpack_lib.KeyCache())
+            with self.assertRaises(ValueError):
+                msgpack_lib.validate(data, limits=limits)
+        obj = {"abc": [b"xy", "z", msgpack_lib.Ext(1, b"a")]}
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack(obj), limits=limits), obj)
+        msgpack_lib.validate(msgpack_lib.pack(obj), limits=limits)
+
+    # validate 檢查格式但不建立物件
+    def test_validate(self):
+        msgpack_lib.validate(msgpack_lib.pack({"a": [1, 2.5, None, {"b": b"x"}], "c": []}))
+        for data in (b'\xc1', b'\x92\x01', b'\x01\x02', b'\xa2\xff\xfe', b'\xd9\x05ab', b''):
+            with self.assertRaises(ValueError):
+                msgpack_lib.validate(data)
+        with self.assertRaises(ValueError):
+            msgpack_lib.validate(b'\x91' * 10 + b'\xc0', max_depth=5)
+
+class TestTranscode(unittest.TestCase):
+    DOCS = [{"a": [1, 2.5, -3, True, None, "é\n\"😀"], "b": {}, "c": [], "d": {"x": {"y": [[], [{}]]}}},
+            [], {}, "s", 1e300, -1.5e-7, 2 ** 63, "x" * 1000, list(range(40)), {"k%d" % i: i for i in range(20)}]
+
+    # JSON 直接轉為 MessagePack，與 pack(json.loads(...)) 相同；讀取邊界可落在任何位置
+    def test_json_to_msgpack(self):
+        text = "\n".join(json.dumps(d) for d in self.DOCS)
+        out = io.BytesIO()
+        self.assertEqual(msgpack_lib.json_to_msgpack(io.StringIO(text), out), len(self.DOCS))
+        self.assertEqual(out.getvalue(), b"".join(msgpack_lib.pack(d) for d in self.DOCS))
+        for chunk_size in (1, 7):
+            out = io.BytesIO()
+            msgpack_lib.json_to_msgpack(io.StringIO(text), out, chunk_size)
+            self.assertEqual(list(msgpack_lib.Unpacker(io.BytesIO(out.getvalue()))), self.DOCS)
+        for chunk_size in (1, 2, 3, 4, 64 * 1024):
+            out = io.BytesIO()
+            msgpack_lib.json_to_msgpack(io.StringIO("[NaN, Infinity, -Infinity]\n-Infinity"), out, chunk_size)
+            self.assertEqual(repr(list(msgpack_lib.Unpacker(io.BytesIO(out.getvalue())))), "[[nan, inf, -inf], -inf]")
+
+    # 寫出後才結束的容器改以 32-bit 長度的標頭補上元素數
+    def test_large_container(self):
+        doc = {"a": list(range(5000)), "b": [{"x": "y" * 10}] * 300}
+        for seekable in (True, False):
+            out = io.BytesIO()
+            out.seekable = lambda: seekable
+            msgpack_lib.json_to_msgpack(io.StringIO(json.dumps(doc)), out, chunk_size=256)
+            self.assertEqual(msgpack_lib.unpack(out.getvalue()), doc)
+
+    # 輸出不可 seek 時，未完成的最外層值寫到暫存檔而非留在記憶體，完成後依序複製到輸出
+    def test_unseekable_spool(self):
+        from unittest import mock
+        docs = [{"a": list(range(5000))}, 1, ["x" * 300] * 50]
+        out = io.BytesIO()
+        out.seekable = lambda: False
+        sizes = []
+        with mock.patch.object(msgpack_lib.tempfile, "TemporaryFile", wraps=msgpack_lib.tempfile.TemporaryFile) as spool:
+            msgpack_lib.json_to_msgpack(io.StringIO("\n".join(map(json.dumps, docs))), out, chunk_size=256,
+                                        callback=lambda size: sizes.append((size, len(out.getvalue()))))
+        self.assertTrue(spool.called)
+        self.assertEqual(list(msgpack_lib.Unpacker(io.BytesIO(out.getvalue()))), docs)
+        # 第一個值完成時大部分已寫到暫存檔，尚未寫到輸出
+        self.assertEqual(sizes[0][1], 0)
+
+    # 格式錯誤或不完整的 JSON
+    def test_invalid_json(self):
+        for text in ('[1, 2', '{"a" 1}', '[1 2]', 'tru', '{"a": }', '"abc', '{1: 2}'):
+            with self.assertRaises(ValueError):
+                msgpack_lib.json_to_msgpack(io.StringIO(text), io.BytesIO())
+
+    # MessagePack 直接轉為 JSON 文字，每個值一行，與 json.dumps 相同（包含 key 的轉換）
+    def test_msgpack_to_json(self):
+        docs = self.DOCS + [{1: 2, None: 3, 2.5: [float("nan")]}]
+        data = b"".join(msgpack_lib.pack(d) for d in docs)
+        for chunk_size in (1, 7, 64 * 1024):
+            out = io.StringIO()
+            self.assertEqual(msgpack_lib.msgpack_to_json(io.BytesIO(data), out, chunk_size), len(docs))
+            self.assertEqual(out.getvalue(), "".join(json.dumps(d, ensure_ascii=False) + "\n" for d in docs))
+
+    # 無法以 JSON 表示的值與不完整的資料
+    def test_msgpack_to_json_errors(self):
+        for obj in (b"x", [msgpack_lib.Ext(1, b"a")], {(1,): 2}):
+            with self.assertRaises(TypeError):
+                msgpack_lib.msgpack_to_json(io.BytesIO(msgpack_lib.pack(obj)), io.StringIO())
+        with self.assertRaises(msgpack_lib.OutOfData):
+            msgpack_lib.msgpack_to_json(io.BytesIO(msgpack_lib.pack([1, 2, 3])[:-1]), io.StringIO())
+
+class TestColumns(unittest.TestCase):
+    RECORDS = [{"id": i, "name": "使用者 %d" % i, "score": i * 0.5, "ok": i % 2 == 0, "big": 2 ** 63 + i,
+                "neg": -i * 1000, "tag": None if i % 3 else "x"} for i in range(50)]
+
+    # unpack(library_exts=True) 還原為原本的 dict list，key 只寫一次因此比逐筆編碼小
+    def test_roundtrip(self):
+        data = msgpack_lib.pack_columns(self.RECORDS)
+        self.assertEqual(msgpack_lib.unpack(data, library_exts=True), self.RECORDS)
+        self.assertLess(len(data), len(msgpack_lib.pack(self.RECORDS)) * 0.7)
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack({"batch": msgpack_lib.pack_columns([])})),
+                         {"batch": msgpack_lib.pack_columns([])})
+        for records in ([], [{}, {}], [{"a": 1}]):
+            self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack_columns(records), library_exts=True), records)
+
+    # 直接回傳各欄：數值欄為 array.array，其他為 list
+    def test_unpack_columns(self):
+        columns = msgpack_lib.unpack_columns(msgpack_lib.pack_columns(iter(self.RECORDS)))
+        self.assertEqual(list(columns), list(self.RECORDS[0]))
+        self.assertEqual(columns["id"].typecode, "B")
+        self.assertEqual(columns["neg"].typecode, "i")
+        self.assertEqual(columns["score"].typecode, "d")
+        for key, column in columns.items():
+            self.assertEqual(list(column), [r[key] for r in self.RECORDS])
+        self.assertIsInstance(columns["name"], list)
+        self.assertIs(columns["ok"][0], True)
+
+    # 只解碼指定的欄位
+    def test_fields(self):
+        from array import array
+        data = msgpack_lib.pack_columns(self.RECORDS)
+        self.assertEqual(msgpack_lib.unpack_columns(data, fields=["score"]),
+                         {"score": array("d", [r["score"] for r in self.RECORDS])})
+        with self.assertRaises(KeyError):
+            msgpack_lib.unpack_columns(data, fields=["missing"])
+
+    # key 不一致的 record、非欄式批次或損毀的資料
+    def test_errors(self):
+        for records in ([{"a": 1}, {"b": 1}], [{"a": 1}, {"a": 1, "b": 2}], [{"a": 1}, [1]]):
+            with self.assertRaises(ValueError):
+                msgpack_lib.pack_columns(records)
+        data = msgpack_lib.pack_columns(self.RECORDS)
+        for bad in (msgpack_lib.pack(self.RECORDS), data[:-1], data + b"\x00", b""):
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack_columns(bad)
+
+    # 欄的內容同樣受 max_depth 與 limits 限制，深度由 ext 所在的位置起算
+    def test_depth_and_limits(self):
+        from array import array
+        deep = []
+        leaf = deep
+        for _ in range(10):
+            leaf.append([])
+            leaf = leaf[0]
+        data = msgpack_lib.pack_columns([{"k": deep}])
+        nested = b"\x91" + data
+        self.assertEqual(msgpack_lib.unpack(data, max_depth=13, library_exts=True), [{"k": deep}])
+        self.assertEqual(msgpack_lib.unpack(nested, max_depth=14, library_exts=True), [[{"k": deep}]])
+        msgpack_lib.validate(nested, max_depth=14, library_exts=True)
+        for check in (lambda: msgpack_lib.unpack(nested, max_depth=13, library_exts=True),
+                      lambda: msgpack_lib.validate(nested, max_depth=13, library_exts=True),
+                      lambda: msgpack_lib.unpack_columns(data, max_depth=12)):
+            with self.assertRaises(ValueError):
+                check()
+        limits = msgpack_lib.Limits(max_array_len=5)
+        for records in ([{"k": [i]} for i in range(50)], [{"k": i} for i in range(50)]):
+            data = msgpack_lib.pack_columns(records)
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(data, limits=limits, library_exts=True)
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack_columns(data, limits=limits)
+        with self.assertRaises(ValueError):
+            msgpack_lib.validate(msgpack_lib.pack_columns([{"k": [i]} for i in range(50)]), limits=limits,
+                                 library_exts=True)
+        with self.assertRaises(ValueError):
+            msgpack_lib.unpack(msgpack_lib.pack(array("q", range(50))), limits=limits, library_exts=True)
+
+class TestRecordClasses(unittest.TestCase):
+    def setUp(self):
+        import collections
+        import dataclasses
+
+        class Point:
+            __slots__ = ("x", "y")
+
+        class Point3(Point):
+            __slots__ = "z"
+
+        @dataclasses.dataclass(frozen=True, slots=True)
+        class Frozen:
+            a: int
+            b: str
+
+        self.Point, self.Point3, self.Frozen = Point, Point3, Frozen
+        self.User = collections.namedtuple("User", "id name tags")
+        self.classes = msgpack_lib.RecordClasses(Point, Point3, Frozen, self.User)
+
+    def unpack(self, obj):
+        return msgpack_lib.unpack(msgpack_lib.pack(obj), record_classes=self.classes)
+
+    # 符合的 map 直接建立為 __slots__ 類別或 namedtuple，key 順序不限，巢狀的 map 亦同
+    def test_records(self):
+        result = self.unpack([{"x": 1, "y": 2.5}, {"z": 3, "x": 1, "y": 2},
+                              {"id": 7, "tags": [{"b": "s", "a": 1}], "name": "n"}])
+        self.assertIsInstance(result[0], self.Point)
+        self.assertEqual((result[0].x, result[0].y), (1, 2.5))
+        self.assertIsInstance(result[1], self.Point3)
+        self.assertEqual((result[1].x, result[1].y, result[1].z), (1, 2, 3))
+        self.assertEqual(result[2], self.User(7, "n", [self.Frozen(1, "s")]))
+
+    # key 集合不符的 map 照常解碼為 dict
+    def test_fallback(self):
+        for obj in ({"x": 1}, {"x": 1, "y": 2, "w": 3}, {"x": 1, "x2": 2}, {"id": 1, "name": 2, "nope": 3}, {"x": 1, 2: 3}, {}):
+            self.assertEqual(self.unpack(obj), obj)
+        result = self.unpack({"y": [1], "w": {"x": 1, "y": 2}})
+        self.assertEqual(result["y"], [1])
+        self.assertIsInstance(result["w"], self.Point)
+        data = msgpack_lib.pack({"x": 1, "y": 2})
+        self.assertEqual(msgpack_lib.unpack(b"\x83" + data[1:] + b"\xa1x\x03", record_classes=self.classes),
+                         {"x": 3, "y": 2})
+
+    # 串流解碼器與紀錄檔讀取同樣支援
+    def test_unpacker(self):
+        data = msgpack_lib.pack({"x": 1, "y": 2}) * 3
+        unpacker = msgpack_lib.Unpacker(record_classes=self.classes)
+        for i in range(len(data)):
+            unpacker.feed(data[i:i + 1])
+        self.assertEqual([(p.x, p.y) for p in unpacker], [(1, 2)] * 3)
+
+    # 不支援的類別與 key 集合相同而無法區分的註冊
+    def test_register_errors(self):
+        class Plain:
+            pass
+
+        class Other:
+            __slots__ = ("x", "w")
+
+        class Same:
+            __slots__ = ("y", "x")
+
+        with self.assertRaises(TypeError):
+            msgpack_lib.RecordClasses(Plain)
+        with self.assertRaises(TypeError):
+            msgpack_lib.RecordClasses(tuple)
+        with self.assertRaises(ValueError):
+            msgpack_lib.RecordClasses(self.Point, Same)
+        with self.assertRaises(ValueError):
+            msgpack_lib.RecordClasses().register(self.Point, fields=("x", "nope"))
+        classes = msgpack_lib.RecordClasses()
+        self.assertIs(classes.register(Other, fields=("w", "x")), Other)
+        self.assertIsInstance(msgpack_lib.unpack(msgpack_lib.pack({"x": 1, "w": 2}), record_classes=classes), Other)
+
+    # 欄位數相同且有共同 key 的類別依 key 集合選擇，與 key 的順序無關
+    def test_shared_fields(self):
+        class A:
+            __slots__ = ("x", "y")
+
+        class B:
+            __slots__ = ("y", "z")
+
+        classes = msgpack_lib.RecordClasses(A, B)
+        for obj, cls in (({"x": 1, "y": 2}, A), ({"y": 1, "x": 2}, A), ({"y": 1, "z": 2}, B), ({"z": 1, "y": 2}, B)):
+            result = msgpack_lib.unpack(msgpack_lib.pack([obj, {"y": [obj]}]), record_classes=classes)
+            self.assertIsInstance(result[0], cls)
+            self.assertIsInstance(result[1]["y"][0], cls)
+            self.assertEqual({name: getattr(result[0], name) for name in cls.__slots__}, obj)
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack({"y": 1, "w": 2}), record_classes=classes), {"y": 1, "w": 2})
+
+    # 私有名稱（依類別改寫）與關鍵字名稱的欄位
+    def test_private_and_keyword_slots(self):
+        class _Foo:
+            __slots__ = ("__x", "y", "class")
+
+        obj = msgpack_lib.unpack(msgpack_lib.pack({"__x": 1, "y": 2, "class": 3}),
+                                 record_classes=msgpack_lib.RecordClasses(_Foo))
+        self.assertIsInstance(obj, _Foo)
+        self.assertEqual((obj._Foo__x, obj.y, getattr(obj, "class")), (1, 2, 3))
+
+    # 退回 dict 時第一個 key 同樣以 key 的解碼表解碼：strings 模式不影響 key，並計入 key_cache
+    def test_fallback_keys(self):
+        class Item:
+            __slots__ = ("name", "value")
+
+        classes = msgpack_lib.RecordClasses(Item)
+        rows = [{"name": "a", "other": "b"}, {"name": "c", "other": "d"}]
+        data = msgpack_lib.pack(rows)
+        for strings in ("raw", "lazy"):
+            result = msgpack_lib.unpack(data, strings=strings, record_classes=classes)
+            self.assertEqual([list(map(type, row)) for row in result], [[str, str]] * 2)
+            self.assertEqual(result[0]["other"], b"b" if strings == "raw" else "b")
+        cache = msgpack_lib.KeyCache()
+        result = msgpack_lib.unpack(data, key_cache=cache, record_classes=classes)
+        self.assertEqual(result, rows)
+        self.assertIs(list(result[0])[0], list(result[1])[0])
+        # 嘗試類別時讀取過的 key 在退回 dict 後重新讀取，同樣經過快取
+        self.assertEqual((cache.misses, cache.hits), (2, 6))
+
+class TestMemo(unittest.TestCase):
+    # 重複出現的容器以快取的 bytes 寫入，輸出與關閉時相同
+    def test_same_output(self):
+        shared = {"table": [1, 2, {"x": (3, "y")}], "name": "共用"}
+        obj = [{"id": i, "config": shared, "pair": shared["table"]} for i in range(20)] + [shared, []]
+        for size in (1, 2, 1024):
+            self.assertEqual(msgpack_lib.pack(obj, memo_size=size), msgpack_lib.pack(obj))
+            self.assertEqual(msgpack_lib.packed_size(obj, memo_size=size), len(msgpack_lib.pack(obj)))
+        cycle = []
+        cycle.append(cycle)
+        with self.assertRaises(ValueError):
+            msgpack_lib.pack(cycle, memo_size=16, max_depth=100)
+
+    # 快取跨 pack() 呼叫保留；修改後需以 invalidate() 或 clear_memo() 移除
+    def test_invalidate(self):
+        shared = {"a": [1, 2]}
+        packer = msgpack_lib.Packer(memo_size=16)
+        for _ in range(3):
+            self.assertEqual(packer.pack([shared]), msgpack_lib.pack([shared]))
+        shared["a"].append(3)
+        self.assertEqual(msgpack_lib.unpack(packer.pack([shared])), [{"a": [1, 2]}])
+        packer.invalidate(shared, shared["a"])
+        self.assertEqual(msgpack_lib.unpack(packer.pack([shared])), [{"a": [1, 2, 3]}])
+        shared["b"] = None
+        packer.pack([shared])
+        packer.clear_memo()
+        self.assertEqual(msgpack_lib.unpack(packer.pack([shared])), [{"a": [1, 2, 3], "b": None}])
+
+    # 快取項目數不超過 memo_size，淘汰最久未使用者
+    def test_lru(self):
+        objs = [[i, i] for i in range(10)]
+        packer = msgpack_lib.Packer(memo_size=4)
+        packer.pack([obj for obj in objs for _ in range(2)])
+        self.assertEqual(len(packer._memo), 4)
+        self.assertEqual(packer.pack(objs * 3), msgpack_lib.pack(objs * 3))
+
+    # 只出現過一次的物件另有上限（預設為 memo_size 的 16 倍）：兩次出現之間隔著超過 memo_size 個
+    # 不同的共用容器時仍會被快取
+    def test_seen_bound(self):
+        objs = [[i, i] for i in range(10)]
+        packer = msgpack_lib.Packer(memo_size=4)
+        self.assertEqual(packer.pack(objs * 2), msgpack_lib.pack(objs * 2))
+        self.assertEqual(list(packer._memo), [id(obj) for obj in objs[6:]])
+        packer = msgpack_lib.Packer(memo_size=4, memo_seen_size=4)
+        packer.pack(objs * 2)
+        self.assertEqual(len(packer._memo), 0)
+        with self.assertRaises(ValueError):
+            msgpack_lib.Packer(memo_size=4, memo_seen_size=0)
+
+class TestStringModes(unittest.TestCase):
+    DATA = msgpack_lib.pack({"name": "héllo", "list": ["a" * 40, "b" * 300, "c" * 70000], "bin": b"x"})
+
+    # raw 模式回傳 UTF-8 bytes（zero_copy 時為 memoryview），key 仍為 str
+    def test_raw(self):
+        obj = msgpack_lib.unpack(self.DATA, strings="raw")
+        self.assertEqual(obj, {"name": "héllo".encode(), "list": [b"a" * 40, b"b" * 300, b"c" * 70000], "bin": b"x"})
+        obj = msgpack_lib.unpack(self.DATA, strings="raw", zero_copy=True, key_cache=msgpack_lib.KeyCache())
+        self.assertIsInstance(obj["name"], memoryview)
+        self.assertEqual(list(obj), ["name", "list", "bin"])
+
+    # lazy 模式與 str 比較、雜湊不需轉換，重新編碼時直接寫出原始 bytes
+    def test_lazy(self):
+        obj = msgpack_lib.unpack(self.DATA, strings="lazy")
+        name = obj["name"]
+        self.assertIsInstance(name, msgpack_lib.LazyStr)
+        self.assertEqual(name, "héllo")
+        self.assertNotEqual(name, "hello")
+        self.assertEqual(str(name), "héllo")
+        self.assertEqual(len(name), 5)
+        self.assertEqual(len(obj["list"][1]), 300)
+        self.assertEqual({name: 1}["héllo"], 1)
+        self.assertEqual(msgpack_lib.pack(obj), self.DATA)
+        self.assertEqual(msgpack_lib.pack(msgpack_lib.unpack(self.DATA, strings="lazy", zero_copy=True)), self.DATA)
+
+    # 無效的 UTF-8 原樣轉送，直到轉為 str 時才拋出錯誤
+    def test_invalid_utf8(self):
+        data = b"\x92\xa2\xff\xfe\x01"
+        with self.assertRaises(UnicodeDecodeError):
+            msgpack_lib.unpack(data)
+        obj = msgpack_lib.unpack(data, strings="lazy")
+        self.assertEqual(msgpack_lib.pack(obj), data)
+        with self.assertRaises(UnicodeDecodeError):
+            str(obj[0])
+
+    # 串流解碼器與不支援的模式
+    def test_unpacker(self):
+        unpacker = msgpack_lib.Unpacker(strings="lazy")
+        unpacker.feed(self.DATA * 2)
+        self.assertEqual([msgpack_lib.pack(obj) for obj in unpacker], [self.DATA] * 2)
+        with self.assertRaises(ValueError):
+            msgpack_lib.unpack(self.DATA, strings="bytes")
+
+class TestDeltaInts(unittest.TestCase):
+    TIMESTAMPS = [1700000000000 + i * 1000 + i * 7919 % 13 for i in range(1000)]
+
+    # 遞增的整數序列以差分編碼，輸出較小且解碼結果相同
+    def test_roundtrip(self):
+        for values in (self.TIMESTAMPS, list(range(5000, 6000)), [-(1 << 63), 0, (1 << 63) - 1] * 4,
+                       [10 ** 12 - i * i for i in range(100)]):
+            packed = msgpack_lib.pack({"t": values}, delta_ints=True)
+            self.assertEqual(msgpack_lib.unpack(packed, library_exts=True), {"t": values})
+            self.assertEqual(msgpack_lib.unpack(packed, zero_copy=True, library_exts=True), {"t": values})
+        self.assertLess(len(msgpack_lib.pack(self.TIMESTAMPS, delta_ints=True)),
+                        len(msgpack_lib.pack(self.TIMESTAMPS)) // 4)
+        # 從 0 開始的計數器：一般編碼中多數的值佔 3 bytes，差分只需 1 byte
+        counter = list(range(1000))
+        self.assertLess(len(msgpack_lib.pack(counter, delta_ints=True)), len(msgpack_lib.pack(counter)) // 2)
+        self.assertEqual(msgpack_lib.unpack(msgpack_lib.pack(tuple(self.TIMESTAMPS), delta_ints=True), library_exts=True),
+                         self.TIMESTAMPS)
+
+    # 不會變小或無法編碼的序列照常寫成 array
+    def test_fallback(self):
+        for values in ([1, 2, 3], list(range(100)), [1, 2.0] * 10, [True] * 20, [2 ** 63 + 5] * 20, [1 << 62, -(1 << 62)] * 10):
+            self.assertEqual(msgpack_lib.pack(values, delta_ints=True), msgpack_lib.pack(values))
+
+    # 整數型別的 array.array 解碼為相同型別的 array
+    def test_array(self):
+        from array import array
+        for typecode in "hIq":
+            arr = array(typecode, range(1000, 1100))
+            obj = msgpack_lib.unpack(msgpack_lib.pack(arr, delta_ints=True), library_exts=True)
+            self.assertEqual((obj.itemsize, obj.tolist()), (arr.itemsize, arr.tolist()))
+        arr = array("d", [1.0] * 20)
+        self.assertEqual(msgpack_lib.pack(arr, delta_ints=True), msgpack_lib.pack(arr))
+
+    # 輸出不會比原本的編碼大：array.array 與 EXT_TYPED_ARRAY 比較，list 與一般 array 比較
+    def test_never_larger(self):
+        import random
+        from array import array
+        arr = array("B", [200, 201] * 500)
+        self.assertEqual(msgpack_lib.pack(arr, delta_ints=True), msgpack_lib.pack(arr))
+        self.assertLess(len(msgpack_lib.pack(arr, delta_ints=True, typed_arrays=False)),
+                        len(msgpack_lib.pack(arr, typed_arrays=False)))
+        rng = random.Random(1)
+        for _ in range(200):
+            start, step, count = rng.randrange(-1 << 40, 1 << 40), rng.randrange(-300, 300), rng.randrange(8, 40)
+            values = [start + i * step + rng.randrange(3) for i in range(count)]
+            for obj in (values, array("q", values)):
+                for typed_arrays in (True, False):
+                    self.assertLessEqual(len(msgpack_lib.pack(obj, delta_ints=True, typed_arrays=typed_arrays)),
+                                         len(msgpack_lib.pack(obj, typed_arrays=typed_arrays)))
+
+    # 與編碼快取並用，以及損毀的資料
+    def test_memo_and_errors(self):
+        obj = [self.TIMESTAMPS, self.TIMESTAMPS, [self.TIMESTAMPS]]
+        self.assertEqual(msgpack_lib.pack(obj, delta_ints=True, memo_size=16), msgpack_lib.pack(obj, delta_ints=True))
+        for data in (b"\x01", b"\x03q\x00" + bytes(8), b"\x01q\x00" + bytes(7), b"\x01q\x00" + bytes(11)):
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(msgpack_lib.pack(msgpack_lib.Ext(msgpack_lib.EXT_DELTA_INTS, data)), library_exts=True)
+
+    # 累加後超出結果型別或 int64 的惡意資料：unpack() 與 validate() 同樣拋出 ValueError
+    def test_overflow(self):
+        import struct
+        for data in (b"\x01bb" + struct.pack(">q", 100) + b"\x64",
+                     b"\x01Q\x00" + struct.pack(">q", (1 << 63) - 1) + b"\xff" * 8,
+                     b"\x02q\x00" + struct.pack(">qq", 0, 1 << 62) + struct.pack(">q", 1 << 62) * 2):
+            packed = msgpack_lib.pack([msgpack_lib.Ext(msgpack_lib.EXT_DELTA_INTS, data)])
+            msgpack_lib.validate(packed)
+            with self.assertRaises(ValueError):
+                msgpack_lib.unpack(packed, library_exts=True)
+            with self.assertRaises(ValueError):
+                msgpack_lib.validate(packed, library_exts=True)
+        packed = msgpack_lib.pack(list(range(1000)), delta_ints=True)
+        msgpack_lib.validate(packed, library_exts=True)
+        with self.assertRaises(ValueError):
+            msgpack_lib.validate(packed, library_exts=True, limits=msgpack_lib.Limits(max_array_len=999))
+
 if __name__ == '__main__':
     unittest.main()